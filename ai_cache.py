@@ -0,0 +1,74 @@
+import hashlib
+import json
+import re
+from cache import AsyncCache
+from config import (
+    DEEPSEEK_MODEL, DEEPSEEK_TEMPERATURE, DEEPSEEK_MAX_TOKENS,
+    AI_CACHE_MEMORY_SIZE, AI_CACHE_TTL, AI_CACHE_MAX_ROWS, logger
+)
+
+# Кэш ответов ИИ: быстрый уровень в памяти (LRU + TTL) и общий уровень в PostgreSQL
+memory_cache = AsyncCache('ai_answers', max_size=AI_CACHE_MEMORY_SIZE, lru=True)
+
+_stats = {'memory_hits': 0, 'db_hits': 0, 'misses': 0}
+
+def normalize_prompt(prompt: str) -> str:
+    """Нормализует вопрос: регистр, ё/е, пробелы и концевая пунктуация"""
+    text = prompt.lower().replace('ё', 'е')
+    text = re.sub(r'\s+', ' ', text).strip()
+    return text.rstrip(' ?!.…')
+
+def make_cache_key(prompt: str) -> str:
+    """Ключ кэша: нормализованный вопрос + параметры модели"""
+    payload = json.dumps({
+        'prompt': normalize_prompt(prompt),
+        'model': DEEPSEEK_MODEL,
+        'temperature': DEEPSEEK_TEMPERATURE,
+        'max_tokens': DEEPSEEK_MAX_TOKENS,
+    }, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+async def get_cached_answer(prompt: str):
+    """Возвращает сохраненный ответ на вопрос или None"""
+    from db import get_cached_ai_answer
+    
+    cache_key = make_cache_key(prompt)
+    answer = memory_cache.get(cache_key)
+    if answer is not None:
+        _stats['memory_hits'] += 1
+        return answer
+    
+    answer = await get_cached_ai_answer(cache_key, AI_CACHE_TTL)
+    if answer is not None:
+        _stats['db_hits'] += 1
+        memory_cache.set(cache_key, answer, AI_CACHE_TTL)
+        return answer
+    
+    _stats['misses'] += 1
+    return None
+
+async def store_answer(prompt: str, answer: str):
+    """Сохраняет ответ в оба уровня кэша"""
+    from db import save_cached_ai_answer
+    
+    cache_key = make_cache_key(prompt)
+    memory_cache.set(cache_key, answer, AI_CACHE_TTL)
+    await save_cached_ai_answer(cache_key, normalize_prompt(prompt), answer)
+
+async def evict_answers():
+    """Очистка кэша в БД по сроку хранения и размеру"""
+    from db import evict_ai_answer_cache
+    
+    removed = await evict_ai_answer_cache(AI_CACHE_TTL, AI_CACHE_MAX_ROWS)
+    if removed:
+        logger.info(f"Кэш ответов ИИ: удалено {removed} записей")
+
+def get_ai_cache_stats() -> dict:
+    """Счетчики попаданий и промахов кэша ответов ИИ"""
+    total = sum(_stats.values())
+    hits = _stats['memory_hits'] + _stats['db_hits']
+    return {
+        **_stats,
+        'memory_size': memory_cache.stats()['size'],
+        'hit_ratio': hits / total if total else 0.0,
+    }
@@ -0,0 +1,65 @@
+import re
+from config import AI_MEMORY_MAX_TURNS, AI_MEMORY_TOKEN_BUDGET, AI_MEMORY_SUMMARY_TOKENS, AI_MEMORY_MAX_REPLY_CHARS
+
+# Память диалога хранится в context.user_data в компактном JSON-совместимом виде:
+# {'turns': [['u', текст], ['a', текст], ...], 'summary': текст}
+MEMORY_KEY = 'ai_memory'
+
+_ROLES = {'u': 'user', 'a': 'assistant'}
+
+def estimate_tokens(text: str) -> int:
+    """Грубая оценка числа токенов (для русского текста ~3 символа на токен)"""
+    return len(text) // 3 + 1
+
+def _compact(text: str, max_chars: int) -> str:
+    """Сжимает пробелы и обрезает текст до max_chars"""
+    text = re.sub(r'\s+', ' ', text).strip()
+    if len(text) > max_chars:
+        text = text[:max_chars].rstrip() + '…'
+    return text
+
+def reset_memory(user_data: dict):
+    """Очищает память диалога пользователя"""
+    user_data.pop(MEMORY_KEY, None)
+
+def get_history_messages(user_data: dict) -> list:
+    """Возвращает историю диалога в формате сообщений chat/completions"""
+    memory = user_data.get(MEMORY_KEY)
+    if not memory:
+        return []
+    
+    messages = []
+    if memory.get('summary'):
+        messages.append({
+            'role': 'system',
+            'content': f"Краткое содержание предыдущей части диалога: {memory['summary']}"
+        })
+    for role, text in memory.get('turns', []):
+        messages.append({'role': _ROLES[role], 'content': text})
+    return messages
+
+def remember_turn(user_data: dict, question: str, answer: str):
+    """Добавляет вопрос и ответ в память, соблюдая лимиты по числу реплик и токенам"""
+    memory = user_data.setdefault(MEMORY_KEY, {'turns': [], 'summary': ''})
+    turns = memory['turns']
+    turns.append(['u', _compact(question, AI_MEMORY_MAX_REPLY_CHARS)])
+    turns.append(['a', _compact(answer, AI_MEMORY_MAX_REPLY_CHARS)])
+    
+    # Старые пары реплик сворачиваем в краткое резюме
+    while len(turns) > 2 and (
+        len(turns) > AI_MEMORY_MAX_TURNS * 2
+        or sum(estimate_tokens(text) for _, text in turns) > AI_MEMORY_TOKEN_BUDGET
+    ):
+        (_, old_question), (_, old_answer) = turns.pop(0), turns.pop(0)
+        memory['summary'] = _append_summary(
+            memory['summary'],
+            f"Вопрос: {_compact(old_question, 150)} Ответ: {_compact(old_answer, 250)}"
+        )
+
+def _append_summary(summary: str, entry: str) -> str:
+    """Добавляет запись в резюме, отбрасывая самые старые записи сверх бюджета"""
+    summary = f"{summary} | {entry}" if summary else entry
+    max_chars = AI_MEMORY_SUMMARY_TOKENS * 3
+    if len(summary) > max_chars:
+        summary = '…' + summary[-max_chars:]
+    return summary
@@ -0,0 +1,142 @@
+import asyncio
+import time
+from collections import deque
+from config import logger, AI_MAX_CONCURRENCY, AI_MAX_PER_USER, AI_QUEUE_STATUS_INTERVAL
+
+class _Ticket:
+    """Ожидающий запрос пользователя"""
+
+    def __init__(self, user_id: int):
+        self.user_id = user_id
+        self.future = asyncio.get_running_loop().create_future()  # True - получен слот, False - заменен новым
+        self.created_at = time.monotonic()
+
+class AIScheduler:
+    """
+    Очередь запросов к ИИ.
+    Одновременно выполняется не больше max_concurrency запросов и не больше
+    max_per_user запросов одного пользователя. Ожидающие пользователи обслуживаются
+    по кругу: у каждого не больше одного ожидающего запроса, а новый вопрос
+    заменяет еще не отправленный.
+    """
+
+    def __init__(self, max_concurrency: int, max_per_user: int = 1):
+        self.max_concurrency = max_concurrency
+        self.max_per_user = max_per_user
+        self._queue = deque()  # user_id в порядке очереди
+        self._pending = {}  # user_id -> _Ticket
+        self._active = {}  # user_id -> число выполняющихся запросов
+        self._in_flight = 0
+        self._changed = None
+        self.granted = 0
+        self.superseded = 0
+        self.max_wait = 0.0
+
+    def _submit(self, user_id: int) -> _Ticket:
+        ticket = _Ticket(user_id)
+        previous = self._pending.get(user_id)
+        if previous is not None:
+            # Новый вопрос занимает место предыдущего в очереди
+            previous.future.set_result(False)
+            self.superseded += 1
+        else:
+            self._queue.append(user_id)
+        self._pending[user_id] = ticket
+        self._dispatch()
+        return ticket
+
+    def _dispatch(self):
+        """Выдает свободные слоты ожидающим пользователям по порядку очереди"""
+        while self._in_flight < self.max_concurrency:
+            user_id = next(
+                (uid for uid in self._queue if self._active.get(uid, 0) < self.max_per_user),
+                None
+            )
+            if user_id is None:
+                break
+
+            self._queue.remove(user_id)
+            ticket = self._pending.pop(user_id)
+            self._active[user_id] = self._active.get(user_id, 0) + 1
+            self._in_flight += 1
+            self.granted += 1
+            self.max_wait = max(self.max_wait, time.monotonic() - ticket.created_at)
+            ticket.future.set_result(True)
+
+        # Будим ожидающих, чтобы они обновили свою позицию
+        if self._changed is not None and not self._changed.done():
+            self._changed.set_result(None)
+        self._changed = None
+
+    def _cancel(self, ticket: _Ticket):
+        if self._pending.get(ticket.user_id) is ticket:
+            del self._pending[ticket.user_id]
+            self._queue.remove(ticket.user_id)
+            self._dispatch()
+
+    def position(self, user_id: int):
+        """Позиция пользователя в очереди (с 1) или None, если он не ждет"""
+        try:
+            return self._queue.index(user_id) + 1
+        except ValueError:
+            return None
+
+    async def acquire(self, user_id: int, on_position=None) -> bool:
+        """
+        Ждет слот для запроса пользователя.
+        on_position(position) вызывается при изменении позиции в очереди,
+        но не чаще AI_QUEUE_STATUS_INTERVAL.
+        Возвращает False, если запрос заменен более новым сообщением пользователя.
+        После успешного ожидания обязательно вызвать release(user_id).
+        """
+        ticket = self._submit(user_id)
+        reported = None
+        reported_at = 0.0
+        try:
+            while not ticket.future.done():
+                position = self.position(user_id)
+                now = time.monotonic()
+                if on_position and position != reported and now - reported_at >= AI_QUEUE_STATUS_INTERVAL:
+                    try:
+                        await on_position(position)
+                    except Exception as e:
+                        logger.warning(f"Не удалось показать позицию в очереди ИИ: {e}")
+                    reported, reported_at = position, now
+                    continue
+
+                if self._changed is None:
+                    self._changed = asyncio.get_running_loop().create_future()
+                await asyncio.wait(
+                    [ticket.future, self._changed],
+                    timeout=AI_QUEUE_STATUS_INTERVAL,
+                    return_when=asyncio.FIRST_COMPLETED
+                )
+        except BaseException:
+            if ticket.future.done() and ticket.future.result():
+                self.release(user_id)
+            else:
+                self._cancel(ticket)
+            raise
+
+        return ticket.future.result()
+
+    def release(self, user_id: int):
+        """Освобождает слот после завершения запроса"""
+        self._in_flight -= 1
+        active = self._active.get(user_id, 0) - 1
+        if active > 0:
+            self._active[user_id] = active
+        else:
+            self._active.pop(user_id, None)
+        self._dispatch()
+
+    def stats(self) -> dict:
+        return {
+            'in_flight': self._in_flight,
+            'queued': len(self._queue),
+            'granted': self.granted,
+            'superseded': self.superseded,
+            'max_wait': self.max_wait,
+        }
+
+ai_scheduler = AIScheduler(AI_MAX_CONCURRENCY, AI_MAX_PER_USER)
@@ -0,0 +1,104 @@
+import bisect
+
+_MIN_ID = float('-inf')
+_MAX_ID = float('inf')
+
+class AlertIndex:
+    """
+    Индекс активных уведомлений в памяти.
+    Для каждой пары (валюта, направление) хранится отсортированный список
+    (порог, id уведомления), поэтому сработавшие уведомления находятся бинарным поиском.
+    """
+    
+    def __init__(self):
+        self._thresholds = {}  # (валюта, направление) -> [(порог, id), ...]
+        self._alerts = {}  # id -> уведомление
+        self._by_user = {}  # user_id -> {id, ...}
+        self.loaded = False
+    
+    def __len__(self):
+        return len(self._alerts)
+    
+    @staticmethod
+    def _record(alert) -> dict:
+        return {
+            'id': alert['id'],
+            'user_id': alert['user_id'],
+            'from_currency': alert['from_currency'],
+            'to_currency': alert['to_currency'],
+            'threshold': float(alert['threshold']),
+            'direction': alert['direction'],
+        }
+    
+    def load(self, alerts):
+        """Полная загрузка индекса из списка активных уведомлений"""
+        self._thresholds = {}
+        self._alerts = {}
+        self._by_user = {}
+        
+        for alert in alerts:
+            record = self._record(alert)
+            self._alerts[record['id']] = record
+            self._by_user.setdefault(record['user_id'], set()).add(record['id'])
+            key = (record['from_currency'], record['direction'])
+            self._thresholds.setdefault(key, []).append((record['threshold'], record['id']))
+        
+        for entries in self._thresholds.values():
+            entries.sort()
+        self.loaded = True
+    
+    def add(self, alert):
+        """Добавление уведомления в индекс"""
+        record = self._record(alert)
+        if record['id'] in self._alerts:
+            self.remove(record['id'])
+        
+        self._alerts[record['id']] = record
+        self._by_user.setdefault(record['user_id'], set()).add(record['id'])
+        key = (record['from_currency'], record['direction'])
+        bisect.insort(self._thresholds.setdefault(key, []), (record['threshold'], record['id']))
+    
+    def remove(self, alert_id: int):
+        """Удаление уведомления из индекса"""
+        record = self._alerts.pop(alert_id, None)
+        if record is None:
+            return
+        
+        user_alerts = self._by_user.get(record['user_id'])
+        if user_alerts is not None:
+            user_alerts.discard(alert_id)
+            if not user_alerts:
+                del self._by_user[record['user_id']]
+        
+        entries = self._thresholds.get((record['from_currency'], record['direction']))
+        if entries:
+            entry = (record['threshold'], alert_id)
+            pos = bisect.bisect_left(entries, entry)
+            if pos < len(entries) and entries[pos] == entry:
+                del entries[pos]
+    
+    def remove_user(self, user_id: int):
+        """Удаление всех уведомлений пользователя из индекса"""
+        for alert_id in list(self._by_user.get(user_id, ())):
+            self.remove(alert_id)
+    
+    def crossed(self, currency: str, rate: float) -> list:
+        """Возвращает уведомления по валюте, условие которых выполнено при данном курсе"""
+        triggered = []
+        
+        # above: срабатывают пороги <= курса (начало списка)
+        above = self._thresholds.get((currency, 'above'))
+        if above:
+            end = bisect.bisect_right(above, (rate, _MAX_ID))
+            triggered.extend(self._alerts[alert_id] for _, alert_id in above[:end])
+        
+        # below: срабатывают пороги >= курса (конец списка)
+        below = self._thresholds.get((currency, 'below'))
+        if below:
+            start = bisect.bisect_left(below, (rate, _MIN_ID))
+            triggered.extend(self._alerts[alert_id] for _, alert_id in below[start:])
+        
+        return triggered
+
+# Общий индекс уведомлений процесса
+alert_index = AlertIndex()
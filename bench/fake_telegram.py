@@ -0,0 +1,210 @@
+"""
+Локальная замена Telegram для нагрузочной проверки бота в режимах polling и webhook.
+
+Сервер отвечает на методы Bot API (getMe, getUpdates, sendMessage, ...) и отдает
+боту синтетические обновления: в режиме polling - через getUpdates, в режиме
+webhook - POST-запросами на вебхук бота с секретным заголовком.
+Задержка считается от отправки обновления до первого ответа бота в тот же чат.
+
+Пример (бот и заглушка в разных терминалах):
+
+    TELEGRAM_BOT_TOKEN=123:bench TELEGRAM_BASE_URL=http://127.0.0.1:8081/bot \\
+    BOT_MODE=webhook WEBHOOK_URL=http://127.0.0.1:8443/telegram WEBHOOK_SECRET=bench \\
+    WEBHOOK_LISTEN=127.0.0.1 python main.py
+
+    python -m bench.fake_telegram --mode webhook --updates 2000 --secret bench
+"""
+import argparse
+import asyncio
+import json
+import time
+from urllib.parse import parse_qs
+
+import httpx
+
+from bench.stats import percentile
+
+BOT_USER = {'id': 1, 'is_bot': True, 'first_name': 'Bench', 'username': 'bench_bot',
+            'can_join_groups': True, 'can_read_all_group_messages': False, 'supports_inline_queries': False}
+
+def make_update(update_id: int, text: str = '/help', user_id: int = None) -> dict:
+    """Сообщение пользователя (по умолчанию каждое обновление - от нового пользователя)"""
+    chat_id = user_id or 100000 + update_id
+    user = {'id': chat_id, 'is_bot': False, 'first_name': f'User{update_id}', 'language_code': 'ru'}
+    message = {
+        'message_id': update_id,
+        'date': int(time.time()),
+        'chat': {'id': chat_id, 'type': 'private', 'first_name': user['first_name']},
+        'from': user,
+        'text': text,
+    }
+    if text.startswith('/'):
+        message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(text.split()[0])}]
+    return {'update_id': update_id, 'message': message}
+
+class FakeTelegram:
+    """Минимальный HTTP-сервер Bot API"""
+
+    def __init__(self):
+        self._updates = []
+        self._has_updates = asyncio.Event()
+        self._message_id = 0
+        self.sent_at = {}  # chat_id -> время отправки обновления
+        self.latencies = []
+        self.calls = {}
+        self.webhook = None
+
+    def push(self, update: dict):
+        self.sent_at[update['message']['chat']['id']] = time.perf_counter()
+        self._updates.append(update)
+        self._has_updates.set()
+
+    async def _get_updates(self, params: dict):
+        offset = int(params.get('offset', 0))
+        timeout = float(params.get('timeout', 0))
+        self._updates = [u for u in self._updates if u['update_id'] >= offset]
+        if not self._updates and timeout:
+            self._has_updates.clear()
+            try:
+                await asyncio.wait_for(self._has_updates.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        limit = int(params.get('limit', 100))
+        return self._updates[:limit]
+
+    def _message(self, params: dict) -> dict:
+        self._message_id += 1
+        chat_id = int(params.get('chat_id', 0))
+        started = self.sent_at.pop(chat_id, None)
+        if started is not None:
+            self.latencies.append(time.perf_counter() - started)
+        return {
+            'message_id': self._message_id,
+            'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'private'},
+            'from': BOT_USER,
+            'text': params.get('text', ''),
+        }
+
+    async def _call(self, method: str, params: dict):
+        self.calls[method] = self.calls.get(method, 0) + 1
+        if method == 'getMe':
+            return BOT_USER
+        if method == 'getUpdates':
+            return await self._get_updates(params)
+        if method == 'setWebhook':
+            self.webhook = params.get('url')
+            return True
+        if method in ('sendMessage', 'editMessageText'):
+            return self._message(params)
+        return True
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                _, path, _ = request_line.decode().split(' ', 2)
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode().partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get('content-length', 0)))
+
+                if 'json' in headers.get('content-type', ''):
+                    params = json.loads(body or b'{}')
+                else:
+                    params = {k: v[0] for k, v in parse_qs(body.decode()).items()}
+
+                method = path.rstrip('/').rsplit('/', 1)[-1]
+                result = await self._call(method, params)
+                payload = json.dumps({'ok': True, 'result': result}).encode()
+                writer.write(
+                    b'HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n'
+                    b'Content-Length: ' + str(len(payload)).encode() + b'\r\n\r\n' + payload
+                )
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+def _report(server: FakeTelegram, mode: str, total: int, elapsed: float) -> dict:
+    answered = len(server.latencies)
+    return {
+        'mode': mode,
+        'updates': total,
+        'answered': answered,
+        'elapsed': round(elapsed, 3),
+        'updates_per_sec': round(answered / elapsed, 1) if elapsed else None,
+        'p50': percentile(server.latencies, 50),
+        'p95': percentile(server.latencies, 95),
+        'p99': percentile(server.latencies, 99),
+        'calls': server.calls,
+    }
+
+async def run(args) -> dict:
+    server = FakeTelegram()
+    tcp_server = await asyncio.start_server(server.handle, args.host, args.port)
+
+    # Ждем, пока бот подключится (getMe при инициализации)
+    while 'getMe' not in server.calls:
+        await asyncio.sleep(0.1)
+    if args.mode == 'webhook':
+        while server.webhook is None:
+            await asyncio.sleep(0.1)
+    await asyncio.sleep(args.warmup)
+
+    started = time.perf_counter()
+    interval = 1 / args.rate if args.rate else 0
+    if args.mode == 'polling':
+        for i in range(1, args.updates + 1):
+            server.push(make_update(i, args.text))
+            if interval:
+                await asyncio.sleep(interval)
+    else:
+        semaphore = asyncio.Semaphore(args.concurrency)
+        headers = {'X-Telegram-Bot-Api-Secret-Token': args.secret}
+        async with httpx.AsyncClient(limits=httpx.Limits(max_connections=args.concurrency)) as client:
+            async def post(update):
+                async with semaphore:
+                    server.sent_at[update['message']['chat']['id']] = time.perf_counter()
+                    await client.post(server.webhook, json=update, headers=headers)
+
+            tasks = []
+            for i in range(1, args.updates + 1):
+                tasks.append(asyncio.create_task(post(make_update(i, args.text))))
+                if interval:
+                    await asyncio.sleep(interval)
+            await asyncio.gather(*tasks)
+
+    deadline = time.perf_counter() + args.timeout
+    while len(server.latencies) < args.updates and time.perf_counter() < deadline:
+        await asyncio.sleep(0.05)
+    elapsed = time.perf_counter() - started
+
+    tcp_server.close()
+    return _report(server, args.mode, args.updates, elapsed)
+
+def main():
+    parser = argparse.ArgumentParser(description="Заглушка Telegram для проверки пропускной способности бота")
+    parser.add_argument('--mode', choices=['polling', 'webhook'], default='polling')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--updates', type=int, default=1000)
+    parser.add_argument('--rate', type=float, default=0, help="обновлений в секунду (0 - без ограничения)")
+    parser.add_argument('--concurrency', type=int, default=40, help="параллельных POST-запросов на вебхук")
+    parser.add_argument('--secret', default='', help="значение WEBHOOK_SECRET бота")
+    parser.add_argument('--text', default='/help')
+    parser.add_argument('--warmup', type=float, default=1.0)
+    parser.add_argument('--timeout', type=float, default=60.0)
+    args = parser.parse_args()
+
+    print(json.dumps(asyncio.run(run(args)), ensure_ascii=False, indent=2))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,156 @@
+"""
+Бенчмарк разбора ответов ЦБ РФ на записанных ответах из bench/fixtures.
+
+Для каждого ответа сравниваются прежний разбор (ElementTree для XML_daily.asp,
+BeautifulSoup html.parser для страницы ключевой ставки) и разбор
+из cbr_parsers.py; выводятся p50/p95/p99 времени разбора,
+размер ответа и ускорение относительно прежнего. Страница ключевой ставки
+сохранена в двух вариантах: прежний запрос с 2020 года и окно последних недель.
+
+    python -m bench.parse_bench
+    python -m bench.parse_bench --iterations 5000 --output parse.json --compare before.json
+"""
+import argparse
+import json
+import os
+import sys
+import time
+import xml.etree.ElementTree as ET
+from datetime import datetime
+
+from bs4 import BeautifulSoup
+
+from bench.stubs import setup_environment
+from bench.stats import summarize, run_metadata, compare, load_results
+
+setup_environment()
+
+from cbr_parsers import parse_daily_rates, parse_key_rate_rows
+from services import CBR_CURRENCY_CODES
+
+FIXTURES_DIR = os.path.join(os.path.dirname(__file__), 'fixtures')
+
+def load_fixture(name: str) -> bytes:
+    with open(os.path.join(FIXTURES_DIR, name), 'rb') as f:
+        return f.read()
+
+def etree_daily_rates(content: bytes, codes: dict) -> tuple:
+    """Прежний разбор XML_daily.asp: полное дерево документа"""
+    root = ET.fromstring(content)
+    cbr_date = root.get('Date', '')
+    rates = {}
+    for valute in root.findall('Valute'):
+        valute_id = valute.get('ID')
+        if valute_id in codes:
+            name = valute.find('Name').text
+            value = float(valute.find('Value').text.replace(',', '.'))
+            nominal = int(valute.find('Nominal').text)
+            if nominal > 1:
+                value = value / nominal
+            rates[codes[valute_id]] = {'value': value, 'name': name, 'nominal': nominal}
+    return rates, cbr_date
+
+def bs4_key_rate(content: bytes) -> tuple:
+    """Прежний разбор страницы ключевой ставки: весь документ в BeautifulSoup"""
+    soup = BeautifulSoup(content, 'html.parser')
+    table = soup.find('table', class_='data')
+    if table:
+        rows = table.find_all('tr')
+        for i in range(1, min(len(rows), 10)):
+            cells = rows[i].find_all('td')
+            if len(cells) >= 2:
+                try:
+                    date_obj = datetime.strptime(cells[0].get_text(strip=True), '%d.%m.%Y')
+                    if date_obj <= datetime.now():
+                        return float(cells[1].get_text(strip=True).replace(',', '.')), date_obj.strftime('%d.%m.%Y')
+                except ValueError:
+                    continue
+    return None
+
+def lxml_key_rate(content: bytes) -> tuple:
+    """Разбор lxml, как в services._latest_key_rate"""
+    today = datetime.now().date()
+    for date, rate in parse_key_rate_rows(content, limit=10):
+        if date <= today:
+            return float(rate), date.strftime('%d.%m.%Y')
+    return None
+
+def cases() -> dict:
+    """Сценарии: 'ответ:разбор' -> (функция без аргументов, размер ответа в байтах)"""
+    daily = load_fixture('cbr_daily.xml')
+    key_rate_full = load_fixture('key_rate_since_2020.html')
+    key_rate_recent = load_fixture('key_rate_recent.html')
+    return {
+        'cbr_daily:etree': (lambda: etree_daily_rates(daily, CBR_CURRENCY_CODES), len(daily)),
+        'cbr_daily:cbr_parsers': (lambda: parse_daily_rates(daily, CBR_CURRENCY_CODES), len(daily)),
+        # Базовый вариант для обоих запросов ключевой ставки - прежний запрос с прежним разбором
+        'key_rate:bs4_since_2020': (lambda: bs4_key_rate(key_rate_full), len(key_rate_full)),
+        'key_rate:lxml_since_2020': (lambda: lxml_key_rate(key_rate_full), len(key_rate_full)),
+        'key_rate:lxml_recent': (lambda: lxml_key_rate(key_rate_recent), len(key_rate_recent)),
+    }
+
+def check_equal(all_cases: dict):
+    """Разборы одного ответа должны давать одинаковый результат"""
+    outputs = {}
+    for name, (call, _) in all_cases.items():
+        payload = name.split(':', 1)[0]
+        result = call()
+        if payload in outputs and outputs[payload] != result:
+            raise SystemExit(f"Результат {name} отличается от других разборов '{payload}'")
+        outputs.setdefault(payload, result)
+
+def run_case(call, iterations: int) -> dict:
+    latencies = []
+    started = time.perf_counter()
+    for _ in range(iterations):
+        call_started = time.perf_counter()
+        call()
+        latencies.append(time.perf_counter() - call_started)
+    return summarize(latencies, time.perf_counter() - started)
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк разбора ответов ЦБ РФ")
+    parser.add_argument('--iterations', type=int, default=2000)
+    parser.add_argument('--warmup', type=int, default=50)
+    parser.add_argument('--filter', action='append', help="запускать только сценарии, содержащие подстроку")
+    parser.add_argument('--output', help="файл для результатов в JSON")
+    parser.add_argument('--compare', help="JSON прошлого запуска для сравнения")
+    args = parser.parse_args()
+
+    all_cases = {
+        name: case for name, case in cases().items()
+        if not args.filter or any(f in name for f in args.filter)
+    }
+    check_equal(all_cases)
+
+    results = {}
+    baselines = {}
+    for name, (call, size) in all_cases.items():
+        payload = name.split(':', 1)[0]
+        run_case(call, args.warmup)
+        result = run_case(call, args.iterations)
+        result['payload_bytes'] = size
+
+        # Первый разбор каждого ответа - базовый для расчета ускорения
+        baseline = baselines.setdefault(payload, result)
+        if baseline['mean_ms'] and result['mean_ms']:
+            result['speedup'] = round(baseline['mean_ms'] / result['mean_ms'], 2)
+        results[name] = result
+        print(f"{name:<32} p50={result['p50_ms']}ms p95={result['p95_ms']}ms "
+              f"x{result.get('speedup')}", file=sys.stderr, flush=True)
+
+    report = {
+        'meta': run_metadata(iterations=args.iterations),
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    else:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+
+    if args.compare:
+        print(compare(report, load_results(args.compare)))
+
+if __name__ == '__main__':
+    main()
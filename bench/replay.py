@@ -0,0 +1,292 @@
+"""
+Нагрузочный прогон: синтетические обновления Telegram через Application из main.py.
+
+Генератор подает обновления (/start, /rates, /alert, нажатия кнопок, вопросы ИИ)
+от N пользователей с заданной частотой прямо в update_queue приложения,
+т.е. через ту же очередь, ограничение параллельности, обработчики и persistence,
+что и в работе. Bot API, внешние сервисы и БД - заглушки из bench.stubs.
+
+Для каждой ступени нагрузки выводятся фактическая пропускная способность,
+распределение задержки (от постановки в очередь до конца обработки)
+и задержка цикла событий. Ступень, на которой пропускная способность
+перестает расти вслед за подаваемой, а задержка резко растет, - точка насыщения.
+
+    python -m bench.replay --rates 50,100,200,400 --duration 20 --users 500
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import random
+import sys
+import time
+
+from bench.stubs import (
+    setup_environment, UpstreamStub, StubBotRequest, FakeDatabase,
+    install_upstream_stubs, install_fake_db, make_callback_update
+)
+from bench.fake_telegram import make_update
+from bench.stats import percentile, summarize, run_metadata
+
+setup_environment()
+
+from telegram import Update
+from telegram.ext import TypeHandler
+from main import build_application
+
+# Сценарии и их веса по умолчанию
+DEFAULT_MIX = {
+    'start': 1,
+    'rates': 3,
+    'keyrate': 1,
+    'crypto': 1,
+    'alert': 1,
+    'myalerts': 1,
+    'button': 4,
+    'ai': 1,
+}
+
+BUTTONS = ['currency_rates', 'crypto_rates', 'key_rate', 'weather', 'my_alerts', 'back_to_main', 'help']
+
+AI_QUESTIONS = [
+    "Что такое ключевая ставка?",
+    "Как инфляция влияет на курс рубля?",
+    "Стоит ли покупать валюту сейчас?",
+    "Объясни, что такое облигации",
+]
+
+def _parse_mix(value: str) -> dict:
+    mix = {}
+    for item in value.split(','):
+        name, _, weight = item.partition('=')
+        if name not in DEFAULT_MIX:
+            raise SystemExit(f"Неизвестный сценарий '{name}', доступны: {', '.join(DEFAULT_MIX)}")
+        mix[name] = float(weight or 1)
+    return mix
+
+class LoopLagMonitor:
+    """Измеряет задержку цикла событий: насколько позже заданного просыпается sleep"""
+
+    def __init__(self, interval: float = 0.01):
+        self.interval = interval
+        self.samples = []
+        self._task = None
+
+    def start(self):
+        self.samples = []
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+
+    async def _run(self):
+        while True:
+            started = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            self.samples.append(max(0.0, time.perf_counter() - started - self.interval))
+
+    def summary(self) -> dict:
+        def ms(value):
+            return round(value * 1000, 3) if value is not None else None
+        return {
+            'p50_ms': ms(percentile(self.samples, 50)),
+            'p99_ms': ms(percentile(self.samples, 99)),
+            'max_ms': ms(max(self.samples) if self.samples else None),
+        }
+
+class Replayer:
+    """Генератор обновлений и учет времени их обработки"""
+
+    def __init__(self, application, users: int, mix: dict, seed: int):
+        self.application = application
+        self.users = [200000 + i for i in range(users)]
+        self.scenarios = list(mix)
+        self.weights = [mix[name] for name in self.scenarios]
+        self.random = random.Random(seed)
+        self.update_ids = itertools.count(1)
+        self.pending = {}  # update_id -> (сценарий, время постановки в очередь)
+        self.latencies = {}  # сценарий -> [задержка, ...]
+        self.completed = 0
+
+        # Последняя группа обработчиков: вызывается после основного обработчика обновления
+        application.add_handler(TypeHandler(Update, self._mark_done), group=1000)
+
+    async def _mark_done(self, update, context):
+        entry = self.pending.pop(update.update_id, None)
+        if entry is None:
+            return
+        scenario, queued_at = entry
+        if scenario == 'ai_enter':
+            # Пользователь вошел в режим ИИ кнопкой - теперь задает вопрос
+            self._enqueue('ai', self._ai_question(next(self.update_ids), update.effective_user.id))
+            return
+        self.latencies.setdefault(scenario, []).append(time.perf_counter() - queued_at)
+        self.completed += 1
+
+    def _ai_question(self, update_id: int, user_id: int) -> dict:
+        return make_update(update_id, self.random.choice(AI_QUESTIONS) + f" #{update_id}", user_id)
+
+    def _enqueue(self, scenario: str, data: dict):
+        """Ставит обновление в очередь из обработчика, не блокируя его при заполненной очереди"""
+        update = Update.de_json(data, self.application.bot)
+        self.pending[update.update_id] = (scenario, time.perf_counter())
+        asyncio.create_task(self.application.update_queue.put(update))
+
+    def _build(self, scenario: str, update_id: int, user_id: int) -> dict:
+        if scenario == 'start':
+            return make_update(update_id, '/start', user_id)
+        if scenario == 'rates':
+            return make_update(update_id, '/rates', user_id)
+        if scenario == 'keyrate':
+            return make_update(update_id, '/keyrate', user_id)
+        if scenario == 'crypto':
+            return make_update(update_id, '/crypto', user_id)
+        if scenario == 'alert':
+            currency = self.random.choice(['USD', 'EUR', 'CNY'])
+            threshold = self.random.randint(70, 120)
+            direction = self.random.choice(['above', 'below'])
+            return make_update(update_id, f'/alert {currency} RUB {threshold} {direction}', user_id)
+        if scenario == 'myalerts':
+            return make_update(update_id, '/myalerts', user_id)
+        if scenario == 'button':
+            return make_callback_update(update_id, self.random.choice(BUTTONS), user_id)
+
+        # Вопрос ИИ: сначала кнопка "Универсальный ИИ" (режим ИИ включает сам бот,
+        # и его же сохраняет persistence), вопрос отправляется после ее обработки.
+        # Задержка сценария считается от постановки вопроса в очередь
+        return make_callback_update(update_id, 'ai_chat', user_id)
+
+    async def feed(self, rate: float, duration: float) -> int:
+        """Подает обновления с постоянной частотой (открытая модель нагрузки)"""
+        sent = 0
+        started = time.perf_counter()
+        while True:
+            elapsed = time.perf_counter() - started
+            if elapsed >= duration:
+                return sent
+
+            # Догоняем расписание, если цикл событий отстал
+            due = int(elapsed * rate) + 1
+            while sent < due:
+                scenario = self.random.choices(self.scenarios, self.weights)[0]
+                update_id = next(self.update_ids)
+                data = self._build(scenario, update_id, self.random.choice(self.users))
+                update = Update.de_json(data, self.application.bot)
+                self.pending[update_id] = ('ai_enter' if scenario == 'ai' else scenario, time.perf_counter())
+                await self.application.update_queue.put(update)
+                sent += 1
+            await asyncio.sleep(max(0.0, (sent / rate) - (time.perf_counter() - started)))
+
+    async def drain(self, timeout: float):
+        deadline = time.perf_counter() + timeout
+        while self.pending and time.perf_counter() < deadline:
+            await asyncio.sleep(0.05)
+
+async def run(args) -> dict:
+    stub = UpstreamStub(
+        latency={name: args.upstream_latency for name in UpstreamStub.PROVIDERS},
+        stream_chunk_delay=args.stream_chunk_delay,
+    )
+    install_upstream_stubs(stub)
+    install_fake_db(FakeDatabase(latency=args.db_latency))
+
+    bot_request = StubBotRequest(latency=args.bot_latency)
+    application = build_application(request=bot_request)
+    replayer = Replayer(application, args.users, _parse_mix(args.mix) if args.mix else DEFAULT_MIX, args.seed)
+    monitor = LoopLagMonitor()
+
+    await application.initialize()
+    await application.start()
+    steps = []
+    try:
+        for rate in [float(r) for r in args.rates.split(',')]:
+            replayer.latencies = {}
+            replayer.completed = 0
+            queue_max = 0
+
+            async def watch_queue():
+                nonlocal queue_max
+                while True:
+                    queue_max = max(queue_max, application.update_queue.qsize())
+                    await asyncio.sleep(0.05)
+
+            watcher = asyncio.create_task(watch_queue())
+            monitor.start()
+            started = time.perf_counter()
+            sent = await replayer.feed(rate, args.duration)
+            await replayer.drain(args.drain_timeout)
+            elapsed = time.perf_counter() - started
+            await monitor.stop()
+            watcher.cancel()
+
+            all_latencies = [value for values in replayer.latencies.values() for value in values]
+            step = {
+                'offered_per_sec': rate,
+                'sent': sent,
+                'completed': replayer.completed,
+                'unfinished': len(replayer.pending),
+                'sustained_per_sec': round(replayer.completed / elapsed, 1),
+                'latency': summarize(all_latencies, elapsed),
+                'loop_lag': monitor.summary(),
+                'queue_max': queue_max,
+                'scenarios': {
+                    name: summarize(values, elapsed) for name, values in sorted(replayer.latencies.items())
+                },
+            }
+            steps.append(step)
+            print(
+                f"offered={rate:g}/s sustained={step['sustained_per_sec']}/s "
+                f"p50={step['latency']['p50_ms']}ms p99={step['latency']['p99_ms']}ms "
+                f"loop_lag_p99={step['loop_lag']['p99_ms']}ms queue_max={queue_max}",
+                file=sys.stderr, flush=True
+            )
+            replayer.pending.clear()
+    finally:
+        await application.stop()
+        await application.shutdown()
+
+    return {
+        'meta': run_metadata(
+            users=args.users,
+            duration=args.duration,
+            mix=_parse_mix(args.mix) if args.mix else DEFAULT_MIX,
+            upstream_latency=args.upstream_latency,
+            bot_latency=args.bot_latency,
+            db_latency=args.db_latency,
+        ),
+        'steps': steps,
+        'bot_api_calls': bot_request.calls,
+        'upstream_requests': stub.requests,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Нагрузочный прогон синтетических обновлений через Application")
+    parser.add_argument('--rates', default='20,50,100,200', help="ступени нагрузки, обновлений/с через запятую")
+    parser.add_argument('--duration', type=float, default=15, help="длительность ступени, сек")
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--mix', help="веса сценариев, например 'rates=3,button=4,ai=1'")
+    parser.add_argument('--upstream-latency', type=float, default=0.05, help="задержка внешних API, сек")
+    parser.add_argument('--stream-chunk-delay', type=float, default=0.02, help="пауза между фрагментами ответа ИИ, сек")
+    parser.add_argument('--bot-latency', type=float, default=0.03, help="задержка Bot API, сек")
+    parser.add_argument('--db-latency', type=float, default=0.002, help="задержка запросов к БД, сек")
+    parser.add_argument('--drain-timeout', type=float, default=30, help="сколько ждать завершения обработки после ступени, сек")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help="файл для результатов в JSON")
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.ERROR)
+    report = asyncio.run(run(args))
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    else:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,236 @@
+"""
+Бенчмарк обработчиков (handlers.py) и сервисов (services.py) на локальных заглушках.
+
+Внешние API отвечают заготовленными данными с заданной задержкой и долей ошибок,
+Bot API и PostgreSQL заменены заглушками в памяти. Для каждого сценария выводятся
+p50/p95/p99 задержки и пропускная способность; результаты в JSON можно сравнить
+с прошлым запуском:
+
+    python -m bench.run_bench --output before.json
+    python -m bench.run_bench --output after.json --compare before.json
+    python -m bench.run_bench --filter handler: --latency 0.1 --latency deepseek=0.8
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import sys
+import time
+
+from bench.stubs import (
+    setup_environment, UpstreamStub, StubBotRequest, FakeDatabase,
+    install_upstream_stubs, install_fake_db, make_callback_update
+)
+from bench.fake_telegram import make_update
+from bench.stats import summarize, run_metadata, compare, load_results
+
+setup_environment()
+
+import handlers
+import services
+from config import TOKEN
+from ai_cache import memory_cache
+from telegram import Update
+from telegram.ext import Application, CallbackContext
+
+def _parse_per_provider(values: list, default: float = 0.0) -> dict:
+    """Разбирает ['0.05', 'deepseek=0.5'] в {провайдер: значение}"""
+    result = {name: default for name in UpstreamStub.PROVIDERS}
+    for value in values or []:
+        if '=' in value:
+            name, number = value.split('=', 1)
+            if name not in result:
+                raise SystemExit(f"Неизвестный провайдер '{name}', доступны: {', '.join(UpstreamStub.PROVIDERS)}")
+            result[name] = float(number)
+        else:
+            result = {name: float(value) for name in result}
+    return result
+
+class Bench:
+    """Сценарии бенчмарка поверх общего Application с заглушками"""
+
+    def __init__(self, application: Application):
+        self.application = application
+        self.update_ids = itertools.count(1)
+
+    def _context(self, update: Update, args: list = None) -> CallbackContext:
+        context = CallbackContext.from_update(update, self.application)
+        if args is not None:
+            context.args = args
+        return context
+
+    def _update(self, data: dict) -> Update:
+        return Update.de_json(data, self.application.bot)
+
+    def command(self, handler, text: str):
+        """Сценарий: команда от нового пользователя"""
+        async def call(_):
+            update = self._update(make_update(next(self.update_ids), text))
+            await handler(update, self._context(update, text.split()[1:]))
+        return call
+
+    def callback(self, data: str):
+        """Сценарий: нажатие inline-кнопки"""
+        async def call(_):
+            update = self._update(make_callback_update(next(self.update_ids), data))
+            await handlers.button_handler(update, self._context(update))
+        return call
+
+    def ai_message(self, repeat_prompt: bool):
+        """Сценарий: вопрос ИИ (уникальный или повторяющийся, т.е. из кэша ответов)"""
+        async def call(i):
+            update_id = next(self.update_ids)
+            prompt = "Что такое ключевая ставка?" if repeat_prompt else f"Вопрос номер {update_id}: что такое ключевая ставка?"
+            update = self._update(make_update(update_id, prompt))
+            context = self._context(update)
+            context.user_data['ai_mode'] = True
+            await handlers.handle_ai_message(update, context)
+        return call
+
+    def cases(self) -> dict:
+        async def currency_rates_cold(_):
+            services.rates_cache.invalidate()
+            await services.get_currency_rates_with_tomorrow()
+
+        async def ask_deepseek(i):
+            await services.ask_deepseek(f"Вопрос {i}")
+
+        async def ask_deepseek_stream(i):
+            async for _ in services.ask_deepseek_stream(f"Вопрос {i}"):
+                pass
+
+        return {
+            'service:get_currency_rates_with_tomorrow': currency_rates_cold,
+            'service:get_key_rate': lambda _: services.get_key_rate(),
+            'service:scrape_key_rate': lambda _: services.scrape_key_rate(),
+            'service:get_key_rate_html': lambda _: services.get_key_rate_html(),
+            'service:get_key_rate_api': lambda _: services.get_key_rate_api(),
+            'service:get_crypto_rates': lambda _: services.get_crypto_rates(),
+            'service:get_weather_moscow': lambda _: services.get_weather_moscow(),
+            'service:ask_deepseek': ask_deepseek,
+            'service:ask_deepseek_stream': ask_deepseek_stream,
+            'handler:/start': self.command(handlers.start, '/start'),
+            'handler:/help': self.command(handlers.help_command, '/help'),
+            'handler:/rates': self.command(handlers.show_currency_rates, '/rates'),
+            'handler:/keyrate': self.command(handlers.show_key_rate, '/keyrate'),
+            'handler:/crypto': self.command(handlers.show_crypto_rates, '/crypto'),
+            'handler:/weather': self.command(handlers.show_weather, '/weather'),
+            'handler:/alert': self.command(handlers.alert_command, '/alert USD RUB 100 above'),
+            'handler:/myalerts': self.command(handlers.myalerts_command, '/myalerts'),
+            'handler:button:currency_rates': self.callback('currency_rates'),
+            'handler:button:back_to_main': self.callback('back_to_main'),
+            'handler:ai_message': self.ai_message(repeat_prompt=False),
+            'handler:ai_message_cached': self.ai_message(repeat_prompt=True),
+        }
+
+async def run_case(call, iterations: int, concurrency: int) -> dict:
+    """Выполняет сценарий iterations раз в concurrency параллельных потоков"""
+    latencies = []
+    errors = 0
+    counter = itertools.count()
+
+    async def worker():
+        nonlocal errors
+        for i in counter:
+            if i >= iterations:
+                return
+            started = time.perf_counter()
+            try:
+                await call(i)
+            except Exception as e:
+                errors += 1
+                logging.getLogger('bench').error(f"Ошибка в сценарии: {e!r}")
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return summarize(latencies, time.perf_counter() - started, errors)
+
+async def run(args) -> dict:
+    stub = UpstreamStub(
+        latency=_parse_per_provider(args.latency),
+        failure_rate=_parse_per_provider(args.failure_rate),
+        stream_chunk_delay=args.stream_chunk_delay,
+    )
+    install_upstream_stubs(stub)
+    fake_db = FakeDatabase(latency=args.db_latency)
+    install_fake_db(fake_db)
+
+    bot_request = StubBotRequest(latency=args.bot_latency)
+    application = (
+        Application.builder()
+        .token(TOKEN)
+        .request(bot_request)
+        .get_updates_request(StubBotRequest())
+        .build()
+    )
+    await application.initialize()
+
+    # История ключевой ставки и снимки заполняются фоновыми задачами; в бенчмарке загружаем их заранее
+    await services.sync_key_rate_history()
+    for name in services.snapshots.providers():
+        await services.snapshots.refresh(name)
+
+    bench = Bench(application)
+    results = {}
+    try:
+        for name, call in bench.cases().items():
+            if args.filter and not any(f in name for f in args.filter):
+                continue
+            if name == 'handler:ai_message_cached':
+                memory_cache.invalidate()
+            if args.warmup:
+                await run_case(call, args.warmup, 1)
+            results[name] = await run_case(call, args.iterations, args.concurrency)
+            print(f"{name:<42} p50={results[name]['p50_ms']}ms p95={results[name]['p95_ms']}ms "
+                  f"{results[name]['throughput_per_sec']}/s", file=sys.stderr, flush=True)
+    finally:
+        await application.shutdown()
+
+    return {
+        'meta': run_metadata(
+            iterations=args.iterations,
+            concurrency=args.concurrency,
+            upstream_latency=stub.latency,
+            upstream_failure_rate=stub.failure_rate,
+            bot_latency=args.bot_latency,
+            db_latency=args.db_latency,
+        ),
+        'results': results,
+        'upstream_requests': stub.requests,
+        'upstream_bytes': stub.bytes_sent,
+        'bot_api_calls': bot_request.calls,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк обработчиков и сервисов бота на локальных заглушках")
+    parser.add_argument('--iterations', type=int, default=200)
+    parser.add_argument('--concurrency', type=int, default=10)
+    parser.add_argument('--warmup', type=int, default=5)
+    parser.add_argument('--latency', action='append',
+                        help="задержка внешних API, сек: '0.05' для всех или 'deepseek=0.5' (можно повторять)")
+    parser.add_argument('--failure-rate', action='append',
+                        help="доля ответов 503: '0.01' для всех или 'cbr=0.1' (можно повторять)")
+    parser.add_argument('--stream-chunk-delay', type=float, default=0.0, help="пауза между фрагментами SSE DeepSeek, сек")
+    parser.add_argument('--bot-latency', type=float, default=0.0, help="задержка Bot API, сек")
+    parser.add_argument('--db-latency', type=float, default=0.0, help="задержка запросов к БД, сек")
+    parser.add_argument('--filter', action='append', help="запускать только сценарии, содержащие подстроку")
+    parser.add_argument('--output', help="файл для результатов в JSON")
+    parser.add_argument('--compare', help="JSON прошлого запуска для сравнения")
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.ERROR)
+    report = asyncio.run(run(args))
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    else:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+
+    if args.compare:
+        print(compare(report, load_results(args.compare)))
+
+if __name__ == '__main__':
+    main()
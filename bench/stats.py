@@ -0,0 +1,59 @@
+"""Общие функции подсчета результатов бенчмарков"""
+import json
+import platform
+import subprocess
+
+def percentile(values: list, p: float):
+    """Перцентиль по ближайшему рангу (values не обязаны быть отсортированы)"""
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+def summarize(latencies: list, elapsed: float, errors: int = 0) -> dict:
+    """Сводка по серии вызовов: перцентили задержки (мс) и пропускная способность"""
+    def ms(value):
+        return round(value * 1000, 3) if value is not None else None
+
+    return {
+        'count': len(latencies),
+        'errors': errors,
+        'p50_ms': ms(percentile(latencies, 50)),
+        'p95_ms': ms(percentile(latencies, 95)),
+        'p99_ms': ms(percentile(latencies, 99)),
+        'mean_ms': ms(sum(latencies) / len(latencies)) if latencies else None,
+        'throughput_per_sec': round(len(latencies) / elapsed, 1) if elapsed else None,
+    }
+
+def run_metadata(**extra) -> dict:
+    """Сведения о запуске, чтобы сравнивать результаты между коммитами"""
+    try:
+        commit = subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {'commit': commit, 'python': platform.python_version(), **extra}
+
+def compare(current: dict, baseline: dict) -> str:
+    """Таблица изменений p50/p95/пропускной способности относительно прошлого запуска"""
+    lines = [f"{'case':<32} {'p50 ms':>16} {'p95 ms':>16} {'ops/s':>16}"]
+    for name, result in current['results'].items():
+        old = baseline.get('results', {}).get(name)
+        if not old:
+            lines.append(f"{name:<32} (нет в базовом запуске)")
+            continue
+
+        cells = []
+        for key in ('p50_ms', 'p95_ms', 'throughput_per_sec'):
+            new_value, old_value = result.get(key), old.get(key)
+            if new_value is None or not old_value:
+                cells.append(f"{'-':>16}")
+            else:
+                cells.append(f"{new_value:>9} {(new_value - old_value) / old_value:+6.0%}")
+        lines.append(f"{name:<32} " + " ".join(cells))
+    return "\n".join(lines)
+
+def load_results(path: str) -> dict:
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
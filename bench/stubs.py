@@ -0,0 +1,500 @@
+"""
+Локальные заглушки внешних сервисов для бенчмарков.
+
+Все внешние API (ЦБ РФ, CoinGecko, OpenWeather, DeepSeek) отвечают заготовленными
+данными через httpx.MockTransport с настраиваемой задержкой и долей ошибок,
+Bot API заменяется StubBotRequest, а функции db.py - хранилищем в памяти.
+"""
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+import httpx
+from telegram.request import BaseRequest
+
+from bench.fake_telegram import BOT_USER
+
+# Настройки, без которых модули бота не импортируются
+BENCH_ENV = {
+    'TELEGRAM_BOT_TOKEN': '123456:bench',
+    'DATABASE_URL': 'postgresql://bench@127.0.0.1/bench',
+    'TG_BOT_APIDEEPSEEK': 'bench-key',
+    'API_weather': 'bench-weather-key',
+    'LEADER_ELECTION': 'false',
+}
+
+def setup_environment():
+    """Задает переменные окружения для импорта модулей бота"""
+    for name, value in BENCH_ENV.items():
+        os.environ.setdefault(name, value)
+
+# =============================================================================
+# ЗАГОТОВЛЕННЫЕ ОТВЕТЫ
+# =============================================================================
+
+# Валюты из XML_daily.asp: (ID, NumCode, CharCode, Nominal, Name, Value)
+CBR_VALUTES = [
+    ('R01010', '036', 'AUD', 1, 'Австралийский доллар', 52.8013),
+    ('R01020A', '944', 'AZN', 1, 'Азербайджанский манат', 47.6423),
+    ('R01035', '826', 'GBP', 1, 'Фунт стерлингов Соединенного королевства', 107.3528),
+    ('R01060', '051', 'AMD', 100, 'Армянских драмов', 20.9375),
+    ('R01090B', '933', 'BYN', 1, 'Белорусский рубль', 27.4452),
+    ('R01100', '975', 'BGN', 1, 'Болгарский лев', 48.6207),
+    ('R01115', '986', 'BRL', 1, 'Бразильский реал', 14.8916),
+    ('R01135', '348', 'HUF', 100, 'Форинтов', 24.0123),
+    ('R01150', '704', 'VND', 10000, 'Донгов', 31.9875),
+    ('R01200', '344', 'HKD', 1, 'Гонконгский доллар', 10.3882),
+    ('R01210', '981', 'GEL', 1, 'Лари', 29.7821),
+    ('R01215', '208', 'DKK', 1, 'Датская крона', 12.7436),
+    ('R01230', '784', 'AED', 1, 'Дирхам ОАЭ', 22.0556),
+    ('R01235', '840', 'USD', 1, 'Доллар США', 80.9961),
+    ('R01239', '978', 'EUR', 1, 'Евро', 94.6207),
+    ('R01270', '356', 'INR', 100, 'Индийских рупий', 91.8844),
+    ('R01280', '360', 'IDR', 10000, 'Рупий', 49.2211),
+    ('R01335', '398', 'KZT', 100, 'Тенге', 15.0428),
+    ('R01350', '124', 'CAD', 1, 'Канадский доллар', 57.7812),
+    ('R01355', '634', 'QAR', 1, 'Катарский риал', 22.2517),
+    ('R01370', '417', 'KGS', 100, 'Сомов', 92.6198),
+    ('R01375', '156', 'CNY', 1, 'Юань', 11.3424),
+    ('R01500', '498', 'MDL', 10, 'Молдавских леев', 47.7031),
+    ('R01530', '554', 'NZD', 1, 'Новозеландский доллар', 46.5098),
+    ('R01535', '578', 'NOK', 10, 'Норвежских крон', 80.6144),
+    ('R01565', '985', 'PLN', 1, 'Польский злотый', 22.2906),
+    ('R01585F', '946', 'RON', 1, 'Румынский лей', 18.6489),
+    ('R01589', '960', 'XDR', 1, 'СДР (специальные права заимствования)', 110.6124),
+    ('R01625', '702', 'SGD', 1, 'Сингапурский доллар', 62.4377),
+    ('R01670', '972', 'TJS', 10, 'Сомони', 87.2653),
+    ('R01675', '764', 'THB', 10, 'Батов', 24.9106),
+    ('R01700J', '949', 'TRY', 10, 'Турецких лир', 19.4285),
+    ('R01710A', '934', 'TMT', 1, 'Новый туркменский манат', 23.1418),
+    ('R01717', '860', 'UZS', 10000, 'Узбекских сумов', 66.8232),
+    ('R01720', '980', 'UAH', 10, 'Украинских гривен', 19.5412),
+    ('R01760', '203', 'CZK', 10, 'Чешских крон', 38.9012),
+    ('R01770', '752', 'SEK', 10, 'Шведских крон', 85.9921),
+    ('R01775', '756', 'CHF', 1, 'Швейцарский франк', 101.3419),
+    ('R01805F', '941', 'RSD', 100, 'Сербских динаров', 80.7254),
+    ('R01810', '710', 'ZAR', 10, 'Рэндов', 46.8813),
+    ('R01815', '410', 'KRW', 1000, 'Вон', 57.4109),
+    ('R01820', '392', 'JPY', 100, 'Иен', 53.2874),
+]
+
+def _decimal(value: float) -> str:
+    return f"{value:.4f}".replace('.', ',')
+
+def cbr_daily_xml(date_req: str = None) -> bytes:
+    """Ответ XML_daily.asp в кодировке windows-1251, как у ЦБ РФ"""
+    try:
+        date = datetime.strptime(date_req, '%d/%m/%Y') if date_req else datetime.now()
+    except ValueError:
+        date = datetime.now()
+
+    # Курсы немного меняются день ото дня
+    shift = 1 + (date.toordinal() % 7 - 3) / 1000
+    parts = [f'<?xml version="1.0" encoding="windows-1251"?><ValCurs Date="{date:%d.%m.%Y}" name="Foreign Currency Market">']
+    for valute_id, num_code, char_code, nominal, name, value in CBR_VALUTES:
+        value *= shift
+        parts.append(
+            f'<Valute ID="{valute_id}"><NumCode>{num_code}</NumCode><CharCode>{char_code}</CharCode>'
+            f'<Nominal>{nominal}</Nominal><Name>{name}</Name><Value>{_decimal(value)}</Value>'
+            f'<VunitRate>{_decimal(value / nominal)}</VunitRate></Valute>'
+        )
+    parts.append('</ValCurs>')
+    return ''.join(parts).encode('windows-1251')
+
+def cbr_dynamic_xml(date_from: str, date_to: str, valute_id: str) -> bytes:
+    """Ответ XML_dynamic.asp: курс одной валюты за период"""
+    start = datetime.strptime(date_from, '%d/%m/%Y')
+    end = min(datetime.strptime(date_to, '%d/%m/%Y'), datetime.now())
+    base = next((v for v in CBR_VALUTES if v[0] == valute_id), CBR_VALUTES[13])
+    parts = [f'<?xml version="1.0" encoding="windows-1251"?><ValCurs ID="{valute_id}" DateRange1="{date_from}" DateRange2="{date_to}" name="Foreign Currency Market Dynamic">']
+    day = start
+    while day <= end:
+        if day.weekday() < 5:
+            value = base[5] * (1 + (day.toordinal() % 11 - 5) / 1000)
+            parts.append(
+                f'<Record Date="{day:%d.%m.%Y}" Id="{valute_id}"><Nominal>{base[3]}</Nominal>'
+                f'<Value>{_decimal(value)}</Value><VunitRate>{_decimal(value / base[3])}</VunitRate></Record>'
+            )
+        day += timedelta(days=1)
+    parts.append('</ValCurs>')
+    return ''.join(parts).encode('windows-1251')
+
+# Решения по ключевой ставке: (дата вступления в силу, ставка)
+KEY_RATE_DECISIONS = [
+    ('2020-01-01', 6.25), ('2020-07-27', 4.25), ('2021-03-22', 4.50), ('2021-07-26', 6.50),
+    ('2021-12-20', 8.50), ('2022-02-28', 20.00), ('2022-09-19', 7.50), ('2023-08-15', 12.00),
+    ('2023-12-18', 16.00), ('2024-10-28', 21.00), ('2025-06-09', 20.00), ('2025-07-28', 18.00),
+    ('2025-09-15', 17.00), ('2025-10-27', 16.50),
+]
+
+def _key_rate_on(day: datetime) -> float:
+    rate = KEY_RATE_DECISIONS[0][1]
+    for date_str, value in KEY_RATE_DECISIONS:
+        if datetime.strptime(date_str, '%Y-%m-%d') <= day:
+            rate = value
+    return rate
+
+def key_rate_html(date_from: datetime = None, date_to: datetime = None) -> bytes:
+    """Страница hd_base/KeyRate: шапка и меню сайта и таблица table.data по рабочим дням (новые сверху)"""
+    date_to = min(date_to or datetime.now(), datetime.now())
+    date_from = date_from or date_to - timedelta(days=30)
+
+    rows = []
+    day = date_to
+    while day >= date_from:
+        if day.weekday() < 5:
+            rows.append(f'<tr><td>{day:%d.%m.%Y}</td><td>{_decimal(_key_rate_on(day))[:-2]}</td></tr>')
+        day -= timedelta(days=1)
+
+    menu = ''.join(
+        f'<li class="menu_item"><a href="/section/{i}/" class="menu_link">Раздел сайта {i}</a>'
+        f'<ul>{"".join(f"<li><a href=/section/{i}/{j}/>Подраздел {j}</a></li>" for j in range(8))}</ul></li>'
+        for i in range(60)
+    )
+    page = (
+        '<!DOCTYPE html><html lang="ru"><head><meta charset="utf-8"><title>Ключевая ставка Банка России</title>'
+        '<script>window.dataLayer = window.dataLayer || [];</script></head><body>'
+        f'<header><nav><ul class="menu">{menu}</ul></nav></header>'
+        '<main><h1>Ключевая ставка Банка России</h1><div class="table-wrapper"><div class="table">'
+        '<table class="data"><tr><th>Дата</th><th>Ставка</th></tr>'
+        f'{"".join(rows)}</table></div></div></main>'
+        f'<footer>{menu}</footer></body></html>'
+    )
+    return page.encode('utf-8')
+
+COINGECKO_PRICES = {
+    'bitcoin': (9_100_000, 112_000), 'ethereum': (330_000, 4_050), 'binancecoin': (92_000, 1_130),
+    'ripple': (205, 2.52), 'cardano': (58, 0.71), 'solana': (15_600, 192),
+    'polkadot': (260, 3.2), 'dogecoin': (16.2, 0.199), 'tron': (26, 0.32), 'litecoin': (7_800, 96),
+}
+
+def coingecko_prices(ids: str) -> dict:
+    data = {}
+    for coin_id in ids.split(','):
+        if coin_id in COINGECKO_PRICES:
+            rub, usd = COINGECKO_PRICES[coin_id]
+            data[coin_id] = {
+                'rub': rub, 'usd': usd,
+                'rub_24h_change': 1.37, 'usd_24h_change': 1.29,
+                'last_updated_at': int(time.time()),
+            }
+    return data
+
+OPENWEATHER_RESPONSE = {
+    'coord': {'lon': 37.6156, 'lat': 55.7522},
+    'weather': [{'id': 803, 'main': 'Clouds', 'description': 'облачно с прояснениями', 'icon': '04d'}],
+    'main': {'temp': 8.4, 'feels_like': 6.1, 'temp_min': 7.2, 'temp_max': 9.3, 'pressure': 1017, 'humidity': 71},
+    'visibility': 10000,
+    'wind': {'speed': 3.6, 'deg': 240},
+    'clouds': {'all': 75},
+    'dt': 1760700000,
+    'sys': {'country': 'RU', 'sunrise': 1760674800, 'sunset': 1760712000},
+    'name': 'Москва',
+    'cod': 200,
+}
+
+DEEPSEEK_ANSWER = (
+    "Ключевая ставка - это минимальная процентная ставка, под которую центральный банк "
+    "выдает кредиты коммерческим банкам и принимает у них депозиты. Она влияет на стоимость "
+    "кредитов и вкладов, курс рубля и инфляцию.\n\n"
+    "**Как это работает:**\n1. При повышении ставки кредиты дорожают, спрос снижается.\n"
+    "2. При снижении ставки кредиты дешевеют, экономика ускоряется.\n\n"
+    "Решения по ставке Банк России принимает восемь раз в год."
+)
+
+def _deepseek_chunks(text: str, size: int = 12) -> list:
+    return [text[i:i + size] for i in range(0, len(text), size)]
+
+# =============================================================================
+# ЗАГЛУШКИ HTTP
+# =============================================================================
+
+class UpstreamStub:
+    """
+    Обработчик для httpx.MockTransport: маршрутизирует запросы к внешним API
+    на заготовленные ответы. Для каждого провайдера (cbr, key_rate, coingecko,
+    openweather, deepseek) задаются задержка (сек) и доля ответов 503.
+    """
+
+    PROVIDERS = ('cbr', 'key_rate', 'coingecko', 'openweather', 'deepseek')
+
+    def __init__(self, latency: dict = None, failure_rate: dict = None,
+                 stream_chunk_delay: float = 0.0, seed: int = 1):
+        self.latency = {name: 0.0 for name in self.PROVIDERS}
+        self.latency.update(latency or {})
+        self.failure_rate = {name: 0.0 for name in self.PROVIDERS}
+        self.failure_rate.update(failure_rate or {})
+        self.stream_chunk_delay = stream_chunk_delay
+        self.random = random.Random(seed)
+        self.requests = {name: 0 for name in self.PROVIDERS}
+        self.bytes_sent = {name: 0 for name in self.PROVIDERS}
+
+    @staticmethod
+    def provider_for(request: httpx.Request) -> str:
+        host, path = request.url.host, request.url.path
+        if host.endswith('cbr.ru'):
+            return 'key_rate' if 'KeyRate' in path else 'cbr'
+        if 'coingecko' in host:
+            return 'coingecko'
+        if 'openweathermap' in host:
+            return 'openweather'
+        if 'deepseek' in host:
+            return 'deepseek'
+        raise ValueError(f"Нет заглушки для {request.url}")
+
+    async def handle(self, request: httpx.Request) -> httpx.Response:
+        provider = self.provider_for(request)
+        self.requests[provider] += 1
+
+        if self.latency[provider]:
+            await asyncio.sleep(self.latency[provider])
+        if self.random.random() < self.failure_rate[provider]:
+            return httpx.Response(503, text='Service Unavailable')
+
+        response = self._respond(provider, request)
+        if isinstance(response.stream, httpx.ByteStream):
+            self.bytes_sent[provider] += len(response.content)
+        return response
+
+    def _respond(self, provider: str, request: httpx.Request) -> httpx.Response:
+        params = request.url.params
+        path = request.url.path
+
+        if provider == 'cbr':
+            if path.endswith('XML_dynamic.asp'):
+                body = cbr_dynamic_xml(params['date_req1'], params['date_req2'], params['VAL_NM_RQ'])
+            else:
+                body = cbr_daily_xml(params.get('date_req'))
+            return httpx.Response(200, content=body, headers={'Content-Type': 'application/xml; charset=windows-1251'})
+
+        if provider == 'key_rate':
+            date_from = params.get('UniDbQuery.From') or params.get('UniDbQuery.FromDate')
+            date_to = params.get('UniDbQuery.To') or params.get('UniDbQuery.ToDate')
+            body = key_rate_html(
+                datetime.strptime(date_from, '%d.%m.%Y') if date_from else None,
+                datetime.strptime(date_to, '%d.%m.%Y') if date_to else None,
+            )
+            return httpx.Response(200, content=body, headers={'Content-Type': 'text/html; charset=utf-8'})
+
+        if provider == 'coingecko':
+            return httpx.Response(200, json=coingecko_prices(params.get('ids', '')))
+
+        if provider == 'openweather':
+            return httpx.Response(200, json=OPENWEATHER_RESPONSE)
+
+        if path.endswith('models'):
+            return httpx.Response(200, json={'object': 'list', 'data': [{'id': 'deepseek-chat', 'object': 'model'}]})
+
+        payload = json.loads(request.content or b'{}')
+        if payload.get('stream'):
+            return httpx.Response(200, content=self._sse(), headers={'Content-Type': 'text/event-stream'})
+        return httpx.Response(200, json={
+            'id': 'bench',
+            'object': 'chat.completion',
+            'model': payload.get('model', 'deepseek-chat'),
+            'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': DEEPSEEK_ANSWER}, 'finish_reason': 'stop'}],
+            'usage': {'prompt_tokens': 40, 'completion_tokens': 120, 'total_tokens': 160},
+        })
+
+    async def _sse(self):
+        for chunk in _deepseek_chunks(DEEPSEEK_ANSWER):
+            if self.stream_chunk_delay:
+                await asyncio.sleep(self.stream_chunk_delay)
+            event = json.dumps({'choices': [{'index': 0, 'delta': {'content': chunk}}]}, ensure_ascii=False)
+            data = f"data: {event}\n\n".encode()
+            self.bytes_sent['deepseek'] += len(data)
+            yield data
+        yield b"data: [DONE]\n\n"
+
+def install_upstream_stubs(stub: UpstreamStub):
+    """Подменяет общие HTTP клиенты бота клиентами с заглушкой"""
+    import http_client
+    from config import HTTP_PROVIDER_LIMITS
+
+    for provider in HTTP_PROVIDER_LIMITS:
+        http_client._clients[provider] = httpx.AsyncClient(
+            transport=httpx.MockTransport(stub.handle), follow_redirects=True
+        )
+
+# =============================================================================
+# ЗАГЛУШКА BOT API
+# =============================================================================
+
+class StubBotRequest(BaseRequest):
+    """Транспорт PTB, который отвечает на методы Bot API без сети"""
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.calls = {}
+        self._message_id = 0
+
+    @property
+    def read_timeout(self):
+        return None
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+    async def do_request(self, url, method, request_data=None, read_timeout=BaseRequest.DEFAULT_NONE,
+                         write_timeout=BaseRequest.DEFAULT_NONE, connect_timeout=BaseRequest.DEFAULT_NONE,
+                         pool_timeout=BaseRequest.DEFAULT_NONE):
+        api_method = url.rsplit('/', 1)[-1]
+        params = request_data.parameters if request_data else {}
+        self.calls[api_method] = self.calls.get(api_method, 0) + 1
+
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+        if api_method == 'getMe':
+            result = BOT_USER
+        elif api_method in ('sendMessage', 'editMessageText'):
+            self._message_id += 1
+            result = {
+                'message_id': self._message_id,
+                'date': int(time.time()),
+                'chat': {'id': int(params.get('chat_id', 0)), 'type': 'private'},
+                'from': BOT_USER,
+                'text': params.get('text', ''),
+            }
+        elif api_method == 'getUpdates':
+            result = []
+        else:
+            result = True
+
+        return 200, json.dumps({'ok': True, 'result': result}).encode()
+
+def make_callback_update(update_id: int, data: str, user_id: int = None) -> dict:
+    """Нажатие inline-кнопки под сообщением бота"""
+    chat_id = user_id or 100000 + update_id
+    user = {'id': chat_id, 'is_bot': False, 'first_name': f'User{update_id}', 'language_code': 'ru'}
+    return {
+        'update_id': update_id,
+        'callback_query': {
+            'id': str(update_id),
+            'from': user,
+            'chat_instance': str(chat_id),
+            'data': data,
+            'message': {
+                'message_id': update_id,
+                'date': int(time.time()),
+                'chat': {'id': chat_id, 'type': 'private'},
+                'from': BOT_USER,
+                'text': 'Выберите раздел:',
+            },
+        },
+    }
+
+# =============================================================================
+# БАЗА ДАННЫХ В ПАМЯТИ
+# =============================================================================
+
+class FakeDatabase:
+    """Замена функций db.py, используемых обработчиками (без PostgreSQL)"""
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.users = {}
+        self.alerts = {}
+        self.state = {}
+        self.ai_answers = {}
+        self.key_rates = {}
+        self._next_alert_id = 1
+
+    async def _wait(self):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+    async def update_user_info(self, user_id, first_name, username=None):
+        await self._wait()
+        self.users[user_id] = {'user_id': user_id, 'first_name': first_name, 'username': username}
+
+    async def get_all_users(self):
+        await self._wait()
+        return list(self.users.values())
+
+    async def add_alert(self, user_id, from_curr, to_curr, threshold, direction):
+        await self._wait()
+        alert_id = self._next_alert_id
+        self._next_alert_id += 1
+        self.alerts[alert_id] = {
+            'id': alert_id, 'user_id': user_id, 'from_currency': from_curr, 'to_currency': to_curr,
+            'threshold': threshold, 'direction': direction, 'is_active': True,
+        }
+        return alert_id
+
+    async def get_user_alerts(self, user_id):
+        await self._wait()
+        return [a for a in self.alerts.values() if a['user_id'] == user_id and a['is_active']]
+
+    async def get_all_alerts(self):
+        await self._wait()
+        return list(self.alerts.values())
+
+    async def remove_alert(self, alert_id):
+        await self._wait()
+        self.alerts.pop(alert_id, None)
+
+    async def clear_user_alerts(self, user_id):
+        await self._wait()
+        for alert_id in [a['id'] for a in self.alerts.values() if a['user_id'] == user_id]:
+            del self.alerts[alert_id]
+
+    async def get_cached_ai_answer(self, cache_key, ttl):
+        await self._wait()
+        return self.ai_answers.get(cache_key)
+
+    async def save_cached_ai_answer(self, cache_key, prompt, answer):
+        await self._wait()
+        self.ai_answers[cache_key] = answer
+
+    async def get_bot_state(self, kind, state_id):
+        await self._wait()
+        return self.state.get((kind, state_id))
+
+    async def save_bot_state(self, rows):
+        await self._wait()
+        for kind, state_id, data in rows:
+            self.state[(kind, state_id)] = data
+
+    async def delete_bot_state(self, kind, state_id):
+        await self._wait()
+        self.state.pop((kind, state_id), None)
+
+    async def save_key_rate_history(self, rows):
+        await self._wait()
+        new_rows = {date: rate for date, rate in rows if date not in self.key_rates}
+        self.key_rates.update(new_rows)
+        return len(new_rows)
+
+    async def get_key_rate_last_date(self):
+        await self._wait()
+        return max(self.key_rates, default=None)
+
+    async def get_latest_key_rate(self, on_date):
+        await self._wait()
+        date = max((d for d in self.key_rates if d <= on_date), default=None)
+        return {'date': date, 'rate': self.key_rates[date]} if date else None
+
+    FUNCTIONS = (
+        'update_user_info', 'get_all_users', 'add_alert', 'get_user_alerts', 'get_all_alerts',
+        'remove_alert', 'clear_user_alerts', 'get_cached_ai_answer', 'save_cached_ai_answer',
+        'get_bot_state', 'save_bot_state', 'delete_bot_state',
+        'save_key_rate_history', 'get_key_rate_last_date', 'get_latest_key_rate',
+    )
+
+def install_fake_db(fake: FakeDatabase):
+    """Подменяет функции db.py в самом модуле и в модулях, импортировавших их по имени"""
+    import db
+
+    modules = [db] + [sys.modules[name] for name in ('handlers', 'services', 'persistence', 'ai_cache') if name in sys.modules]
+    for name in FakeDatabase.FUNCTIONS:
+        for module in modules:
+            if hasattr(module, name):
+                setattr(module, name, getattr(fake, name))
@@ -0,0 +1,291 @@
+import asyncio
+import time
+from telegram.error import RetryAfter, Forbidden, BadRequest, TelegramError
+from config import (
+    BROADCAST_RATE, BROADCAST_CONCURRENCY, BROADCAST_PER_CHAT_INTERVAL,
+    BROADCAST_MAX_RETRIES, BROADCAST_PROGRESS_INTERVAL, BROADCAST_PAGE_SIZE,
+    BROADCAST_CHECKPOINT_INTERVAL, logger
+)
+
+# Возобновляемые рассылки, выполняющиеся в этом процессе
+_running_broadcasts = set()
+
+# Прогресс последней рассылки каждого вида (для метрик)
+broadcast_stats = {}
+
+class TokenBucket:
+    """Ограничитель скорости: не более rate операций в секунду (с запасом capacity)"""
+    
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+    
+    async def acquire(self):
+        """Ожидает, пока не появится свободный токен"""
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+class BroadcastStats:
+    """Прогресс рассылки"""
+    
+    def __init__(self, name: str, total: int = None):
+        self.name = name
+        self.total = total
+        self.sent = 0
+        self.failed = 0
+        self.retries = 0
+        self.started = time.monotonic()
+        self.finished = None
+    
+    @property
+    def processed(self) -> int:
+        return self.sent + self.failed
+    
+    @property
+    def elapsed(self) -> float:
+        return (self.finished or time.monotonic()) - self.started
+    
+    @property
+    def throughput(self) -> float:
+        return self.processed / self.elapsed if self.elapsed > 0 else 0.0
+    
+    @property
+    def eta(self):
+        if not self.total or not self.throughput:
+            return None
+        return max(self.total - self.processed, 0) / self.throughput
+    
+    def summary(self) -> str:
+        text = (
+            f"Рассылка '{self.name}': отправлено {self.sent}, ошибок {self.failed}, "
+            f"повторов {self.retries}, {self.throughput:.1f} сообщ/с"
+        )
+        if self.total:
+            text += f", {self.processed}/{self.total}"
+        if not self.finished and self.eta is not None:
+            text += f", осталось ~{self.eta:.0f} с"
+        return text
+
+class Broadcaster:
+    """
+    Рассылка сообщений с ограниченной параллельностью.
+    Общая скорость ограничена token bucket, для каждого чата выдерживается
+    минимальный интервал между сообщениями. RetryAfter приостанавливает только
+    ту «полосу» (воркер), которая его получила.
+    """
+    
+    def __init__(self, bot, name: str, rate: float = BROADCAST_RATE,
+                 concurrency: int = BROADCAST_CONCURRENCY,
+                 per_chat_interval: float = BROADCAST_PER_CHAT_INTERVAL,
+                 max_retries: int = BROADCAST_MAX_RETRIES):
+        self.bot = bot
+        self.name = name
+        self.concurrency = concurrency
+        self.per_chat_interval = per_chat_interval
+        self.max_retries = max_retries
+        self.bucket = TokenBucket(rate)
+        self._chat_last_sent = {}
+        self._queue = None
+        self._workers = []
+        self._reporter = None
+        self._should_continue = None
+        self._stopped = False
+        self._processed = set()
+        self.stats = None
+    
+    async def run(self, chat_ids, text: str, total: int = None, **send_kwargs) -> BroadcastStats:
+        """Отправляет text всем chat_ids (обычный или асинхронный итератор)"""
+        if total is None and hasattr(chat_ids, '__len__'):
+            total = len(chat_ids)
+        
+        self._start(text, total, send_kwargs)
+        try:
+            if hasattr(chat_ids, '__aiter__'):
+                async for chat_id in chat_ids:
+                    await self._queue.put(chat_id)
+            else:
+                for chat_id in chat_ids:
+                    await self._queue.put(chat_id)
+            await self._queue.join()
+        finally:
+            await self._stop()
+        
+        return self.stats
+    
+    async def run_paged(self, broadcast_id: str, kind: str, text: str, should_continue=None, **send_kwargs):
+        """
+        Возобновляемая рассылка всем пользователям.
+        Пользователи читаются страницами по возрастанию user_id. Контрольная точка -
+        последний пользователь, до которого страница обработана без пропусков
+        (воркеры отправляют не строго по порядку) - сохраняется в БД каждые
+        BROADCAST_CHECKPOINT_INTERVAL секунд и в конце каждой страницы, поэтому
+        после перезапуска рассылка продолжается с места остановки.
+        should_continue() проверяется перед каждым сообщением: если он вернул False,
+        оставшиеся сообщения не отправляются.
+        """
+        from db import (
+            count_users, iter_user_id_pages,
+            get_broadcast_checkpoint, save_broadcast_checkpoint
+        )
+        
+        if broadcast_id in _running_broadcasts:
+            logger.warning(f"Рассылка '{broadcast_id}' уже выполняется")
+            return None
+        
+        checkpoint = await get_broadcast_checkpoint(broadcast_id)
+        if checkpoint and checkpoint['completed']:
+            logger.info(f"Рассылка '{broadcast_id}' уже завершена")
+            return None
+        
+        last_user_id = checkpoint['last_user_id'] if checkpoint else None
+        sent_before = checkpoint['sent'] if checkpoint else 0
+        failed_before = checkpoint['failed'] if checkpoint else 0
+        if last_user_id is not None:
+            logger.info(f"Рассылка '{broadcast_id}' продолжается после user_id {last_user_id}")
+        else:
+            await save_broadcast_checkpoint(broadcast_id, kind, None, 0, 0)
+        
+        page = []
+        save_lock = asyncio.Lock()
+        
+        async def save_progress(completed: bool = False):
+            nonlocal last_user_id
+            # Под блокировкой: точка, посчитанная раньше, не перезапишет более позднюю
+            async with save_lock:
+                for chat_id in page:
+                    if chat_id not in self._processed:
+                        break
+                    last_user_id = chat_id
+                await save_broadcast_checkpoint(
+                    broadcast_id, kind, last_user_id,
+                    sent_before + self.stats.sent, failed_before + self.stats.failed, completed=completed
+                )
+        
+        async def save_progress_periodically():
+            while True:
+                await asyncio.sleep(BROADCAST_CHECKPOINT_INTERVAL)
+                try:
+                    await save_progress()
+                except Exception as e:
+                    logger.error(f"Не удалось сохранить контрольную точку рассылки '{broadcast_id}': {e}")
+        
+        _running_broadcasts.add(broadcast_id)
+        self._start(text, max(await count_users() - sent_before - failed_before, 0), send_kwargs, should_continue)
+        checkpointer = asyncio.create_task(save_progress_periodically())
+        try:
+            async for page in iter_user_id_pages(last_user_id, BROADCAST_PAGE_SIZE):
+                self._processed = set()
+                for chat_id in page:
+                    if self._stopped:
+                        break
+                    await self._queue.put(chat_id)
+                await self._queue.join()
+                await save_progress()
+                
+                if self._stopped:
+                    logger.warning(f"Рассылка '{broadcast_id}' прервана после user_id {last_user_id}")
+                    return self.stats
+            
+            await save_progress(completed=True)
+        finally:
+            checkpointer.cancel()
+            await asyncio.gather(checkpointer, return_exceptions=True)
+            _running_broadcasts.discard(broadcast_id)
+            await self._stop()
+        
+        return self.stats
+    
+    def _start(self, text: str, total: int, send_kwargs: dict, should_continue=None):
+        self.stats = BroadcastStats(self.name, total)
+        self._should_continue = should_continue
+        self._stopped = False
+        self._processed = set()
+        broadcast_stats[self.name] = self.stats
+        self._queue = asyncio.Queue(maxsize=self.concurrency * 2)
+        self._workers = [
+            asyncio.create_task(self._worker(self._queue, text, send_kwargs))
+            for _ in range(self.concurrency)
+        ]
+        self._reporter = asyncio.create_task(self._report_progress())
+    
+    async def _stop(self):
+        for worker in self._workers:
+            worker.cancel()
+        self._reporter.cancel()
+        await asyncio.gather(*self._workers, self._reporter, return_exceptions=True)
+        
+        self.stats.finished = time.monotonic()
+        logger.info(self.stats.summary())
+    
+    async def _worker(self, queue: asyncio.Queue, text: str, send_kwargs: dict):
+        while True:
+            chat_id = await queue.get()
+            try:
+                if self._stopped or (self._should_continue is not None and not self._should_continue()):
+                    # Например, реплика перестала быть лидером: рассылку продолжит новый лидер
+                    self._stopped = True
+                    continue
+                if await self._send(chat_id, text, send_kwargs):
+                    self.stats.sent += 1
+                else:
+                    self.stats.failed += 1
+                self._processed.add(chat_id)
+            finally:
+                queue.task_done()
+    
+    async def _send(self, chat_id: int, text: str, send_kwargs: dict) -> bool:
+        """
+        Отправляет одно сообщение с учетом лимитов и повторов.
+        RetryAfter - требование подождать, а не ошибка доставки: попытку он не расходует.
+        """
+        attempt = 0
+        while attempt <= self.max_retries:
+            # Лимит на чат
+            last_sent = self._chat_last_sent.get(chat_id)
+            if last_sent is not None:
+                wait = last_sent + self.per_chat_interval - time.monotonic()
+                if wait > 0:
+                    await asyncio.sleep(wait)
+            
+            # Общий лимит
+            await self.bucket.acquire()
+            
+            try:
+                await self.bot.send_message(chat_id=chat_id, text=text, **send_kwargs)
+                self._chat_last_sent[chat_id] = time.monotonic()
+                return True
+            except RetryAfter as e:
+                # Приостанавливаем только эту полосу
+                retry_after = e.retry_after.total_seconds() if hasattr(e.retry_after, 'total_seconds') else e.retry_after
+                logger.warning(f"RetryAfter {retry_after} с при отправке пользователю {chat_id}")
+                self.stats.retries += 1
+                await asyncio.sleep(retry_after)
+            except (Forbidden, BadRequest) as e:
+                # Пользователь заблокировал бота или чат недоступен - повтор бесполезен
+                logger.error(f"Ошибка отправки рассылки '{self.name}' пользователю {chat_id}: {e}")
+                return False
+            except TelegramError as e:
+                logger.error(f"Ошибка отправки рассылки '{self.name}' пользователю {chat_id}: {e}")
+                self.stats.retries += 1
+                await asyncio.sleep(2 ** attempt)
+                attempt += 1
+            except Exception as e:
+                logger.error(f"Ошибка отправки рассылки '{self.name}' пользователю {chat_id}: {e}")
+                return False
+        
+        return False
+    
+    async def _report_progress(self):
+        while True:
+            await asyncio.sleep(BROADCAST_PROGRESS_INTERVAL)
+            logger.info(self.stats.summary())
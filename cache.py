@@ -0,0 +1,91 @@
+import asyncio
+import time
+
+# Все кэши процесса по имени (для статистики и метрик)
+caches = {}
+
+class AsyncCache:
+    """Кэш с TTL и объединением параллельных запросов одного ключа"""
+    
+    def __init__(self, name: str, max_size: int = None, lru: bool = False):
+        self.name = name
+        self.max_size = max_size
+        self.lru = lru
+        self._data = {}  # key -> (value, expires_at или None для бессрочных записей)
+        self._inflight = {}
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        caches[name] = self
+    
+    def get(self, key):
+        """Возвращает значение из кэша или None, если его нет или оно устарело"""
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+        value, expires_at = entry
+        if expires_at is not None and expires_at <= time.monotonic():
+            del self._data[key]
+            return None
+        if self.lru:
+            # Переносим запись в конец, чтобы вытеснялись давно не использованные
+            self._data[key] = self._data.pop(key)
+        return value
+    
+    def set(self, key, value, ttl: float = None):
+        """Сохраняет значение; ttl=None означает бессрочное хранение"""
+        expires_at = time.monotonic() + ttl if ttl is not None else None
+        self._data.pop(key, None)
+        self._data[key] = (value, expires_at)
+        if self.max_size and len(self._data) > self.max_size:
+            # Удаляем самую старую (или давно не использованную) запись
+            del self._data[next(iter(self._data))]
+    
+    def invalidate(self, key=None):
+        """Удаляет запись (или весь кэш, если ключ не указан)"""
+        if key is None:
+            self._data.clear()
+        else:
+            self._data.pop(key, None)
+    
+    async def get_or_load(self, key, loader, ttl=None):
+        """
+        Возвращает значение из кэша или загружает его через loader().
+        Параллельные промахи по одному ключу объединяются в один запрос.
+        ttl может быть числом, None или функцией от загруженного значения.
+        Значения None не кэшируются.
+        """
+        value = self.get(key)
+        if value is not None:
+            self.hits += 1
+            return value
+        
+        task = self._inflight.get(key)
+        if task is not None:
+            self.coalesced += 1
+        else:
+            self.misses += 1
+            task = asyncio.ensure_future(self._load(key, loader, ttl))
+            self._inflight[key] = task
+        return await asyncio.shield(task)
+    
+    async def _load(self, key, loader, ttl):
+        try:
+            value = await loader()
+            if value is not None:
+                self.set(key, value, ttl(value) if callable(ttl) else ttl)
+            return value
+        finally:
+            self._inflight.pop(key, None)
+    
+    def stats(self) -> dict:
+        """Статистика попаданий в кэш"""
+        total = self.hits + self.misses + self.coalesced
+        return {
+            'name': self.name,
+            'size': len(self._data),
+            'hits': self.hits,
+            'misses': self.misses,
+            'coalesced': self.coalesced,
+            'hit_ratio': (self.hits + self.coalesced) / total if total else 0.0,
+        }
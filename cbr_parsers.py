@@ -0,0 +1,82 @@
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+import xml.etree.ElementTree as ET
+from io import BytesIO
+from lxml import etree
+
+# =============================================================================
+# РАЗБОР ОТВЕТОВ ЦБ РФ
+# =============================================================================
+
+def parse_daily_rates(content: bytes, codes: dict) -> tuple:
+    """
+    Разбирает XML_daily.asp: читаются только валюты из codes
+    ({ID в XML ЦБ: буквенный код}), перебор прекращается, как только найдены все.
+    Документ небольшой (~8 КБ), поэтому разбирается целиком стандартным ElementTree:
+    потоковый разбор и lxml на нем не быстрее (см. bench.parse_bench).
+    Возвращает ({код: {'value': курс за 1 единицу, 'name', 'nominal'}}, дата ЦБ).
+    """
+    root = ET.fromstring(content)
+    rates = {}
+    remaining = len(codes)
+
+    for valute in root.iterfind('Valute'):
+        currency_code = codes.get(valute.get('ID'))
+        if currency_code is None or currency_code in rates:
+            continue
+
+        nominal = int(valute.findtext('Nominal'))
+        value = float(valute.findtext('Value').replace(',', '.'))
+        rates[currency_code] = {
+            'value': value / nominal if nominal > 1 else value,
+            'name': valute.findtext('Name'),
+            'nominal': nominal
+        }
+        remaining -= 1
+        if remaining == 0:
+            break
+
+    return rates, root.get('Date', '')
+
+def _cell_text(cell) -> str:
+    return ''.join(cell.itertext()).strip()
+
+def parse_key_rate_rows(content: bytes, limit: int = None) -> list:
+    """
+    Извлекает строки таблицы table.data страницы hd_base/KeyRate потоково:
+    обрабатываются только строки этой таблицы, разбор прекращается после нее
+    (или после limit строк), остаток страницы не читается.
+    Возвращает [(дата, ставка Decimal), ...] в порядке страницы (новые сверху),
+    не больше limit строк.
+    """
+    rows = []
+    in_table = False
+
+    parser = etree.iterparse(
+        BytesIO(content), events=('start', 'end'), tag=('table', 'tr'), html=True, recover=True
+    )
+    for event, element in parser:
+        if element.tag == 'table':
+            if event == 'start':
+                in_table = 'data' in (element.get('class') or '').split()
+            elif in_table:
+                break
+            continue
+
+        if event != 'end' or not in_table:
+            continue
+
+        cells = element.findall('td')
+        if len(cells) >= 2:
+            try:
+                date = datetime.strptime(_cell_text(cells[0]), '%d.%m.%Y').date()
+                rate = Decimal(_cell_text(cells[1]).replace(',', '.').replace('\xa0', '').replace(' ', ''))
+            except (ValueError, InvalidOperation):
+                date = None
+            if date is not None:
+                rows.append((date, rate))
+                if limit is not None and len(rows) >= limit:
+                    break
+        element.clear()
+
+    return rows
@@ -31,3 +31,152 @@ SUPPORTED_CURRENCIES = ['USD', 'EUR', 'GBP', 'JPY', 'CNY', 'CHF', 'CAD', 'AUD',
 
 # Настройки погоды
 WEATHER_CITY = "Moscow"
+
+# Настройки HTTP клиентов для внешних провайдеров
+# (лимиты соединений и keep-alive задаются отдельно для каждого провайдера)
+HTTP_PROVIDER_LIMITS = {
+    'cbr': {'max_connections': 10, 'max_keepalive': 5, 'timeout': 15},
+    'coingecko': {'max_connections': 5, 'max_keepalive': 2, 'timeout': 15},
+    'openweather': {'max_connections': 5, 'max_keepalive': 2, 'timeout': 10},
+    'deepseek': {'max_connections': 20, 'max_keepalive': 10, 'timeout': 30},
+}
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv('HTTP_KEEPALIVE_EXPIRY', '30'))
+
+# Кэш курсов ЦБ РФ: прошедшие даты хранятся бессрочно, сегодня/завтра - с TTL
+CBR_RATES_TTL = int(os.getenv('CBR_RATES_TTL', '600'))
+CBR_RATES_CACHE_SIZE = int(os.getenv('CBR_RATES_CACHE_SIZE', '1000'))
+
+# Фоновое обновление снимков данных (интервал обновления и предел устаревания, сек)
+CRYPTO_REFRESH_INTERVAL = int(os.getenv('CRYPTO_REFRESH_INTERVAL', '120'))
+CRYPTO_STALE_AFTER = int(os.getenv('CRYPTO_STALE_AFTER', '300'))
+KEY_RATE_REFRESH_INTERVAL = int(os.getenv('KEY_RATE_REFRESH_INTERVAL', '3600'))
+KEY_RATE_STALE_AFTER = int(os.getenv('KEY_RATE_STALE_AFTER', '10800'))
+WEATHER_REFRESH_INTERVAL = int(os.getenv('WEATHER_REFRESH_INTERVAL', '600'))
+WEATHER_STALE_AFTER = int(os.getenv('WEATHER_STALE_AFTER', '1800'))
+
+# История курсов ЦБ РФ: глубина первичной загрузки (дней)
+RATES_HISTORY_BACKFILL_DAYS = int(os.getenv('RATES_HISTORY_BACKFILL_DAYS', '365'))
+
+# Интервал проверки уведомлений (сек)
+ALERT_CHECK_INTERVAL = int(os.getenv('ALERT_CHECK_INTERVAL', '1800'))
+
+# Способ проверки уведомлений: 'index' - индекс в памяти, 'sql' - одним запросом в БД
+ALERT_EVALUATION_MODE = os.getenv('ALERT_EVALUATION_MODE', 'index')
+
+# Рассылки: общая скорость (сообщ/с), число параллельных отправок,
+# минимальный интервал между сообщениями в один чат (сек)
+BROADCAST_RATE = float(os.getenv('BROADCAST_RATE', '30'))
+BROADCAST_CONCURRENCY = int(os.getenv('BROADCAST_CONCURRENCY', '20'))
+BROADCAST_PER_CHAT_INTERVAL = float(os.getenv('BROADCAST_PER_CHAT_INTERVAL', '1'))
+BROADCAST_MAX_RETRIES = int(os.getenv('BROADCAST_MAX_RETRIES', '3'))
+BROADCAST_PROGRESS_INTERVAL = int(os.getenv('BROADCAST_PROGRESS_INTERVAL', '30'))
+BROADCAST_PAGE_SIZE = int(os.getenv('BROADCAST_PAGE_SIZE', '1000'))
+# Как часто сохраняется контрольная точка возобновляемой рассылки внутри страницы (сек):
+# после перезапуска повторно отправляется не больше BROADCAST_RATE * интервал сообщений
+BROADCAST_CHECKPOINT_INTERVAL = float(os.getenv('BROADCAST_CHECKPOINT_INTERVAL', '2'))
+
+# Потоковые ответы ИИ: включение и минимальный интервал между правками сообщения (сек)
+AI_STREAMING = os.getenv('AI_STREAMING', 'true').lower() == 'true'
+AI_STREAM_EDIT_INTERVAL = float(os.getenv('AI_STREAM_EDIT_INTERVAL', '1.0'))
+
+# Проверка доступности ИИ: интервал фоновой проверки (сек), если не было реальных запросов
+AI_HEALTH_PROBE_INTERVAL = int(os.getenv('AI_HEALTH_PROBE_INTERVAL', '300'))
+
+# Ключевая ставка: общий дедлайн опроса источников и задержка запуска следующего источника (сек)
+KEY_RATE_DEADLINE = float(os.getenv('KEY_RATE_DEADLINE', '10'))
+KEY_RATE_HEDGE_DELAY = float(os.getenv('KEY_RATE_HEDGE_DELAY', '0.5'))
+# Глубина запроса таблицы ключевой ставки (дней): достаточно последних недель
+KEY_RATE_QUERY_DAYS = int(os.getenv('KEY_RATE_QUERY_DAYS', '28'))
+# История ключевой ставки в БД: глубина первичной загрузки (дней) и интервал дозагрузки (сек)
+KEY_RATE_HISTORY_BACKFILL_DAYS = int(os.getenv('KEY_RATE_HISTORY_BACKFILL_DAYS', '365'))
+KEY_RATE_SYNC_INTERVAL = int(os.getenv('KEY_RATE_SYNC_INTERVAL', '21600'))
+# Таблица ЦБ РФ обновляется каждый рабочий день: если последняя сохраненная строка
+# старше стольких дней, ставка считается устаревшей, а фоновая задача опрашивает сайт
+KEY_RATE_MAX_AGE_DAYS = int(os.getenv('KEY_RATE_MAX_AGE_DAYS', '7'))
+
+# Память диалога с ИИ: число пар реплик, бюджет токенов истории и резюме,
+# максимальная длина одной сохраненной реплики (символов)
+AI_MEMORY_MAX_TURNS = int(os.getenv('AI_MEMORY_MAX_TURNS', '6'))
+AI_MEMORY_TOKEN_BUDGET = int(os.getenv('AI_MEMORY_TOKEN_BUDGET', '1500'))
+AI_MEMORY_SUMMARY_TOKENS = int(os.getenv('AI_MEMORY_SUMMARY_TOKENS', '300'))
+AI_MEMORY_MAX_REPLY_CHARS = int(os.getenv('AI_MEMORY_MAX_REPLY_CHARS', '1500'))
+
+# Параметры модели DeepSeek
+DEEPSEEK_MODEL = os.getenv('DEEPSEEK_MODEL', 'deepseek-chat')
+DEEPSEEK_TEMPERATURE = float(os.getenv('DEEPSEEK_TEMPERATURE', '0.7'))
+DEEPSEEK_MAX_TOKENS = int(os.getenv('DEEPSEEK_MAX_TOKENS', '2000'))
+
+# Кэш ответов ИИ: размер в памяти, срок хранения (сек) и максимум записей в БД
+AI_CACHE_MEMORY_SIZE = int(os.getenv('AI_CACHE_MEMORY_SIZE', '500'))
+AI_CACHE_TTL = int(os.getenv('AI_CACHE_TTL', str(7 * 24 * 3600)))
+AI_CACHE_MAX_ROWS = int(os.getenv('AI_CACHE_MAX_ROWS', '10000'))
+
+# Очередь запросов к ИИ: общее число одновременных запросов, лимит на пользователя
+# и минимальный интервал обновления позиции в очереди (сек)
+AI_MAX_CONCURRENCY = int(os.getenv('AI_MAX_CONCURRENCY', '4'))
+AI_MAX_PER_USER = int(os.getenv('AI_MAX_PER_USER', '1'))
+AI_QUEUE_STATUS_INTERVAL = float(os.getenv('AI_QUEUE_STATUS_INTERVAL', '3'))
+
+# Число обновлений, обрабатываемых параллельно, и размер очереди входящих обновлений
+# (0 - без ограничения; при заполнении прием новых обновлений приостанавливается)
+CONCURRENT_UPDATES = int(os.getenv('CONCURRENT_UPDATES', '64'))
+UPDATE_QUEUE_SIZE = int(os.getenv('UPDATE_QUEUE_SIZE', '0'))
+
+# Режим получения обновлений: 'polling' или 'webhook'
+BOT_MODE = os.getenv('BOT_MODE', 'polling')
+
+# Вебхук: адрес и порт встроенного сервера, путь, публичный URL,
+# секрет для заголовка X-Telegram-Bot-Api-Secret-Token и лимит соединений со стороны Telegram
+WEBHOOK_LISTEN = os.getenv('WEBHOOK_LISTEN', '0.0.0.0')
+WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT', '8443'))
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', 'telegram')
+WEBHOOK_URL = os.getenv('WEBHOOK_URL')
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET')
+WEBHOOK_MAX_CONNECTIONS = int(os.getenv('WEBHOOK_MAX_CONNECTIONS', '40'))
+
+if BOT_MODE == 'webhook' and not (WEBHOOK_URL and WEBHOOK_SECRET):
+    raise ValueError("Для режима webhook требуются переменные окружения WEBHOOK_URL и WEBHOOK_SECRET")
+
+# Адрес Bot API (можно заменить на локальный сервер или заглушку)
+TELEGRAM_BASE_URL = os.getenv('TELEGRAM_BASE_URL', 'https://api.telegram.org/bot')
+
+# Выбор лидера среди реплик (advisory-блокировка PostgreSQL): плановые задачи
+# выполняет только лидер. Ключ блокировки и интервал попыток/проверки (сек)
+LEADER_ELECTION = os.getenv('LEADER_ELECTION', 'true').lower() == 'true'
+LEADER_LOCK_KEY = int(os.getenv('LEADER_LOCK_KEY', '72163401'))
+LEADER_CHECK_INTERVAL = float(os.getenv('LEADER_CHECK_INTERVAL', '2'))
+
+# Хранение user_data/chat_data в PostgreSQL: как часто PTB передает измененные данные (сек),
+# задержка объединения изменений в одну запись (сек) и срок, после которого данные
+# пользователя перечитываются из БД (изменения на других репликах)
+PERSISTENCE_UPDATE_INTERVAL = float(os.getenv('PERSISTENCE_UPDATE_INTERVAL', '10'))
+PERSISTENCE_FLUSH_DELAY = float(os.getenv('PERSISTENCE_FLUSH_DELAY', '0.5'))
+PERSISTENCE_REFRESH_TTL = float(os.getenv('PERSISTENCE_REFRESH_TTL', '30'))
+
+# Пока PTB не передал изменения обработчика (до update_interval + flush_delay),
+# перечитывание из БД затерло бы их
+if PERSISTENCE_REFRESH_TTL <= PERSISTENCE_UPDATE_INTERVAL + PERSISTENCE_FLUSH_DELAY:
+    raise ValueError(
+        "PERSISTENCE_REFRESH_TTL должен быть больше PERSISTENCE_UPDATE_INTERVAL + PERSISTENCE_FLUSH_DELAY"
+    )
+
+# Эндпоинт метрик Prometheus (/metrics): адрес и порт (0 - отключен)
+METRICS_HOST = os.getenv('METRICS_HOST', '127.0.0.1')
+METRICS_PORT = int(os.getenv('METRICS_PORT', '9108'))
+
+# Трассировка обработки обновлений (спаны обработчика, сервисов, HTTP и БД в JSONL):
+# доля сохраняемых трасс, порог (сек), после которого трасса сохраняется всегда
+# (0 - отключен; по умолчанию трассировка выключена), файл, его предельный размер
+# (байт) и число ротированных копий, предельное число спанов в одной трассе
+TRACE_SAMPLE_RATE = float(os.getenv('TRACE_SAMPLE_RATE', '0'))
+TRACE_SLOW_THRESHOLD = float(os.getenv('TRACE_SLOW_THRESHOLD', '0'))
+TRACE_EXPORT_PATH = os.getenv('TRACE_EXPORT_PATH', 'traces.jsonl')
+TRACE_MAX_BYTES = int(os.getenv('TRACE_MAX_BYTES', str(50 * 1024 * 1024)))
+TRACE_BACKUP_COUNT = int(os.getenv('TRACE_BACKUP_COUNT', '3'))
+TRACE_MAX_SPANS = int(os.getenv('TRACE_MAX_SPANS', '500'))
+
+# Часовой пояс бота: по нему определяется день ежедневной рассылки (идентификатор
+# контрольной точки), и время рассылок курсов и погоды в этом поясе
+BOT_TIMEZONE = os.getenv('BOT_TIMEZONE', 'Europe/Moscow')
+DAILY_RATES_TIME = os.getenv('DAILY_RATES_TIME', '10:00')
+DAILY_WEATHER_TIME = os.getenv('DAILY_WEATHER_TIME', '08:00')
@@ -1,62 +1,218 @@
+import asyncio
 import asyncpg
+import json
 import os
+import socket
+import time
+from decimal import Decimal
+from contextlib import asynccontextmanager
+from alert_index import alert_index
+from metrics import db_query_logger, db_query_latency
+from tracing import db_query_tracer, span
 
 DATABASE_URL = os.getenv('DATABASE_URL')
 
 if not DATABASE_URL:
     raise ValueError("Требуется переменная окружения DATABASE_URL")
 
+# Настройки пула соединений
+DB_POOL_MIN_SIZE = int(os.getenv('DB_POOL_MIN_SIZE', '2'))
+DB_POOL_MAX_SIZE = int(os.getenv('DB_POOL_MAX_SIZE', '10'))
+DB_STATEMENT_CACHE_SIZE = int(os.getenv('DB_STATEMENT_CACHE_SIZE', '100'))
+
+_pool = None
+# Защищает создание пула от параллельных первых обращений
+_pool_lock = asyncio.Lock()
+
+# Канал уведомлений об изменении списка уведомлений о курсах и идентификатор процесса,
+# чтобы реплика-лидер перезагружала индекс после изменений на других репликах
+ALERTS_CHANNEL = 'alerts_changed'
+INSTANCE_ID = f"{socket.gethostname()}:{os.getpid()}"
+
+# Статистика использования пула (для подбора размера под нагрузкой)
+_pool_stats = {
+    'acquire_count': 0,
+    'acquire_wait_total': 0.0,
+    'acquire_wait_max': 0.0,
+    'in_use': 0,
+    'in_use_max': 0,
+}
+
+async def _init_connection(conn):
+    """Настройка нового соединения пула: учет времени запросов в метриках и трассировке"""
+    conn.add_query_logger(db_query_logger)
+    conn.add_query_logger(db_query_tracer)
+
+async def init_pool():
+    """Создание пула соединений с базой данных"""
+    global _pool
+    if _pool is not None:
+        return _pool
+    
+    async with _pool_lock:
+        # Пул мог создать другой вызов, пока этот ждал блокировку
+        if _pool is None:
+            _pool = await asyncpg.create_pool(
+                DATABASE_URL,
+                min_size=DB_POOL_MIN_SIZE,
+                max_size=DB_POOL_MAX_SIZE,
+                statement_cache_size=DB_STATEMENT_CACHE_SIZE,
+                init=_init_connection
+            )
+            print(f"Пул соединений создан (min={DB_POOL_MIN_SIZE}, max={DB_POOL_MAX_SIZE})")
+    return _pool
+
+async def close_pool():
+    """Закрытие пула соединений"""
+    global _pool
+    if _pool is None:
+        return
+    
+    pool, _pool = _pool, None
+    await pool.close()
+    print("Пул соединений закрыт")
+
+@asynccontextmanager
+async def acquire():
+    """Получение соединения из пула с учетом времени ожидания"""
+    pool = _pool or await init_pool()
+    
+    started = time.perf_counter()
+    async with pool.acquire() as conn:
+        wait = time.perf_counter() - started
+        _pool_stats['acquire_count'] += 1
+        _pool_stats['acquire_wait_total'] += wait
+        _pool_stats['acquire_wait_max'] = max(_pool_stats['acquire_wait_max'], wait)
+        _pool_stats['in_use'] += 1
+        _pool_stats['in_use_max'] = max(_pool_stats['in_use_max'], _pool_stats['in_use'])
+        try:
+            yield conn
+        finally:
+            _pool_stats['in_use'] -= 1
+
+def get_pool_stats() -> dict:
+    """Возвращает статистику пула соединений"""
+    stats = dict(_pool_stats)
+    count = stats['acquire_count']
+    stats['acquire_wait_avg'] = stats['acquire_wait_total'] / count if count else 0.0
+    stats['min_size'] = DB_POOL_MIN_SIZE
+    stats['max_size'] = DB_POOL_MAX_SIZE
+    if _pool is not None:
+        stats['size'] = _pool.get_size()
+        stats['idle'] = _pool.get_idle_size()
+    return stats
+
 async def init_db():
     """Инициализация базы данных и создание таблиц"""
     try:
-        conn = await asyncpg.connect(DATABASE_URL)
-        
-        # Создаем таблицу users
-        await conn.execute('''
-            CREATE TABLE IF NOT EXISTS users (
-                user_id BIGINT PRIMARY KEY,
-                first_name TEXT,
-                username TEXT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            );
-        ''')
-        
-        # Создаем таблицу alerts
-        await conn.execute('''
-            CREATE TABLE IF NOT EXISTS alerts (
-                id SERIAL PRIMARY KEY,
-                user_id BIGINT NOT NULL,
-                from_currency TEXT NOT NULL,
-                to_currency TEXT NOT NULL,
-                threshold DECIMAL NOT NULL,
-                direction TEXT NOT NULL CHECK (direction IN ('above', 'below')),
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                is_active BOOLEAN DEFAULT TRUE,
-                FOREIGN KEY (user_id) REFERENCES users(user_id) ON DELETE CASCADE
-            );
-        ''')
+        async with acquire() as conn:
+            # Создаем таблицу users
+            await conn.execute('''
+                CREATE TABLE IF NOT EXISTS users (
+                    user_id BIGINT PRIMARY KEY,
+                    first_name TEXT,
+                    username TEXT,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                );
+            ''')
         
-        # Проверяем существование колонки is_active и добавляем если нет
-        try:
-            # Проверяем существование колонки
-            result = await conn.fetchval('''
-                SELECT column_name 
-                FROM information_schema.columns 
-                WHERE table_name='alerts' AND column_name='is_active'
+            # Создаем таблицу alerts
+            await conn.execute('''
+                CREATE TABLE IF NOT EXISTS alerts (
+                    id SERIAL PRIMARY KEY,
+                    user_id BIGINT NOT NULL,
+                    from_currency TEXT NOT NULL,
+                    to_currency TEXT NOT NULL,
+                    threshold DECIMAL NOT NULL,
+                    direction TEXT NOT NULL CHECK (direction IN ('above', 'below')),
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    is_active BOOLEAN DEFAULT TRUE,
+                    FOREIGN KEY (user_id) REFERENCES users(user_id) ON DELETE CASCADE
+                );
             ''')
+        
+            # Проверяем существование колонки is_active и добавляем если нет
+            try:
+                # Проверяем существование колонки
+                result = await conn.fetchval('''
+                    SELECT column_name 
+                    FROM information_schema.columns 
+                    WHERE table_name='alerts' AND column_name='is_active'
+                ''')
             
-            if result is None:
-                # Добавляем колонку is_active если её нет
-                await conn.execute('ALTER TABLE alerts ADD COLUMN is_active BOOLEAN DEFAULT TRUE')
-                print("Колонка is_active добавлена в таблицу alerts")
-            else:
-                print("Колонка is_active уже существует")
+                if result is None:
+                    # Добавляем колонку is_active если её нет
+                    await conn.execute('ALTER TABLE alerts ADD COLUMN is_active BOOLEAN DEFAULT TRUE')
+                    print("Колонка is_active добавлена в таблицу alerts")
+                else:
+                    print("Колонка is_active уже существует")
                 
-        except Exception as e:
-            print(f"Ошибка при проверке/добавлении колонки is_active: {e}")
-            # Если не удалось проверить, просто продолжаем
-        
-        await conn.close()
+            except Exception as e:
+                print(f"Ошибка при проверке/добавлении колонки is_active: {e}")
+                # Если не удалось проверить, просто продолжаем
+            
+            # Частичный индекс для выборки сработавших уведомлений
+            await conn.execute('''
+                CREATE INDEX IF NOT EXISTS alerts_active_threshold_idx
+                ON alerts (from_currency, direction, threshold)
+                WHERE is_active
+            ''')
+            
+            # Создаем таблицу контрольных точек рассылок
+            await conn.execute('''
+                CREATE TABLE IF NOT EXISTS broadcast_checkpoints (
+                    broadcast_id TEXT PRIMARY KEY,
+                    kind TEXT NOT NULL,
+                    last_user_id BIGINT,
+                    sent INTEGER DEFAULT 0,
+                    failed INTEGER DEFAULT 0,
+                    completed BOOLEAN DEFAULT FALSE,
+                    started_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                );
+            ''')
+            
+            # Создаем таблицу кэша ответов ИИ
+            await conn.execute('''
+                CREATE TABLE IF NOT EXISTS ai_answer_cache (
+                    cache_key TEXT PRIMARY KEY,
+                    prompt TEXT NOT NULL,
+                    answer TEXT NOT NULL,
+                    hits INTEGER DEFAULT 0,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    last_used_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                );
+            ''')
+            
+            # Создаем таблицу истории курсов ЦБ РФ
+            await conn.execute('''
+                CREATE TABLE IF NOT EXISTS rates_history (
+                    date DATE NOT NULL,
+                    currency TEXT NOT NULL,
+                    value NUMERIC NOT NULL,
+                    nominal INTEGER NOT NULL,
+                    PRIMARY KEY (currency, date)
+                );
+            ''')
+            
+            # Создаем таблицу истории ключевой ставки ЦБ РФ (по рабочим дням)
+            await conn.execute('''
+                CREATE TABLE IF NOT EXISTS key_rate_history (
+                    date DATE PRIMARY KEY,
+                    rate NUMERIC NOT NULL
+                );
+            ''')
+            
+            # Создаем таблицу данных пользователей и чатов (user_data / chat_data бота)
+            await conn.execute('''
+                CREATE TABLE IF NOT EXISTS bot_state (
+                    kind TEXT NOT NULL,
+                    id BIGINT NOT NULL,
+                    data JSONB NOT NULL,
+                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    PRIMARY KEY (kind, id)
+                );
+            ''')
         print("Таблицы созданы успешно")
     except Exception as e:
         print(f"Ошибка при создании таблиц: {e}")
@@ -65,27 +221,37 @@ async def init_db():
 async def update_user_info(user_id: int, first_name: str, username: str = None):
     """Обновление информации о пользователе"""
     try:
-        conn = await asyncpg.connect(DATABASE_URL)
-        await conn.execute('''
-            INSERT INTO users (user_id, first_name, username)
-            VALUES ($1, $2, $3)
-            ON CONFLICT (user_id)
-            DO UPDATE SET first_name = $2, username = $3
-        ''', user_id, first_name, username)
-        await conn.close()
+        async with acquire() as conn:
+            await conn.execute('''
+                INSERT INTO users (user_id, first_name, username)
+                VALUES ($1, $2, $3)
+                ON CONFLICT (user_id)
+                DO UPDATE SET first_name = $2, username = $3
+            ''', user_id, first_name, username)
     except Exception as e:
         print(f"Ошибка при обновлении информации о пользователе: {e}")
         raise
 
+async def _notify_alerts_changed(conn, op: str, **data):
+    """
+    Сообщает другим репликам об изменении уведомлений: операция индекса
+    (add - уведомление целиком, remove - id, remove_user - user_id)
+    """
+    payload = json.dumps({'origin': INSTANCE_ID, 'op': op, **data}, default=float)
+    await conn.execute('SELECT pg_notify($1, $2)', ALERTS_CHANNEL, payload)
+
 async def add_alert(user_id: int, from_curr: str, to_curr: str, threshold: float, direction: str):
     """Добавление уведомления"""
     try:
-        conn = await asyncpg.connect(DATABASE_URL)
-        await conn.execute('''
-            INSERT INTO alerts (user_id, from_currency, to_currency, threshold, direction)
-            VALUES ($1, $2, $3, $4, $5)
-        ''', user_id, from_curr, to_curr, threshold, direction)
-        await conn.close()
+        async with acquire() as conn:
+            alert = await conn.fetchrow('''
+                INSERT INTO alerts (user_id, from_currency, to_currency, threshold, direction)
+                VALUES ($1, $2, $3, $4, $5)
+                RETURNING id, user_id, from_currency, to_currency, threshold, direction
+            ''', user_id, from_curr, to_curr, threshold, direction)
+            await _notify_alerts_changed(conn, 'add', alert=dict(alert))
+        alert_index.add(alert)
+        return alert['id']
     except Exception as e:
         print(f"Ошибка при добавлении уведомления: {e}")
         raise
@@ -93,20 +259,88 @@ async def add_alert(user_id: int, from_curr: str, to_curr: str, threshold: float
 async def get_all_users():
     """Получение всех пользователей"""
     try:
-        conn = await asyncpg.connect(DATABASE_URL)
-        users = await conn.fetch('SELECT user_id FROM users')
-        await conn.close()
+        async with acquire() as conn:
+            users = await conn.fetch('SELECT user_id FROM users')
         return users
     except Exception as e:
         print(f"Ошибка при получении пользователей: {e}")
         return []
 
+async def count_users() -> int:
+    """Количество пользователей"""
+    try:
+        async with acquire() as conn:
+            return await conn.fetchval('SELECT COUNT(*) FROM users')
+    except Exception as e:
+        print(f"Ошибка при подсчете пользователей: {e}")
+        return 0
+
+async def iter_user_id_pages(after_user_id: int = None, page_size: int = 1000):
+    """Постраничный обход id пользователей по возрастанию (keyset pagination)"""
+    last_user_id = after_user_id
+    while True:
+        async with acquire() as conn:
+            if last_user_id is None:
+                rows = await conn.fetch(
+                    'SELECT user_id FROM users ORDER BY user_id LIMIT $1', page_size
+                )
+            else:
+                rows = await conn.fetch(
+                    'SELECT user_id FROM users WHERE user_id > $1 ORDER BY user_id LIMIT $2',
+                    last_user_id, page_size
+                )
+        if not rows:
+            return
+        
+        page = [row['user_id'] for row in rows]
+        yield page
+        last_user_id = page[-1]
+
+async def get_broadcast_checkpoint(broadcast_id: str):
+    """Получение контрольной точки рассылки"""
+    try:
+        async with acquire() as conn:
+            return await conn.fetchrow(
+                'SELECT * FROM broadcast_checkpoints WHERE broadcast_id = $1', broadcast_id
+            )
+    except Exception as e:
+        print(f"Ошибка при получении контрольной точки рассылки: {e}")
+        raise
+
+async def save_broadcast_checkpoint(broadcast_id: str, kind: str, last_user_id: int,
+                                    sent: int, failed: int, completed: bool = False):
+    """Сохранение контрольной точки рассылки (последний обработанный user_id)"""
+    try:
+        async with acquire() as conn:
+            await conn.execute('''
+                INSERT INTO broadcast_checkpoints (broadcast_id, kind, last_user_id, sent, failed, completed)
+                VALUES ($1, $2, $3, $4, $5, $6)
+                ON CONFLICT (broadcast_id)
+                DO UPDATE SET last_user_id = $3, sent = $4, failed = $5, completed = $6,
+                              updated_at = CURRENT_TIMESTAMP
+            ''', broadcast_id, kind, last_user_id, sent, failed, completed)
+    except Exception as e:
+        print(f"Ошибка при сохранении контрольной точки рассылки: {e}")
+        raise
+
+async def get_unfinished_broadcasts(since):
+    """Получение незавершенных рассылок, начатых после since"""
+    try:
+        async with acquire() as conn:
+            return await conn.fetch('''
+                SELECT * FROM broadcast_checkpoints
+                WHERE NOT completed AND started_at >= $1
+                ORDER BY started_at
+            ''', since)
+    except Exception as e:
+        print(f"Ошибка при получении незавершенных рассылок: {e}")
+        return []
+
 async def get_all_alerts():
     """Получение всех уведомлений"""
     try:
-        conn = await asyncpg.connect(DATABASE_URL)
-        alerts = await conn.fetch('SELECT * FROM alerts')
-        await conn.close()
+        async with acquire() as conn:
+            alerts = await conn.fetch('SELECT * FROM alerts')
         return alerts
     except Exception as e:
         print(f"Ошибка при получении уведомлений: {e}")
@@ -115,22 +349,19 @@ async def get_all_alerts():
 async def get_user_alerts(user_id: int):
     """Получение уведомлений пользователя"""
     try:
-        conn = await asyncpg.connect(DATABASE_URL)
-        
-        # Сначала проверяем существование колонки is_active
-        try:
-            alerts = await conn.fetch(
-                'SELECT * FROM alerts WHERE user_id = $1 AND is_active = TRUE ORDER BY created_at DESC', 
-                user_id
-            )
-        except asyncpg.exceptions.UndefinedColumnError:
-            # Если колонки is_active нет, получаем все активные уведомления
-            alerts = await conn.fetch(
-                'SELECT * FROM alerts WHERE user_id = $1 ORDER BY created_at DESC', 
-                user_id
-            )
-        
-        await conn.close()
+        async with acquire() as conn:
+            # Сначала проверяем существование колонки is_active
+            try:
+                alerts = await conn.fetch(
+                    'SELECT * FROM alerts WHERE user_id = $1 AND is_active = TRUE ORDER BY created_at DESC', 
+                    user_id
+                )
+            except asyncpg.exceptions.UndefinedColumnError:
+                # Если колонки is_active нет, получаем все активные уведомления
+                alerts = await conn.fetch(
+                    'SELECT * FROM alerts WHERE user_id = $1 ORDER BY created_at DESC', 
+                    user_id
+                )
         return alerts
     except Exception as e:
         print(f"Ошибка при получении уведомлений пользователя: {e}")
@@ -139,9 +370,10 @@ async def get_user_alerts(user_id: int):
 async def remove_alert(alert_id: int):
     """Удаление уведомления"""
     try:
-        conn = await asyncpg.connect(DATABASE_URL)
-        await conn.execute('DELETE FROM alerts WHERE id = $1', alert_id)
-        await conn.close()
+        async with acquire() as conn:
+            await conn.execute('DELETE FROM alerts WHERE id = $1', alert_id)
+            await _notify_alerts_changed(conn, 'remove', id=alert_id)
+        alert_index.remove(alert_id)
     except Exception as e:
         print(f"Ошибка при удалении уведомления: {e}")
         raise
@@ -149,16 +381,14 @@ async def remove_alert(alert_id: int):
 async def deactivate_alert(alert_id: int):
     """Деактивация уведомления (помечаем как неактивное)"""
     try:
-        conn = await asyncpg.connect(DATABASE_URL)
-        
-        # Сначала проверяем существование колонки is_active
-        try:
-            await conn.execute('UPDATE alerts SET is_active = FALSE WHERE id = $1', alert_id)
-        except asyncpg.exceptions.UndefinedColumnError:
-            # Если колонки is_active нет, удаляем уведомление
-            await conn.execute('DELETE FROM alerts WHERE id = $1', alert_id)
-        
-        await conn.close()
+        async with acquire() as conn:
+            # Сначала проверяем существование колонки is_active
+            try:
+                await conn.execute('UPDATE alerts SET is_active = FALSE WHERE id = $1', alert_id)
+            except asyncpg.exceptions.UndefinedColumnError:
+                # Если колонки is_active нет, удаляем уведомление
+                await conn.execute('DELETE FROM alerts WHERE id = $1', alert_id)
+        alert_index.remove(alert_id)
     except Exception as e:
         print(f"Ошибка при деактивации уведомления: {e}")
         raise
@@ -166,27 +396,249 @@ async def deactivate_alert(alert_id: int):
 async def get_all_active_alerts():
     """Получение всех активных уведомлений"""
     try:
-        conn = await asyncpg.connect(DATABASE_URL)
-        
-        # Сначала проверяем существование колонки is_active
-        try:
-            alerts = await conn.fetch('SELECT * FROM alerts WHERE is_active = TRUE')
-        except asyncpg.exceptions.UndefinedColumnError:
-            # Если колонки is_active нет, получаем все уведомления
-            alerts = await conn.fetch('SELECT * FROM alerts')
-        
-        await conn.close()
+        async with acquire() as conn:
+            # Сначала проверяем существование колонки is_active
+            try:
+                alerts = await conn.fetch('SELECT * FROM alerts WHERE is_active = TRUE')
+            except asyncpg.exceptions.UndefinedColumnError:
+                # Если колонки is_active нет, получаем все уведомления
+                alerts = await conn.fetch('SELECT * FROM alerts')
         return alerts
     except Exception as e:
         print(f"Ошибка при получении всех уведомлений: {e}")
         return []
 
+async def trigger_crossed_alerts(rates: dict):
+    """
+    Деактивирует все уведомления, пороги которых пересечены текущими курсами
+    ({валюта: курс}), одним запросом и возвращает сработавшие уведомления
+    """
+    if not rates:
+        return []
+    
+    currencies = list(rates)
+    values = [Decimal(str(rates[currency])) for currency in currencies]
+    try:
+        async with acquire() as conn:
+            alerts = await conn.fetch('''
+                UPDATE alerts AS a
+                SET is_active = FALSE
+                FROM unnest($1::text[], $2::numeric[]) AS r(currency, rate)
+                WHERE a.is_active
+                  AND a.from_currency = r.currency
+                  AND ((a.direction = 'above' AND r.rate >= a.threshold)
+                    OR (a.direction = 'below' AND r.rate <= a.threshold))
+                RETURNING a.id, a.user_id, a.from_currency, a.to_currency,
+                          a.threshold, a.direction, r.rate AS current_rate
+            ''', currencies, values)
+        for alert in alerts:
+            alert_index.remove(alert['id'])
+        return alerts
+    except Exception as e:
+        print(f"Ошибка при выборке сработавших уведомлений: {e}")
+        raise
+
+async def load_alert_index():
+    """Загрузка индекса активных уведомлений из БД"""
+    try:
+        async with acquire() as conn:
+            alerts = await conn.fetch('''
+                SELECT id, user_id, from_currency, to_currency, threshold, direction
+                FROM alerts WHERE is_active = TRUE
+            ''')
+        alert_index.load(alerts)
+        print(f"Индекс уведомлений загружен: {len(alert_index)} активных")
+    except Exception as e:
+        print(f"Ошибка при загрузке индекса уведомлений: {e}")
+        raise
+
 async def clear_user_alerts(user_id: int):
     """Очистка всех уведомлений пользователя"""
     try:
-        conn = await asyncpg.connect(DATABASE_URL)
-        await conn.execute('DELETE FROM alerts WHERE user_id = $1', user_id)
-        await conn.close()
+        async with acquire() as conn:
+            await conn.execute('DELETE FROM alerts WHERE user_id = $1', user_id)
+            await _notify_alerts_changed(conn, 'remove_user', user_id=user_id)
+        alert_index.remove_user(user_id)
     except Exception as e:
         print(f"Ошибка при очистке уведомлений пользователя: {e}")
         raise
+
+async def save_rates_history(records: list) -> int:
+    """Массовое сохранение курсов (date, currency, value, nominal) в историю"""
+    if not records:
+        return 0
+    
+    try:
+        async with acquire() as conn:
+            async with conn.transaction():
+                # Загружаем через COPY во временную таблицу, затем переносим без дублей
+                await conn.execute('''
+                    CREATE TEMP TABLE IF NOT EXISTS rates_history_staging
+                    (LIKE rates_history) ON COMMIT DELETE ROWS
+                ''')
+                # Логгер запросов asyncpg не вызывается для COPY - замеряем явно
+                with db_query_latency.time('COPY rates_history_staging'), span('db', statement='COPY rates_history_staging'):
+                    await conn.copy_records_to_table(
+                        'rates_history_staging',
+                        records=records,
+                        columns=['date', 'currency', 'value', 'nominal']
+                    )
+                result = await conn.execute('''
+                    INSERT INTO rates_history (date, currency, value, nominal)
+                    SELECT date, currency, value, nominal FROM rates_history_staging
+                    ON CONFLICT (currency, date) DO NOTHING
+                ''')
+        return int(result.split()[-1])
+    except Exception as e:
+        print(f"Ошибка при сохранении истории курсов: {e}")
+        raise
+
+async def get_rates_history(currency: str, date_from, date_to):
+    """Получение истории курса валюты за период"""
+    try:
+        async with acquire() as conn:
+            rows = await conn.fetch('''
+                SELECT date, currency, value, nominal
+                FROM rates_history
+                WHERE currency = $1 AND date BETWEEN $2 AND $3
+                ORDER BY date
+            ''', currency, date_from, date_to)
+        return rows
+    except Exception as e:
+        print(f"Ошибка при получении истории курсов: {e}")
+        return []
+
+async def get_rates_history_last_dates() -> dict:
+    """Получение последней сохраненной даты истории по каждой валюте"""
+    try:
+        async with acquire() as conn:
+            rows = await conn.fetch('SELECT currency, MAX(date) AS last_date FROM rates_history GROUP BY currency')
+        return {row['currency']: row['last_date'] for row in rows}
+    except Exception as e:
+        print(f"Ошибка при получении последних дат истории курсов: {e}")
+        raise
+
+async def save_key_rate_history(rows: list) -> int:
+    """Сохранение строк (date, rate) истории ключевой ставки, уже сохраненные даты пропускаются"""
+    if not rows:
+        return 0
+    
+    try:
+        async with acquire() as conn:
+            result = await conn.execute('''
+                INSERT INTO key_rate_history (date, rate)
+                SELECT * FROM unnest($1::date[], $2::numeric[])
+                ON CONFLICT (date) DO NOTHING
+            ''', [row[0] for row in rows], [row[1] for row in rows])
+        return int(result.split()[-1])
+    except Exception as e:
+        print(f"Ошибка при сохранении истории ключевой ставки: {e}")
+        raise
+
+async def get_key_rate_last_date():
+    """Последняя сохраненная дата истории ключевой ставки (None, если история пуста)"""
+    try:
+        async with acquire() as conn:
+            return await conn.fetchval('SELECT MAX(date) FROM key_rate_history')
+    except Exception as e:
+        print(f"Ошибка при получении последней даты ключевой ставки: {e}")
+        raise
+
+async def get_latest_key_rate(on_date):
+    """Ключевая ставка на дату: последняя сохраненная строка не позже on_date"""
+    try:
+        async with acquire() as conn:
+            return await conn.fetchrow('''
+                SELECT date, rate FROM key_rate_history
+                WHERE date <= $1
+                ORDER BY date DESC
+                LIMIT 1
+            ''', on_date)
+    except Exception as e:
+        print(f"Ошибка при получении ключевой ставки из истории: {e}")
+        return None
+
+async def get_cached_ai_answer(cache_key: str, ttl: int):
+    """Получение ответа ИИ из кэша (не старше ttl секунд)"""
+    try:
+        async with acquire() as conn:
+            return await conn.fetchval('''
+                UPDATE ai_answer_cache
+                SET hits = hits + 1, last_used_at = CURRENT_TIMESTAMP
+                WHERE cache_key = $1
+                  AND created_at > CURRENT_TIMESTAMP - make_interval(secs => $2)
+                RETURNING answer
+            ''', cache_key, ttl)
+    except Exception as e:
+        print(f"Ошибка при получении ответа ИИ из кэша: {e}")
+        return None
+
+async def save_cached_ai_answer(cache_key: str, prompt: str, answer: str):
+    """Сохранение ответа ИИ в кэш"""
+    try:
+        async with acquire() as conn:
+            await conn.execute('''
+                INSERT INTO ai_answer_cache (cache_key, prompt, answer)
+                VALUES ($1, $2, $3)
+                ON CONFLICT (cache_key)
+                DO UPDATE SET answer = $3, created_at = CURRENT_TIMESTAMP, last_used_at = CURRENT_TIMESTAMP
+            ''', cache_key, prompt, answer)
+    except Exception as e:
+        print(f"Ошибка при сохранении ответа ИИ в кэш: {e}")
+
+async def evict_ai_answer_cache(ttl: int, max_rows: int) -> int:
+    """Удаление устаревших записей кэша ИИ и самых давно использованных сверх max_rows"""
+    try:
+        async with acquire() as conn:
+            expired = await conn.execute('''
+                DELETE FROM ai_answer_cache
+                WHERE created_at <= CURRENT_TIMESTAMP - make_interval(secs => $1)
+            ''', ttl)
+            overflow = await conn.execute('''
+                DELETE FROM ai_answer_cache
+                WHERE cache_key IN (
+                    SELECT cache_key FROM ai_answer_cache
+                    ORDER BY last_used_at DESC
+                    OFFSET $1
+                )
+            ''', max_rows)
+        return int(expired.split()[-1]) + int(overflow.split()[-1])
+    except Exception as e:
+        print(f"Ошибка при очистке кэша ответов ИИ: {e}")
+        return 0
+
+async def get_bot_state(kind: str, state_id: int):
+    """Получение сохраненных данных пользователя или чата (JSON-строка или None)"""
+    try:
+        async with acquire() as conn:
+            return await conn.fetchval(
+                'SELECT data::text FROM bot_state WHERE kind = $1 AND id = $2', kind, state_id
+            )
+    except Exception as e:
+        print(f"Ошибка при получении данных {kind} {state_id}: {e}")
+        raise
+
+async def save_bot_state(rows: list):
+    """Сохранение пачки данных [(kind, id, json), ...] одним executemany"""
+    if not rows:
+        return
+    try:
+        async with acquire() as conn:
+            await conn.executemany('''
+                INSERT INTO bot_state (kind, id, data, updated_at)
+                VALUES ($1, $2, $3::jsonb, CURRENT_TIMESTAMP)
+                ON CONFLICT (kind, id)
+                DO UPDATE SET data = EXCLUDED.data, updated_at = EXCLUDED.updated_at
+            ''', rows)
+    except Exception as e:
+        print(f"Ошибка при сохранении данных пользователей: {e}")
+        raise
+
+async def delete_bot_state(kind: str, state_id: int):
+    """Удаление данных пользователя или чата"""
+    try:
+        async with acquire() as conn:
+            await conn.execute('DELETE FROM bot_state WHERE kind = $1 AND id = $2', kind, state_id)
+    except Exception as e:
+        print(f"Ошибка при удалении данных {kind} {state_id}: {e}")
+        raise
@@ -1,15 +1,41 @@
 import logging
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes
-from config import logger, DEEPSEEK_API_KEY
+from config import logger, DEEPSEEK_API_KEY, AI_STREAMING, AI_STREAM_EDIT_INTERVAL
 from services import (
     get_currency_rates_with_tomorrow, format_currency_rates_message, 
-    get_key_rate, format_key_rate_message, get_crypto_rates, 
-    get_crypto_rates_fallback, format_crypto_rates_message, ask_deepseek
+    get_key_rate_demo, format_key_rate_message, 
+    get_crypto_rates_fallback, format_crypto_rates_message, ask_deepseek, ask_deepseek_stream, AIError, snapshots,
+    is_ai_available
 )
-from utils import split_long_message, create_back_button
+from utils import split_long_message, create_back_button, format_snapshot_age, StreamingReply
+from ai_memory import get_history_messages, remember_turn, reset_memory
+from ai_cache import get_cached_answer, store_answer
+from ai_scheduler import ai_scheduler
+from tracing import traced
 from db import get_user_alerts, clear_user_alerts, remove_alert, add_alert, update_user_info
-from services import get_weather_moscow, format_weather_message
+from services import get_weather_demo, format_weather_message
+
+def build_main_menu_keyboard(ai_available: bool) -> InlineKeyboardMarkup:
+    """Клавиатура главного меню"""
+    keyboard = [
+        [InlineKeyboardButton("💱 Курсы валют", callback_data='currency_rates')],
+        [InlineKeyboardButton("₿ Криптовалюты", callback_data='crypto_rates')],
+        [InlineKeyboardButton("💎 Ключевая ставка", callback_data='key_rate')],
+    ]
+    
+    if ai_available:
+        keyboard.append([InlineKeyboardButton("🤖 Универсальный ИИ", callback_data='ai_chat')])
+    else:
+        keyboard.append([InlineKeyboardButton("❌ ИИ временно недоступен", callback_data='ai_unavailable')])
+        
+    keyboard.extend([
+        [InlineKeyboardButton("🔔 Мои уведомления", callback_data='my_alerts')],
+        [InlineKeyboardButton("🔧 Прочие функции", callback_data='other_functions')],
+        [InlineKeyboardButton("❓ Помощь", callback_data='help')],
+    ])
+    
+    return InlineKeyboardMarkup(keyboard)
 
 # Основные команды
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -20,28 +46,8 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         
         greeting = f"Привет, {user.first_name}!" if user.first_name else "Привет!"
         
-        # Проверяем доступность ИИ
-        test_ai = await ask_deepseek("test", context)
-        ai_available = not (test_ai.startswith("❌") or test_ai.startswith("⏰"))
-        
-        keyboard = [
-            [InlineKeyboardButton("💱 Курсы валют", callback_data='currency_rates')],
-            [InlineKeyboardButton("₿ Криптовалюты", callback_data='crypto_rates')],
-            [InlineKeyboardButton("💎 Ключевая ставка", callback_data='key_rate')],
-        ]
-        
-        if ai_available:
-            keyboard.append([InlineKeyboardButton("🤖 Универсальный ИИ", callback_data='ai_chat')])
-        else:
-            keyboard.append([InlineKeyboardButton("❌ ИИ временно недоступен", callback_data='ai_unavailable')])
-            
-        keyboard.extend([
-            [InlineKeyboardButton("🔔 Мои уведомления", callback_data='my_alerts')],
-            [InlineKeyboardButton("🔧 Прочие функции", callback_data='other_functions')],
-            [InlineKeyboardButton("❓ Помощь", callback_data='help')],
-        ])
-        
-        reply_markup = InlineKeyboardMarkup(keyboard)
+        # Доступность ИИ берем из реестра состояния (без запроса к API)
+        reply_markup = build_main_menu_keyboard(is_ai_available())
         
         start_message = f'{greeting} Я бот для отслеживания финансовых данных!\n\nВыберите раздел:'
         await update.message.reply_text(start_message, parse_mode='HTML', reply_markup=reply_markup)
@@ -76,7 +82,7 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
 async def show_currency_rates(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Показывает курсы валют"""
     try:
-        rates_today, date_today, rates_tomorrow, changes = get_currency_rates_with_tomorrow()
+        rates_today, date_today, rates_tomorrow, changes = await get_currency_rates_with_tomorrow()
         
         if not rates_today:
             await update.effective_message.reply_text(
@@ -95,7 +101,10 @@ async def show_currency_rates(update: Update, context: ContextTypes.DEFAULT_TYPE
 async def show_key_rate(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Показывает ключевую ставку"""
     try:
-        key_rate_data = get_key_rate()
+        # Берем последний снимок, обновляемый в фоне
+        key_rate_data, age = snapshots.get('key_rate')
+        if not key_rate_data:
+            key_rate_data = get_key_rate_demo()
         
         if not key_rate_data:
             await update.effective_message.reply_text(
@@ -105,6 +114,7 @@ async def show_key_rate(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
             return
         
         message = format_key_rate_message(key_rate_data)
+        message += format_snapshot_age(age)
         
         keyboard = [
             [InlineKeyboardButton("💱 Курсы валют", callback_data='currency_rates')],
@@ -121,16 +131,12 @@ async def show_key_rate(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
 async def show_crypto_rates(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Показывает курсы криптовалют"""
     try:
-        # Показываем сообщение о загрузке
-        loading_message = "🔄 <b>Загружаем курсы криптовалют...</b>"
-        await update.effective_message.reply_text(loading_message, parse_mode='HTML', reply_markup=create_back_button())
-        
-        # Получаем данные
-        crypto_rates = get_crypto_rates()
+        # Берем последний снимок, обновляемый в фоне
+        crypto_rates, age = snapshots.get('crypto')
         
-        # Если не удалось получить данные, используем fallback
+        # Если снимка еще нет, используем fallback
         if not crypto_rates:
-            logger.warning("Не удалось получить данные от CoinGecko, используем fallback")
+            logger.warning("Снимок курсов криптовалют недоступен, используем fallback")
             crypto_rates = get_crypto_rates_fallback()
         
         if not crypto_rates:
@@ -143,6 +149,8 @@ async def show_crypto_rates(update: Update, context: ContextTypes.DEFAULT_TYPE)
         # Добавляем предупреждение если используем демо-данные
         if crypto_rates.get('source') == 'demo_fallback':
             message_text += "\n\n⚠️ <i>Используются демонстрационные данные (CoinGecko API недоступен)</i>"
+        else:
+            message_text += format_snapshot_age(age)
         
         # Клавиатура с кнопками
         keyboard = [
@@ -165,8 +173,9 @@ async def show_ai_chat(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
             await update.effective_message.reply_text(error_msg, parse_mode='HTML', reply_markup=create_back_button())
             return
         
-        # Активируем режим ИИ для пользователя
+        # Активируем режим ИИ для пользователя и начинаем новый диалог
         context.user_data['ai_mode'] = True
+        reset_memory(context.user_data)
         
         welcome_message = (
             "🤖 <b>УНИВЕРСАЛЬНЫЙ ИИ ПОМОЩНИК</b>\n\n"
@@ -390,6 +399,108 @@ async def show_settings(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
             reply_markup=create_back_button()
         )
 
+async def _save_ai_turn(context: ContextTypes.DEFAULT_TYPE, question: str, answer: str, cache: bool):
+    """Сохраняет полностью полученный ответ в памяти диалога и, если нужно, в кэше ответов"""
+    if not answer:
+        return
+    
+    remember_turn(context.user_data, question, answer)
+    if cache:
+        await store_answer(question, answer)
+
+@traced('ai_queue_wait')
+async def _wait_ai_turn(update: Update, user_id: int) -> bool:
+    """Ждет очереди к ИИ, показывая позицию; False - если вопрос заменен более новым"""
+    status_message = None
+    
+    async def show_position(position: int):
+        nonlocal status_message
+        text = f"⏳ Ваш вопрос в очереди: {position}-й. Ответ начнется автоматически."
+        if status_message is None:
+            status_message = await update.message.reply_text(text)
+        else:
+            await status_message.edit_text(text)
+    
+    granted = await ai_scheduler.acquire(user_id, on_position=show_position)
+    
+    if status_message is not None:
+        try:
+            if granted:
+                await status_message.delete()
+            else:
+                await status_message.edit_text("↪️ Вопрос заменен вашим новым сообщением.")
+        except Exception as e:
+            logger.warning(f"Не удалось обновить сообщение очереди ИИ: {e}")
+    
+    return granted
+
+async def _reply_ai(update: Update, context: ContextTypes.DEFAULT_TYPE, user_message: str,
+                    history: list, cached_answer: str = None):
+    """Отвечает на вопрос из кэша или через DeepSeek"""
+    keyboard = InlineKeyboardMarkup([
+        [InlineKeyboardButton("🔄 Новый вопрос", callback_data='ai_chat')],
+        [InlineKeyboardButton("🔙 Назад в меню", callback_data='back_to_main')]
+    ])
+    
+    if cached_answer is not None or AI_STREAMING:
+        # Выводим ответ по мере генерации, редактируя сообщение
+        reply = StreamingReply(
+            update.message,
+            header="🤖 <b>ИИ Ассистент:</b>\n\n",
+            edit_interval=AI_STREAM_EDIT_INTERVAL
+        )
+        if cached_answer is not None:
+            answer = cached_answer
+            await reply.append(answer)
+        else:
+            chunks = []
+            try:
+                async for delta in ask_deepseek_stream(user_message, history):
+                    chunks.append(delta)
+                    await reply.append(delta)
+            except AIError as e:
+                # Неполный ответ не сохраняется ни в памяти диалога, ни в кэше
+                await reply.append(("\n\n" if chunks else "") + str(e))
+                await reply.finish(reply_markup=keyboard)
+                return
+            answer = ''.join(chunks)
+        
+        await reply.finish(reply_markup=keyboard)
+        await _save_ai_turn(context, user_message, answer, cache=not history and cached_answer is None)
+        return
+    
+    # Отправляем запрос к DeepSeek
+    try:
+        ai_response = await ask_deepseek(user_message, context, history)
+        await _save_ai_turn(context, user_message, ai_response, cache=not history)
+    except AIError as e:
+        ai_response = str(e)
+    
+    # Разбиваем длинные сообщения на части
+    message_parts = await split_long_message(ai_response)
+    
+    # Отправляем первую часть с клавиатурой
+    first_part = message_parts[0]
+    if len(message_parts) > 1:
+        first_part += f"\n\n📄 <i>Часть 1 из {len(message_parts)}</i>"
+    
+    await update.message.reply_text(
+        f"🤖 <b>ИИ Ассистент:</b>\n\n{first_part}",
+        parse_mode='HTML',
+        reply_markup=keyboard
+    )
+    
+    # Отправляем остальные части
+    for i, part in enumerate(message_parts[1:], 2):
+        part_text = part
+        if i < len(message_parts):
+            part_text += f"\n\n📄 <i>Часть {i} из {len(message_parts)}</i>"
+        
+        await update.message.reply_text(
+            part_text,
+            parse_mode='HTML'
+        )
+
 async def handle_ai_message(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Обрабатывает текстовые сообщения для ИИ"""
     try:
@@ -404,39 +515,28 @@ async def handle_ai_message(update: Update, context: ContextTypes.DEFAULT_TYPE)
         if context.user_data.get('ai_mode') != True:
             return
             
-        # Показываем индикатор набора сообщения
-        await update.message.chat.send_action(action="typing")
+        # Предыдущие реплики диалога (в пределах бюджета токенов)
+        history = get_history_messages(context.user_data)
         
-        # Отправляем запрос к DeepSeek
-        ai_response = await ask_deepseek(user_message, context)
-        
-        # Разбиваем длинные сообщения на части
-        message_parts = await split_long_message(ai_response)
-        
-        # Отправляем первую часть с клавиатурой
-        first_part = message_parts[0]
-        if len(message_parts) > 1:
-            first_part += f"\n\n📄 <i>Часть 1 из {len(message_parts)}</i>"
+        # Вопросы без контекста диалога сначала ищем в кэше ответов
+        cached_answer = None if history else await get_cached_answer(user_message)
+        if cached_answer is not None:
+            await _reply_ai(update, context, user_message, history, cached_answer)
+            return
         
-        await update.message.reply_text(
-            f"🤖 <b>ИИ Ассистент:</b>\n\n{first_part}",
-            parse_mode='HTML',
-            reply_markup=InlineKeyboardMarkup([
-                [InlineKeyboardButton("🔄 Новый вопрос", callback_data='ai_chat')],
-                [InlineKeyboardButton("🔙 Назад в меню", callback_data='back_to_main')]
-            ])
-        )
+        # Ждем свободного слота: общий лимит запросов к ИИ и не больше одного на пользователя
+        if not await _wait_ai_turn(update, user_id):
+            return
         
-        # Отправляем остальные части
-        for i, part in enumerate(message_parts[1:], 2):
-            part_text = part
-            if i < len(message_parts):
-                part_text += f"\n\n📄 <i>Часть {i} из {len(message_parts)}</i>"
+        try:
+            # Пока вопрос ждал, мог завершиться предыдущий ответ этому пользователю
+            history = get_history_messages(context.user_data)
             
-            await update.message.reply_text(
-                part_text,
-                parse_mode='HTML'
-            )
+            # Показываем индикатор набора сообщения
+            await update.message.chat.send_action(action="typing")
+            await _reply_ai(update, context, user_message, history)
+        finally:
+            ai_scheduler.release(user_id)
         
     except Exception as e:
         logger.error(f"Ошибка в обработчике ИИ сообщений: {e}")
@@ -511,7 +611,7 @@ async def alert_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
         await add_alert(user_id, from_curr, to_curr, threshold, direction)
         
         # Получаем текущий курс для информации
-        rates_today, _, _, _ = get_currency_rates_with_tomorrow()
+        rates_today, _, _, _ = await get_currency_rates_with_tomorrow()
         current_rate = "N/A"
         if rates_today and from_curr in rates_today:
             current_rate = f"{rates_today[from_curr]['value']:.2f}"
@@ -567,14 +667,15 @@ async def myalerts_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -
         
         message = "🔔 <b>ВАШИ АКТИВНЫЕ УВЕДОМЛЕНИЯ</b>\n\n"
         
+        # Получаем текущие курсы один раз для всех уведомлений
+        rates_today, _, _, _ = await get_currency_rates_with_tomorrow()
+        
         for i, alert in enumerate(alerts, 1):
             from_curr = alert['from_currency']
             to_curr = alert['to_currency']
             threshold = alert['threshold']
             direction = alert['direction']
             
-            # Получаем текущий курс для сравнения
-            rates_today, _, _, _ = get_currency_rates_with_tomorrow()
             current_rate = "N/A"
             if rates_today and from_curr in rates_today:
                 current_rate = f"{rates_today[from_curr]['value']:.2f}"
@@ -618,28 +719,8 @@ async def show_main_menu(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         user = update.effective_user
         greeting = f"Привет, {user.first_name}!" if user.first_name else "Привет!"
         
-        # Проверяем доступность ИИ
-        test_ai = await ask_deepseek("test", context)
-        ai_available = not (test_ai.startswith("❌") or test_ai.startswith("⏰"))
-        
-        keyboard = [
-            [InlineKeyboardButton("💱 Курсы валют", callback_data='currency_rates')],
-            [InlineKeyboardButton("₿ Криптовалюты", callback_data='crypto_rates')],
-            [InlineKeyboardButton("💎 Ключевая ставка", callback_data='key_rate')],
-        ]
-        
-        if ai_available:
-            keyboard.append([InlineKeyboardButton("🤖 Универсальный ИИ", callback_data='ai_chat')])
-        else:
-            keyboard.append([InlineKeyboardButton("❌ ИИ временно недоступен", callback_data='ai_unavailable')])
-            
-        keyboard.extend([
-            [InlineKeyboardButton("🔔 Мои уведомления", callback_data='my_alerts')],
-            [InlineKeyboardButton("🔧 Прочие функции", callback_data='other_functions')],
-            [InlineKeyboardButton("❓ Помощь", callback_data='help')],
-        ])
-        
-        reply_markup = InlineKeyboardMarkup(keyboard)
+        # Доступность ИИ берем из реестра состояния (без запроса к API)
+        reply_markup = build_main_menu_keyboard(is_ai_available())
         
         await update.effective_message.edit_text(
             f'{greeting} Я бот для отслеживания финансовых данных!\n\nВыберите раздел:',
@@ -755,13 +836,13 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
 async def show_weather(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Показывает текущую погоду в Москве"""
     try:
-        # Показываем сообщение о загрузке
-        loading_message = "🔄 <b>Загружаем данные о погоде...</b>"
-        await update.effective_message.reply_text(loading_message, parse_mode='HTML', reply_markup=create_back_button())
-        
-        # Получаем данные о погоде
-        weather_data = get_weather_moscow()
-        message = format_weather_message(weather_data)
+        # Берем последний снимок, обновляемый в фоне
+        weather_data, age = snapshots.get('weather')
+        if weather_data:
+            # Время обновления снимка уже выводится в конце сообщения
+            message = format_weather_message(weather_data, snapshots.get_snapshot('weather').updated_at)
+        else:
+            message = format_weather_message(get_weather_demo())
         
         keyboard = [
             [InlineKeyboardButton("🔄 Обновить", callback_data='weather')],
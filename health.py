@@ -0,0 +1,76 @@
+import time
+from collections import deque
+
+class ProviderHealth:
+    """Состояние внешнего провайдера по результатам последних обращений"""
+    
+    def __init__(self, name: str, window: int = 20, failure_threshold: int = 2):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.outcomes = deque(maxlen=window)  # (успех, задержка, время)
+        self.consecutive_failures = 0
+        self.fatal = False
+        self.last_error = None
+        self.last_checked = None
+    
+    def record(self, ok: bool, latency: float, error: str = None, fatal: bool = False):
+        """
+        Записывает результат обращения к провайдеру.
+        fatal - ошибка, которая не пройдет сама (неверный ключ, нет средств).
+        """
+        now = time.monotonic()
+        self.outcomes.append((ok, latency, now))
+        self.last_checked = now
+        if ok:
+            self.consecutive_failures = 0
+            self.fatal = False
+            self.last_error = None
+        else:
+            self.consecutive_failures += 1
+            self.fatal = self.fatal or fatal
+            self.last_error = error
+    
+    @property
+    def available(self) -> bool:
+        """Провайдер считается доступным, пока нет фатальной ошибки или серии сбоев"""
+        if self.fatal:
+            return False
+        return self.consecutive_failures < self.failure_threshold
+    
+    @property
+    def seconds_since_check(self):
+        if self.last_checked is None:
+            return None
+        return time.monotonic() - self.last_checked
+    
+    def stats(self) -> dict:
+        latencies = [latency for ok, latency, _ in self.outcomes if ok]
+        return {
+            'name': self.name,
+            'available': self.available,
+            'success_rate': sum(1 for ok, _, _ in self.outcomes if ok) / len(self.outcomes) if self.outcomes else None,
+            'avg_latency': sum(latencies) / len(latencies) if latencies else None,
+            'consecutive_failures': self.consecutive_failures,
+            'last_error': self.last_error,
+        }
+
+class HealthRegistry:
+    """Реестр состояния провайдеров"""
+    
+    def __init__(self):
+        self._providers = {}
+    
+    def get(self, name: str) -> ProviderHealth:
+        provider = self._providers.get(name)
+        if provider is None:
+            provider = self._providers[name] = ProviderHealth(name)
+        return provider
+    
+    def record(self, name: str, ok: bool, latency: float, error: str = None, fatal: bool = False):
+        self.get(name).record(ok, latency, error, fatal)
+    
+    def stats(self) -> list:
+        return [provider.stats() for provider in self._providers.values()]
+
+# Общий реестр состояния провайдеров процесса
+health = HealthRegistry()
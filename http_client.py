@@ -0,0 +1,46 @@
+import httpx
+from config import HTTP_PROVIDER_LIMITS, HTTP_KEEPALIVE_EXPIRY, logger
+from metrics import MetricsTransport
+from tracing import TracingTransport
+
+# Общие асинхронные HTTP клиенты (по одному пулу соединений на провайдера)
+_clients = {}
+
+def _create_client(provider: str) -> httpx.AsyncClient:
+    """Создает HTTP клиент с лимитами соединений для провайдера"""
+    settings = HTTP_PROVIDER_LIMITS.get(provider, {})
+    limits = httpx.Limits(
+        max_connections=settings.get('max_connections', 10),
+        max_keepalive_connections=settings.get('max_keepalive', 5),
+        keepalive_expiry=HTTP_KEEPALIVE_EXPIRY
+    )
+    return httpx.AsyncClient(
+        transport=TracingTransport(MetricsTransport(httpx.AsyncHTTPTransport(limits=limits), provider), provider),
+        timeout=settings.get('timeout', 10),
+        follow_redirects=True
+    )
+
+async def init_http_clients():
+    """Инициализация HTTP клиентов для всех провайдеров"""
+    for provider in HTTP_PROVIDER_LIMITS:
+        if provider not in _clients:
+            _clients[provider] = _create_client(provider)
+    logger.info(f"HTTP клиенты инициализированы: {', '.join(_clients)}")
+
+async def close_http_clients():
+    """Закрытие HTTP клиентов при остановке бота"""
+    for provider, client in list(_clients.items()):
+        try:
+            await client.aclose()
+        except Exception as e:
+            logger.error(f"Ошибка при закрытии HTTP клиента {provider}: {e}")
+    _clients.clear()
+    logger.info("HTTP клиенты закрыты")
+
+def get_http_client(provider: str) -> httpx.AsyncClient:
+    """Возвращает общий HTTP клиент провайдера (создает при первом обращении)"""
+    client = _clients.get(provider)
+    if client is None or client.is_closed:
+        client = _create_client(provider)
+        _clients[provider] = client
+    return client
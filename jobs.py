@@ -1,32 +1,90 @@
 import logging
 from telegram.ext import ContextTypes
 from datetime import datetime
-from services import check_alerts, send_daily_rates, send_daily_weather
-from config import logger
+from services import check_alerts, send_daily_rates, send_daily_weather, append_rates_history, resume_broadcasts, snapshots
+from services import probe_ai_health, evict_ai_cache, sync_key_rate_history_job, DAILY_BROADCAST_TIMES
+from config import logger, ALERT_CHECK_INTERVAL, AI_HEALTH_PROBE_INTERVAL, KEY_RATE_SYNC_INTERVAL
+from db import load_alert_index
+from leader import leader, leader_only
+
+def _on_elected(application):
+    """Задачи, которые новый лидер выполняет при получении лидерства"""
+    async def callback():
+        # Индекс мог устареть, пока задачи выполняла другая реплика
+        await load_alert_index()
+        
+        # Продолжение рассылок, прерванных перезапуском или падением прежнего лидера
+        application.job_queue.run_once(leader_only(resume_broadcasts), when=20, name="resume_broadcasts")
+        
+        # Первичная загрузка истории курсов, если она пуста или отстала
+        application.job_queue.run_once(leader_only(append_rates_history), when=30, name="rates_history_startup")
+        
+        # Первичная загрузка или дозагрузка истории ключевой ставки
+        application.job_queue.run_once(leader_only(sync_key_rate_history_job), when=25, name="key_rate_history_startup")
+    return callback
 
 def setup_jobs(application):
-    """Настройка фоновых задач"""
+    """
+    Настройка фоновых задач.
+    Рассылки, проверка уведомлений и обслуживание БД выполняются только на реплике-лидере;
+    обновление снимков и проверка ИИ нужны каждой реплике для ответов пользователям.
+    """
     job_queue = application.job_queue
     
     if job_queue:
-        # Ежедневная рассылка курсов валют в 10:00 (07:00 UTC)
+        # Ежедневная рассылка курсов валют (по умолчанию в 10:00 МСК)
         job_queue.run_daily(
-            send_daily_rates,
-            time=datetime.strptime("07:00", "%H:%M").time(),
+            leader_only(send_daily_rates),
+            time=DAILY_BROADCAST_TIMES['daily_rates'],
             days=(0, 1, 2, 3, 4, 5, 6),
             name="daily_rates"
         )
         
-        # Ежедневная рассылка погоды в 08:00 (05:00 UTC)
+        # Ежедневная рассылка погоды (по умолчанию в 08:00 МСК)
         job_queue.run_daily(
-            send_daily_weather,
-            time=datetime.strptime("05:00", "%H:%M").time(),
+            leader_only(send_daily_weather),
+            time=DAILY_BROADCAST_TIMES['daily_weather'],
             days=(0, 1, 2, 3, 4, 5, 6),
             name="daily_weather"
         )
         
-        # Проверка уведомлений каждые 30 минут
-        job_queue.run_repeating(check_alerts, interval=1800, first=10, name="check_alerts")
+        # Пополнение истории курсов ЦБ РФ в 13:00 (10:00 UTC), после публикации курсов
+        job_queue.run_daily(
+            leader_only(append_rates_history),
+            time=datetime.strptime("10:00", "%H:%M").time(),
+            days=(0, 1, 2, 3, 4, 5, 6),
+            name="rates_history"
+        )
+        
+        # Дозагрузка истории ключевой ставки (только строки новее сохраненных)
+        job_queue.run_repeating(
+            leader_only(sync_key_rate_history_job),
+            interval=KEY_RATE_SYNC_INTERVAL,
+            first=KEY_RATE_SYNC_INTERVAL,
+            name="key_rate_history"
+        )
+        
+        # Продолжение прерванных рассылок и первичная загрузка истории - при получении лидерства
+        leader.on_elected(_on_elected(application))
+        
+        # Проверка уведомлений (по умолчанию каждые 30 минут)
+        job_queue.run_repeating(leader_only(check_alerts), interval=ALERT_CHECK_INTERVAL, first=10, name="check_alerts")
+        
+        # Проверка доступности ИИ (только если не было реальных запросов)
+        job_queue.run_repeating(probe_ai_health, interval=AI_HEALTH_PROBE_INTERVAL, first=5, name="ai_health")
+        
+        # Очистка кэша ответов ИИ раз в час
+        job_queue.run_repeating(leader_only(evict_ai_cache), interval=3600, first=60, name="ai_cache_eviction")
+        
+        # Фоновое обновление снимков (криптовалюты, ключевая ставка, погода)
+        for name, interval in snapshots.providers().items():
+            job_queue.run_repeating(
+                snapshots.refresh_job,
+                interval=interval,
+                first=0,
+                name=f"snapshot_{name}",
+                data=name
+            )
         
         logger.info("Фоновые задачи настроены")
     else:
@@ -0,0 +1,139 @@
+import asyncio
+import functools
+import json
+import asyncpg
+from config import logger, LEADER_ELECTION, LEADER_LOCK_KEY, LEADER_CHECK_INTERVAL
+from db import DATABASE_URL, ALERTS_CHANNEL, INSTANCE_ID
+from alert_index import alert_index
+
+# Keepalive на стороне сервера: сеанс упавшей реплики (и ее блокировка)
+# закрывается через ~10 секунд даже без штатного разрыва соединения
+_KEEPALIVE_SETTINGS = {
+    'tcp_keepalives_idle': '5',
+    'tcp_keepalives_interval': '2',
+    'tcp_keepalives_count': '3',
+}
+
+class LeaderElection:
+    """
+    Выбор лидера среди реплик бота через сессионную advisory-блокировку PostgreSQL.
+    Блокировку держит отдельное соединение: если лидер падает, соединение
+    закрывается, блокировка освобождается, и ее забирает другая реплика.
+    """
+
+    def __init__(self, lock_key: int, check_interval: float, enabled: bool = True):
+        self.lock_key = lock_key
+        self.check_interval = check_interval
+        self.enabled = enabled
+        self.is_leader = False
+        self._conn = None
+        self._task = None
+        self._callbacks = []
+
+    def on_elected(self, callback):
+        """Регистрирует корутинную функцию, вызываемую при получении лидерства"""
+        self._callbacks.append(callback)
+
+    async def start(self):
+        if not self.enabled:
+            # Единственный экземпляр: всегда лидер
+            await self._become_leader()
+            return
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self._close()
+        self.is_leader = False
+
+    async def _run(self):
+        while True:
+            try:
+                if self._conn is None or self._conn.is_closed():
+                    await self._connect()
+
+                if self.is_leader:
+                    # Проверяем, что сеанс, удерживающий блокировку, жив
+                    await self._conn.fetchval('SELECT 1')
+                elif await self._conn.fetchval('SELECT pg_try_advisory_lock($1)', self.lock_key):
+                    await self._become_leader()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Ошибка соединения для выбора лидера: {e}")
+                self._lose_leadership()
+                await self._close()
+
+            await asyncio.sleep(self.check_interval)
+
+    async def _connect(self):
+        self._conn = await asyncpg.connect(DATABASE_URL, server_settings=_KEEPALIVE_SETTINGS)
+        self._conn.add_termination_listener(lambda conn: self._lose_leadership())
+
+    async def _close(self):
+        conn, self._conn = self._conn, None
+        if conn is not None and not conn.is_closed():
+            try:
+                await conn.close(timeout=5)
+            except Exception:
+                conn.terminate()
+
+    async def _become_leader(self):
+        self.is_leader = True
+        logger.info(f"Реплика {INSTANCE_ID} стала лидером, плановые задачи выполняются здесь")
+
+        if self._conn is not None:
+            await self._conn.add_listener(ALERTS_CHANNEL, self._on_alerts_changed)
+
+        for callback in self._callbacks:
+            try:
+                await callback()
+            except Exception as e:
+                logger.error(f"Ошибка при получении лидерства: {e}")
+
+    def _lose_leadership(self):
+        if self.is_leader:
+            logger.warning(f"Реплика {INSTANCE_ID} потеряла лидерство")
+        self.is_leader = False
+
+    def _on_alerts_changed(self, conn, pid, channel, payload):
+        """
+        Применяет к индексу изменения уведомлений, сделанные на других репликах.
+        Пропущенные при разрыве соединения уведомления не теряются: после
+        переподключения реплика снова получает лидерство и загружает индекс целиком.
+        """
+        try:
+            change = json.loads(payload)
+        except ValueError:
+            change = {}
+        if change.get('origin') == INSTANCE_ID:
+            return
+
+        op = change.get('op')
+        if op == 'add':
+            alert_index.add(change['alert'])
+        elif op == 'remove':
+            alert_index.remove(change['id'])
+        elif op == 'remove_user':
+            alert_index.remove_user(change['user_id'])
+        else:
+            # Неизвестный формат (например, от реплики старой версии) - полная перезагрузка
+            alert_index.loaded = False
+
+def leader_only(callback):
+    """Обертка задачи JobQueue: задача выполняется только на реплике-лидере"""
+    @functools.wraps(callback)
+    async def wrapper(context):
+        if not leader.is_leader:
+            return
+        return await callback(context)
+    return wrapper
+
+leader = LeaderElection(LEADER_LOCK_KEY, LEADER_CHECK_INTERVAL, enabled=LEADER_ELECTION)
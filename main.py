@@ -1,46 +1,110 @@
+import asyncio
 import logging
+from telegram.request import BaseRequest
 from telegram.ext import Application, CommandHandler, CallbackQueryHandler, MessageHandler, filters
-from config import TOKEN, logger
-from db import init_db
+from config import (
+    TOKEN, CONCURRENT_UPDATES, UPDATE_QUEUE_SIZE, TELEGRAM_BASE_URL, BOT_MODE,
+    WEBHOOK_LISTEN, WEBHOOK_PORT, WEBHOOK_PATH, WEBHOOK_URL, WEBHOOK_SECRET, WEBHOOK_MAX_CONNECTIONS, logger
+)
+from db import init_db, init_pool, close_pool
+from http_client import init_http_clients, close_http_clients
 from handlers import start, help_command, button_handler, show_currency_rates
 from handlers import handle_ai_message, alert_command, myalerts_command, show_key_rate, show_crypto_rates, show_ai_chat
 from handlers import show_other_functions, show_bot_stats, show_bot_about, show_settings, show_weather
 from jobs import setup_jobs
+from leader import leader
+from persistence import PostgresPersistence
+from metrics import instrument_handlers, start_metrics_server, stop_metrics_server
+from tracing import TracingUpdateProcessor, trace_handlers, exporter as trace_exporter
 
 async def post_init(application):
     """Функция инициализации после запуска бота"""
+    await init_http_clients()
+    await start_metrics_server()
+    
     try:
+        await init_pool()
         await init_db()
         logger.info("База данных инициализирована")
     except Exception as e:
         logger.error(f"Ошибка при инициализации БД: {e}")
+    
+    # Плановые задачи начнут выполняться, когда эта реплика станет лидером
+    # (тогда же загрузится индекс уведомлений)
+    await leader.start()
+
+async def post_shutdown(application):
+    """Освобождение ресурсов при остановке бота"""
+    await leader.stop()
+    await stop_metrics_server()
+    await close_http_clients()
+    await close_pool()
+    trace_exporter.close()
+
+def build_application(request: BaseRequest = None) -> Application:
+    """
+    Создает приложение с обработчиками и фоновыми задачами.
+    request - транспорт Bot API вместо стандартного (для нагрузочных тестов).
+    """
+    builder = (
+        Application.builder()
+        .token(TOKEN)
+        .base_url(TELEGRAM_BASE_URL)
+        .update_queue(asyncio.Queue(maxsize=UPDATE_QUEUE_SIZE))
+        .concurrent_updates(TracingUpdateProcessor(CONCURRENT_UPDATES))
+        .persistence(PostgresPersistence())
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
+    )
+    if request is not None:
+        builder = builder.request(request).get_updates_request(request)
+    application = builder.build()
+
+    # Регистрация обработчиков команд
+    application.add_handler(CommandHandler("start", start))
+    application.add_handler(CommandHandler("help", help_command))
+    application.add_handler(CommandHandler("rates", show_currency_rates))
+    application.add_handler(CommandHandler("currency", show_currency_rates))
+    application.add_handler(CommandHandler("keyrate", show_key_rate))
+    application.add_handler(CommandHandler("crypto", show_crypto_rates))
+    application.add_handler(CommandHandler("ai", show_ai_chat))
+    application.add_handler(CommandHandler("alert", alert_command))
+    application.add_handler(CommandHandler("myalerts", myalerts_command))
+    application.add_handler(CommandHandler("weather", show_weather))  # Новая команда!
+    
+    # Обработчики кнопок и сообщений
+    application.add_handler(CallbackQueryHandler(button_handler))
+    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_ai_message))
+
+    # Метрики времени обработки и спаны трассировки для всех обработчиков
+    instrument_handlers(application)
+    trace_handlers(application)
+
+    # Настройка фоновых задач
+    setup_jobs(application)
+
+    return application
 
 def main():
     """Основная функция запуска бота"""
     try:
-        application = Application.builder().token(TOKEN).post_init(post_init).build()
-
-        # Регистрация обработчиков команд
-        application.add_handler(CommandHandler("start", start))
-        application.add_handler(CommandHandler("help", help_command))
-        application.add_handler(CommandHandler("rates", show_currency_rates))
-        application.add_handler(CommandHandler("currency", show_currency_rates))
-        application.add_handler(CommandHandler("keyrate", show_key_rate))
-        application.add_handler(CommandHandler("crypto", show_crypto_rates))
-        application.add_handler(CommandHandler("ai", show_ai_chat))
-        application.add_handler(CommandHandler("alert", alert_command))
-        application.add_handler(CommandHandler("myalerts", myalerts_command))
-        application.add_handler(CommandHandler("weather", show_weather))  # Новая команда!
-        
-        # Обработчики кнопок и сообщений
-        application.add_handler(CallbackQueryHandler(button_handler))
-        application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_ai_message))
-
-        # Настройка фоновых задач
-        setup_jobs(application)
+        application = build_application()
 
-        logger.info("Бот запускается...")
-        application.run_polling()
+        if BOT_MODE == 'webhook':
+            # Обновления приходят POST-запросами на встроенный сервер;
+            # запросы без верного секретного заголовка отклоняются
+            logger.info(f"Бот запускается в режиме webhook на {WEBHOOK_LISTEN}:{WEBHOOK_PORT}/{WEBHOOK_PATH}...")
+            application.run_webhook(
+                listen=WEBHOOK_LISTEN,
+                port=WEBHOOK_PORT,
+                url_path=WEBHOOK_PATH,
+                webhook_url=WEBHOOK_URL,
+                secret_token=WEBHOOK_SECRET,
+                max_connections=WEBHOOK_MAX_CONNECTIONS
+            )
+        else:
+            logger.info("Бот запускается...")
+            application.run_polling()
         
     except Exception as e:
         logger.error(f"Ошибка при запуске бота: {e}")
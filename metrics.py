@@ -0,0 +1,333 @@
+import asyncio
+import functools
+import re
+import time
+import httpx
+from config import logger, METRICS_HOST, METRICS_PORT
+
+# Границы корзин гистограмм задержки (сек)
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+def _format_labels(names: tuple, values: tuple, extra: str = '') -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return '{' + ','.join(parts) + '}' if parts else ''
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Histogram:
+    """Гистограмма в формате Prometheus (накопительные корзины, сумма и количество)"""
+
+    def __init__(self, name: str, help_text: str, labels: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labels = labels
+        self.buckets = tuple(buckets) + (float('inf'),)
+        self._series = {}  # значения меток -> [счетчики корзин, сумма, количество]
+
+    def observe(self, value: float, *label_values):
+        series = self._series.get(label_values)
+        if series is None:
+            series = self._series[label_values] = [[0] * len(self.buckets), 0.0, 0]
+        counts = series[0]
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                counts[i] += 1
+                break
+        series[1] += value
+        series[2] += 1
+
+    def time(self, *label_values):
+        """Контекстный менеджер, измеряющий время блока"""
+        return _Timer(self, label_values)
+
+    def render(self) -> list:
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} histogram']
+        for label_values, (counts, total, count) in sorted(self._series.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                labels = _format_labels(self.labels, label_values, f'le="{_format_value(bound)}"')
+                lines.append(f'{self.name}_bucket{labels} {cumulative}')
+            labels = _format_labels(self.labels, label_values)
+            lines.append(f'{self.name}_sum{labels} {total!r}')
+            lines.append(f'{self.name}_count{labels} {count}')
+        return lines
+
+class Counter:
+    """Монотонный счетчик с метками"""
+
+    def __init__(self, name: str, help_text: str, labels: tuple = ()):
+        self.name = name
+        self.help = help_text
+        self.labels = labels
+        self._values = {}
+
+    def inc(self, *label_values, amount: float = 1):
+        self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def render(self) -> list:
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} counter']
+        for label_values, value in sorted(self._values.items()):
+            lines.append(f'{self.name}{_format_labels(self.labels, label_values)} {_format_value(value)}')
+        return lines
+
+class GaugeFunc:
+    """Показатель, значения которого вычисляются при каждом опросе: fn() -> {значения меток: число}"""
+
+    def __init__(self, name: str, help_text: str, labels: tuple, fn):
+        self.name = name
+        self.help = help_text
+        self.labels = labels
+        self.fn = fn
+
+    def render(self) -> list:
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} gauge']
+        try:
+            values = self.fn()
+        except Exception as e:
+            logger.error(f"Ошибка при сборе метрики {self.name}: {e}")
+            return lines
+        for label_values, value in sorted(values.items()):
+            if value is not None:
+                lines.append(f'{self.name}{_format_labels(self.labels, label_values)} {_format_value(value)}')
+        return lines
+
+class _Timer:
+    def __init__(self, histogram: Histogram, label_values: tuple):
+        self.histogram = histogram
+        self.label_values = label_values
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.started, *self.label_values)
+        return False
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+registry = Registry()
+
+handler_latency = registry.register(Histogram(
+    'bot_handler_duration_seconds', 'Время обработки обновления обработчиком', ('handler',)
+))
+handler_errors = registry.register(Counter(
+    'bot_handler_errors_total', 'Необработанные исключения в обработчиках', ('handler',)
+))
+upstream_latency = registry.register(Histogram(
+    'bot_upstream_request_duration_seconds', 'Время ответа внешних API (до заголовков ответа)', ('provider', 'status')
+))
+db_query_latency = registry.register(Histogram(
+    'bot_db_query_duration_seconds', 'Время выполнения запросов к PostgreSQL', ('statement',)
+))
+alert_check_latency = registry.register(Histogram(
+    'bot_alert_check_duration_seconds', 'Время одной проверки уведомлений о курсах', ('mode',)
+))
+
+# =============================================================================
+# ИНСТРУМЕНТИРОВАНИЕ
+# =============================================================================
+
+def track_handler(callback):
+    """Обертка обработчика PTB: гистограмма времени обработки и счетчик исключений"""
+    name = callback.__name__
+
+    @functools.wraps(callback)
+    async def wrapper(update, context):
+        started = time.perf_counter()
+        try:
+            return await callback(update, context)
+        except Exception:
+            handler_errors.inc(name)
+            raise
+        finally:
+            handler_latency.observe(time.perf_counter() - started, name)
+    return wrapper
+
+def instrument_handlers(application):
+    """Оборачивает все зарегистрированные обработчики приложения"""
+    for handlers in application.handlers.values():
+        for handler in handlers:
+            handler.callback = track_handler(handler.callback)
+
+class MetricsTransport(httpx.AsyncBaseTransport):
+    """
+    Транспорт httpx, измеряющий время ответа провайдера (до заголовков ответа).
+    Таймауты и ошибки соединения учитываются со статусом timeout / error.
+    """
+
+    def __init__(self, transport: httpx.AsyncBaseTransport, provider: str):
+        self._transport = transport
+        self.provider = provider
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        started = time.perf_counter()
+        status = 'error'
+        try:
+            response = await self._transport.handle_async_request(request)
+            status = str(response.status_code)
+            return response
+        except httpx.TimeoutException:
+            status = 'timeout'
+            raise
+        except asyncio.CancelledError:
+            # Например, проигравший запрос хеджирования
+            status = 'cancelled'
+            raise
+        finally:
+            upstream_latency.observe(time.perf_counter() - started, self.provider, status)
+
+    async def aclose(self) -> None:
+        await self._transport.aclose()
+
+_OPERATION_RE = re.compile(r'^\s*(SELECT|INSERT|UPDATE|DELETE|COPY|CREATE|ALTER)\b', re.IGNORECASE)
+_TABLE_RE = {
+    'SELECT': re.compile(r'\bFROM\s+([\w."]+)', re.IGNORECASE),
+    'INSERT': re.compile(r'^\s*INSERT\s+INTO\s+([\w."]+)', re.IGNORECASE),
+    'UPDATE': re.compile(r'^\s*UPDATE\s+([\w."]+)', re.IGNORECASE),
+    'DELETE': re.compile(r'^\s*DELETE\s+FROM\s+([\w."]+)', re.IGNORECASE),
+    'COPY': re.compile(r'^\s*COPY\s+([\w."]+)', re.IGNORECASE),
+}
+
+@functools.lru_cache(maxsize=512)
+def statement_label(query: str) -> str:
+    """Короткая метка запроса: операция и таблица (например 'UPDATE alerts')"""
+    match = _OPERATION_RE.match(query)
+    if not match:
+        return 'other'
+    operation = match.group(1).upper()
+    table_re = _TABLE_RE.get(operation)
+    table = table_re.search(query) if table_re else None
+    return f'{operation} {table.group(1).strip(chr(34))}' if table else operation
+
+def db_query_logger(record):
+    """Обработчик asyncpg Connection.add_query_logger"""
+    db_query_latency.observe(record.elapsed, statement_label(record.query))
+
+def register_default_collectors():
+    """Показатели, снимаемые при опросе: кэши, пул БД, рассылки, очередь ИИ, провайдеры"""
+    from cache import caches
+    from db import get_pool_stats
+    from broadcast import broadcast_stats
+    from ai_cache import get_ai_cache_stats
+    from ai_scheduler import ai_scheduler
+    from health import health
+
+    registry.register(GaugeFunc(
+        'bot_cache_hit_ratio', 'Доля попаданий в кэш', ('cache',),
+        lambda: {(name,): cache.stats()['hit_ratio'] for name, cache in caches.items()}
+    ))
+    registry.register(GaugeFunc(
+        'bot_cache_requests', 'Обращения к кэшу по результату', ('cache', 'result'),
+        lambda: {
+            (name, result): cache.stats()[result]
+            for name, cache in caches.items() for result in ('hits', 'misses', 'coalesced')
+        }
+    ))
+    registry.register(GaugeFunc(
+        'bot_ai_answer_cache_requests', 'Обращения к кэшу ответов ИИ по уровню', ('result',),
+        lambda: {
+            (key,): value for key, value in get_ai_cache_stats().items()
+            if key in ('memory_hits', 'db_hits', 'misses')
+        }
+    ))
+    registry.register(GaugeFunc(
+        'bot_db_pool', 'Состояние пула соединений PostgreSQL', ('stat',),
+        lambda: {
+            (key,): value for key, value in get_pool_stats().items()
+            if key in ('size', 'idle', 'in_use', 'in_use_max', 'acquire_wait_avg', 'acquire_wait_max')
+        }
+    ))
+    registry.register(GaugeFunc(
+        'bot_broadcast_messages', 'Прогресс последней рассылки каждого вида', ('broadcast', 'state'),
+        lambda: {
+            (name, state): value
+            for name, stats in broadcast_stats.items()
+            for state, value in (('sent', stats.sent), ('failed', stats.failed),
+                                 ('retries', stats.retries), ('total', stats.total))
+        }
+    ))
+    registry.register(GaugeFunc(
+        'bot_broadcast_running', 'Идет ли рассылка', ('broadcast',),
+        lambda: {(name,): int(stats.finished is None) for name, stats in broadcast_stats.items()}
+    ))
+    registry.register(GaugeFunc(
+        'bot_broadcast_throughput', 'Скорость рассылки, сообщений/с', ('broadcast',),
+        lambda: {(name,): stats.throughput for name, stats in broadcast_stats.items()}
+    ))
+    registry.register(GaugeFunc(
+        'bot_ai_queue', 'Очередь запросов к ИИ', ('stat',),
+        lambda: {(key,): value for key, value in ai_scheduler.stats().items()}
+    ))
+    registry.register(GaugeFunc(
+        'bot_upstream_available', 'Доступность внешних провайдеров', ('provider',),
+        lambda: {(stats['name'],): int(stats['available']) for stats in health.stats()}
+    ))
+
+# =============================================================================
+# HTTP-ЭНДПОИНТ
+# =============================================================================
+
+_server = None
+
+async def _handle_scrape(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    try:
+        request_line = await reader.readline()
+        while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+            pass
+
+        parts = request_line.decode(errors='replace').split()
+        if len(parts) >= 2 and parts[0] == 'GET' and parts[1].split('?')[0] == '/metrics':
+            body = registry.render().encode()
+            status = b'200 OK'
+            content_type = b'text/plain; version=0.0.4; charset=utf-8'
+        else:
+            body, status, content_type = b'Not Found\n', b'404 Not Found', b'text/plain'
+
+        writer.write(
+            b'HTTP/1.1 ' + status + b'\r\nContent-Type: ' + content_type +
+            b'\r\nContent-Length: ' + str(len(body)).encode() + b'\r\nConnection: close\r\n\r\n' + body
+        )
+        await writer.drain()
+    except Exception as e:
+        logger.error(f"Ошибка при отдаче метрик: {e}")
+    finally:
+        writer.close()
+
+async def start_metrics_server():
+    """Запускает эндпоинт /metrics (METRICS_PORT=0 - отключен)"""
+    global _server
+    if not METRICS_PORT or _server is not None:
+        return
+    register_default_collectors()
+    _server = await asyncio.start_server(_handle_scrape, METRICS_HOST, METRICS_PORT)
+    logger.info(f"Метрики доступны на http://{METRICS_HOST}:{METRICS_PORT}/metrics")
+
+async def stop_metrics_server():
+    global _server
+    if _server is None:
+        return
+    server, _server = _server, None
+    server.close()
+    await server.wait_closed()
@@ -0,0 +1,168 @@
+import asyncio
+import json
+import time
+from telegram.ext import BasePersistence, PersistenceInput
+from config import logger, PERSISTENCE_UPDATE_INTERVAL, PERSISTENCE_FLUSH_DELAY, PERSISTENCE_REFRESH_TTL
+from db import get_bot_state, save_bot_state, delete_bot_state
+
+class PostgresPersistence(BasePersistence):
+    """
+    Хранение user_data и chat_data в таблице bot_state.
+    Данные пользователя читаются из БД при первом обращении (и повторно, если
+    прочитаны давно и не менялись локально). Измененные данные копятся в памяти
+    и записываются пачкой: PTB передает их раз в update_interval, а все изменения,
+    пришедшие в пределах flush_delay, уходят в БД одним executemany.
+    """
+
+    def __init__(self, update_interval: float = PERSISTENCE_UPDATE_INTERVAL,
+                 flush_delay: float = PERSISTENCE_FLUSH_DELAY, refresh_ttl: float = PERSISTENCE_REFRESH_TTL):
+        super().__init__(
+            store_data=PersistenceInput(bot_data=False, chat_data=True, user_data=True, callback_data=False),
+            update_interval=update_interval
+        )
+        self.flush_delay = flush_delay
+        self.refresh_ttl = refresh_ttl
+        self._loaded_at = {}  # (kind, id) -> время чтения из БД
+        self._dirty = {}  # (kind, id) -> JSON для записи
+        self._flush_task = None
+        self.loads = 0
+        self.writes = 0
+        self.batches = 0
+
+    # Данные загружаются лениво, поэтому при запуске возвращаем пустые словари
+    async def get_user_data(self) -> dict:
+        return {}
+
+    async def get_chat_data(self) -> dict:
+        return {}
+
+    async def get_bot_data(self) -> dict:
+        return {}
+
+    async def get_callback_data(self):
+        return None
+
+    async def get_conversations(self, name: str) -> dict:
+        return {}
+
+    async def update_conversation(self, name: str, key, new_state) -> None:
+        pass
+
+    async def update_bot_data(self, data) -> None:
+        pass
+
+    async def update_callback_data(self, data) -> None:
+        pass
+
+    async def refresh_bot_data(self, bot_data) -> None:
+        pass
+
+    async def refresh_user_data(self, user_id: int, user_data: dict) -> None:
+        await self._refresh('user', user_id, user_data)
+
+    async def refresh_chat_data(self, chat_id: int, chat_data: dict) -> None:
+        await self._refresh('chat', chat_id, chat_data)
+
+    async def update_user_data(self, user_id: int, data: dict) -> None:
+        self._mark_dirty('user', user_id, data)
+
+    async def update_chat_data(self, chat_id: int, data: dict) -> None:
+        self._mark_dirty('chat', chat_id, data)
+
+    async def drop_user_data(self, user_id: int) -> None:
+        await self._drop('user', user_id)
+
+    async def drop_chat_data(self, chat_id: int) -> None:
+        await self._drop('chat', chat_id)
+
+    async def flush(self) -> None:
+        """Записывает все накопленные изменения (вызывается при остановке бота)"""
+        if self._flush_task is not None and not self._flush_task.done():
+            self._flush_task.cancel()
+        self._flush_task = None
+        await self._write()
+
+    async def _refresh(self, kind: str, state_id: int, data: dict):
+        key = (kind, state_id)
+        loaded_at = self._loaded_at.get(key)
+        if key in self._dirty or (loaded_at is not None and time.monotonic() - loaded_at < self.refresh_ttl):
+            return
+
+        try:
+            stored = await get_bot_state(kind, state_id)
+        except Exception as e:
+            logger.error(f"Не удалось загрузить данные {kind} {state_id}: {e}")
+            return
+
+        self.loads += 1
+        self._touch(key)
+        # Пока шел запрос, обработчик мог изменить данные - их не затираем
+        if stored is not None and key not in self._dirty:
+            data.clear()
+            data.update(json.loads(stored))
+
+    def _mark_dirty(self, kind: str, state_id: int, data: dict):
+        key = (kind, state_id)
+        try:
+            # Сериализуем сразу: обработчики продолжают менять исходный словарь
+            self._dirty[key] = json.dumps(data, ensure_ascii=False)
+        except (TypeError, ValueError) as e:
+            logger.error(f"Данные {kind} {state_id} не сериализуются в JSON: {e}")
+            return
+        self._touch(key)
+
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._flush_later())
+
+    def _touch(self, key):
+        # Переставляем ключ в конец: словарь упорядочен по времени чтения
+        self._loaded_at.pop(key, None)
+        self._loaded_at[key] = time.monotonic()
+
+    def _evict_expired(self):
+        """Забывает данные, прочитанные раньше refresh_ttl: они все равно будут перечитаны"""
+        expired_before = time.monotonic() - self.refresh_ttl
+        while self._loaded_at:
+            key = next(iter(self._loaded_at))
+            if self._loaded_at[key] >= expired_before:
+                break
+            del self._loaded_at[key]
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.flush_delay)
+        await self._write()
+
+    async def _write(self):
+        self._evict_expired()
+        if not self._dirty:
+            return
+
+        batch, self._dirty = self._dirty, {}
+        rows = [(kind, state_id, data) for (kind, state_id), data in batch.items()]
+        try:
+            await save_bot_state(rows)
+            self.writes += len(rows)
+            self.batches += 1
+        except Exception as e:
+            logger.error(f"Не удалось сохранить данные пользователей ({len(rows)}): {e}")
+            # Возвращаем несохраненное, не затирая более свежие изменения
+            for key, data in batch.items():
+                self._dirty.setdefault(key, data)
+
+    async def _drop(self, kind: str, state_id: int):
+        key = (kind, state_id)
+        self._dirty.pop(key, None)
+        self._loaded_at.pop(key, None)
+        try:
+            await delete_bot_state(kind, state_id)
+        except Exception as e:
+            logger.error(f"Не удалось удалить данные {kind} {state_id}: {e}")
+
+    def stats(self) -> dict:
+        return {
+            'cached': len(self._loaded_at),
+            'dirty': len(self._dirty),
+            'loads': self.loads,
+            'writes': self.writes,
+            'batches': self.batches,
+        }
@@ -1,60 +1,85 @@
-import requests
+import asyncio
+import time
+import httpx
 import xml.etree.ElementTree as ET
 import json
-from bs4 import BeautifulSoup
 from datetime import datetime, timedelta
+from zoneinfo import ZoneInfo
+from decimal import Decimal
 import logging
-from config import CBR_API_BASE, COINGECKO_API_BASE, DEEPSEEK_API_BASE, DEEPSEEK_API_KEY, logger
+from config import CBR_API_BASE, COINGECKO_API_BASE, DEEPSEEK_API_BASE, DEEPSEEK_API_KEY, OPENWEATHER_API_BASE, logger
+from config import CBR_RATES_TTL, CBR_RATES_CACHE_SIZE
+from config import CRYPTO_REFRESH_INTERVAL, CRYPTO_STALE_AFTER, KEY_RATE_REFRESH_INTERVAL, KEY_RATE_STALE_AFTER
+from config import WEATHER_REFRESH_INTERVAL, WEATHER_STALE_AFTER, RATES_HISTORY_BACKFILL_DAYS, ALERT_EVALUATION_MODE
+from config import AI_HEALTH_PROBE_INTERVAL, KEY_RATE_DEADLINE, KEY_RATE_HEDGE_DELAY, KEY_RATE_QUERY_DAYS
+from config import KEY_RATE_HISTORY_BACKFILL_DAYS, KEY_RATE_MAX_AGE_DAYS, BOT_TIMEZONE, DAILY_RATES_TIME, DAILY_WEATHER_TIME
+from config import DEEPSEEK_MODEL, DEEPSEEK_TEMPERATURE, DEEPSEEK_MAX_TOKENS
+from cache import AsyncCache
+from broadcast import Broadcaster
+from snapshots import SnapshotStore
+from health import health
+from cbr_parsers import parse_daily_rates, parse_key_rate_rows
+from http_client import get_http_client
+from metrics import alert_check_latency
+from tracing import traced
 from telegram.ext import ContextTypes
 
 # =============================================================================
 # ФУНКЦИИ ДЛЯ РАБОТЫ С КУРСАМИ ВАЛЮТ ЦБ РФ
 # =============================================================================
 
-def get_currency_rates_for_date(date_req):
-    """Получает курсы валют на определенную дату"""
+# Коды валют ЦБ РФ (ID в XML ЦБ -> буквенный код)
+CBR_CURRENCY_CODES = {
+    'R01235': 'USD',  'R01239': 'EUR',  'R01035': 'GBP',  'R01820': 'JPY',
+    'R01375': 'CNY',  'R01775': 'CHF',  'R01350': 'CAD',  'R01010': 'AUD',
+    'R01700J': 'TRY', 'R01335': 'KZT',
+}
+
+# Кэш курсов ЦБ РФ по запрошенной дате
+rates_cache = AsyncCache('cbr_rates', max_size=CBR_RATES_CACHE_SIZE)
+
+def _rates_cache_ttl(date_req: str):
+    """TTL для курсов на дату: прошедшие даты не меняются, сегодня и завтра - с TTL"""
+    try:
+        requested = datetime.strptime(date_req, '%d/%m/%Y').date()
+    except ValueError:
+        return CBR_RATES_TTL
+    
+    if requested < datetime.now().date():
+        return None
+    return CBR_RATES_TTL
+
+@traced()
+async def get_currency_rates_for_date(date_req):
+    """Получает курсы валют на определенную дату (с кэшированием)"""
+    async def load():
+        rates, cbr_date = await fetch_currency_rates_for_date(date_req)
+        return (rates, cbr_date) if rates else None
+    
+    result = await rates_cache.get_or_load(date_req, load, ttl=_rates_cache_ttl(date_req))
+    if result is None:
+        return None, None
+    return result
+
+@traced()
+async def fetch_currency_rates_for_date(date_req):
+    """Загружает курсы валют на определенную дату с сайта ЦБ РФ"""
     try:
         url = f"{CBR_API_BASE}scripts/XML_daily.asp"
         params = {'date_req': date_req}
         
-        response = requests.get(url, params=params, timeout=10)
+        response = await get_http_client('cbr').get(url, params=params, timeout=10)
         if response.status_code != 200:
             return None, None
         
-        root = ET.fromstring(response.content)
-        cbr_date = root.get('Date', '')
-        
-        rates = {}
-        currency_codes = {
-            'R01235': 'USD',  'R01239': 'EUR',  'R01035': 'GBP',  'R01820': 'JPY',
-            'R01375': 'CNY',  'R01775': 'CHF',  'R01350': 'CAD',  'R01010': 'AUD',
-            'R01700': 'TRY',  'R01335': 'KZT',
-        }
-        
-        for valute in root.findall('Valute'):
-            valute_id = valute.get('ID')
-            if valute_id in currency_codes:
-                currency_code = currency_codes[valute_id]
-                name = valute.find('Name').text
-                value = float(valute.find('Value').text.replace(',', '.'))
-                nominal = int(valute.find('Nominal').text)
-                
-                if nominal > 1:
-                    value = value / nominal
-                
-                rates[currency_code] = {
-                    'value': value,
-                    'name': name,
-                    'nominal': nominal
-                }
-        
-        return rates, cbr_date
+        return parse_daily_rates(response.content, CBR_CURRENCY_CODES)
         
     except Exception as e:
         logger.error(f"Ошибка при получении курсов на дату {date_req}: {e}")
         return None, None
 
-def get_currency_rates_with_tomorrow():
+@traced()
+async def get_currency_rates_with_tomorrow():
     """Получает курсы валют на сегодня и завтра (если доступно)"""
     try:
         today = datetime.now()
@@ -65,12 +90,12 @@ def get_currency_rates_with_tomorrow():
         date_tomorrow = tomorrow.strftime('%d/%m/%Y')
         
         # Получаем курсы на сегодня
-        rates_today, date_today_str = get_currency_rates_for_date(date_today)
+        rates_today, date_today_str = await get_currency_rates_for_date(date_today)
         if not rates_today:
             return {}, 'неизвестная дата', None, None
         
         # Пытаемся получить курсы на завтра
-        rates_tomorrow, date_tomorrow_str = get_currency_rates_for_date(date_tomorrow)
+        rates_tomorrow, date_tomorrow_str = await get_currency_rates_for_date(date_tomorrow)
         
         # Если курсы на завтра не доступны, возвращаем только сегодняшние
         if not rates_tomorrow:
@@ -96,6 +121,94 @@ def get_currency_rates_with_tomorrow():
         logger.error(f"Ошибка при получении курсов с завтрашними данными: {e}")
         return {}, 'неизвестная дата', None, None
 
+# =============================================================================
+# ИСТОРИЯ КУРСОВ ЦБ РФ
+# =============================================================================
+
+@traced()
+async def fetch_currency_dynamic(valute_id: str, date_from, date_to) -> list:
+    """Загружает динамику курса одной валюты за период одним запросом (XML_dynamic.asp)"""
+    try:
+        url = f"{CBR_API_BASE}scripts/XML_dynamic.asp"
+        params = {
+            'date_req1': date_from.strftime('%d/%m/%Y'),
+            'date_req2': date_to.strftime('%d/%m/%Y'),
+            'VAL_NM_RQ': valute_id
+        }
+        
+        response = await get_http_client('cbr').get(url, params=params, timeout=30)
+        if response.status_code != 200:
+            logger.error(f"Ошибка HTTP {response.status_code} при загрузке динамики {valute_id}")
+            return []
+        
+        root = ET.fromstring(response.content)
+        currency_code = CBR_CURRENCY_CODES[valute_id]
+        
+        records = []
+        for record in root.findall('Record'):
+            date = datetime.strptime(record.get('Date'), '%d.%m.%Y').date()
+            nominal = int(record.find('Nominal').text)
+            value = Decimal(record.find('Value').text.replace(',', '.'))
+            records.append((date, currency_code, value, nominal))
+        
+        return records
+        
+    except Exception as e:
+        logger.error(f"Ошибка при загрузке динамики курса {valute_id}: {e}")
+        return []
+
+async def backfill_rates_history(ranges: dict) -> int:
+    """Загружает историю курсов ({ID валюты ЦБ: (с, по)}) и сохраняет ее в БД"""
+    from db import save_rates_history
+    
+    results = await asyncio.gather(*[
+        fetch_currency_dynamic(valute_id, date_from, date_to)
+        for valute_id, (date_from, date_to) in ranges.items()
+    ])
+    records = [record for currency_records in results for record in currency_records]
+    
+    inserted = await save_rates_history(records)
+    logger.info(f"История курсов: получено {len(records)} записей, добавлено {inserted}")
+    return inserted
+
+async def sync_rates_history() -> int:
+    """Дозагружает историю курсов каждой валюты начиная с последней сохраненной даты"""
+    from db import get_rates_history_last_dates
+    
+    today = datetime.now().date()
+    # Курсы на завтра ЦБ РФ публикует заранее
+    date_to = today + timedelta(days=1)
+    last_dates = await get_rates_history_last_dates()
+    
+    ranges = {}
+    for valute_id, currency in CBR_CURRENCY_CODES.items():
+        last_date = last_dates.get(currency)
+        if last_date is None:
+            date_from = today - timedelta(days=RATES_HISTORY_BACKFILL_DAYS)
+        else:
+            date_from = last_date + timedelta(days=1)
+        
+        if date_from <= date_to:
+            ranges[valute_id] = (date_from, date_to)
+    
+    if not ranges:
+        return 0
+    return await backfill_rates_history(ranges)
+
+async def get_currency_rates_history(currency: str, date_from, date_to) -> list:
+    """Возвращает историю курса валюты из БД: список (дата, курс за 1 единицу)"""
+    from db import get_rates_history
+    
+    rows = await get_rates_history(currency, date_from, date_to)
+    return [(row['date'], float(row['value']) / row['nominal']) for row in rows]
+
+async def append_rates_history(context: ContextTypes.DEFAULT_TYPE):
+    """Фоновая задача: ежедневное пополнение истории курсов"""
+    try:
+        await sync_rates_history()
+    except Exception as e:
+        logger.error(f"Ошибка при пополнении истории курсов: {e}")
+
 def format_currency_rates_message(rates_today: dict, date_today: str, 
                                 rates_tomorrow: dict = None, changes: dict = None) -> str:
     """Форматирует сообщение с курсами валют на сегодня и завтра"""
@@ -162,25 +275,144 @@ def format_currency_rates_message(rates_today: dict, date_today: str,
 # ФУНКЦИИ ДЛЯ РАБОТЫ С КЛЮЧЕВОЙ СТАВКОЙ ЦБ РФ
 # =============================================================================
 
-def get_key_rate():
-    """Получает ключевую ставку ЦБ РФ с использованием нескольких методов"""
+# Статистика источников ключевой ставки: попытки, победы, средняя задержка (EWMA)
+key_rate_source_stats = {}
+
+def _key_rate_sources() -> list:
+    """Источники ключевой ставки: самый быстрый по статистике идет первым"""
+    sources = [('cbr_parsed', get_key_rate_html), ('cbr_api', get_key_rate_api)]
+    return sorted(
+        sources,
+        key=lambda source: key_rate_source_stats.get(source[0], {}).get('latency') or float('inf')
+    )
+
+def _record_key_rate_source(name: str, latency: float, ok: bool, won: bool = False):
+    stats = key_rate_source_stats.setdefault(
+        name, {'attempts': 0, 'successes': 0, 'wins': 0, 'latency': None}
+    )
+    if won:
+        stats['wins'] += 1
+        return
     
-    # Сначала пробуем парсинг HTML с правильными заголовками
-    key_rate_data = get_key_rate_html()
-    if key_rate_data:
-        return key_rate_data
+    stats['attempts'] += 1
+    if ok:
+        stats['successes'] += 1
+        previous = stats['latency']
+        stats['latency'] = latency if previous is None else previous * 0.8 + latency * 0.2
+
+async def _fetch_key_rate_source(name: str, fetch, delay: float, hedge_now: asyncio.Event):
+    """Запускает источник (с задержкой хеджирования, если он не первый)"""
+    if delay > 0:
+        try:
+            await asyncio.wait_for(hedge_now.wait(), timeout=delay)
+        except asyncio.TimeoutError:
+            pass
+    
+    started = time.perf_counter()
+    result = await fetch()
+    _record_key_rate_source(name, time.perf_counter() - started, bool(result))
+    if not result:
+        # Источник не дал результата - сразу запускаем остальные
+        hedge_now.set()
+    return name, result
+
+@traced()
+async def get_key_rate():
+    """
+    Ключевая ставка из локальной истории (key_rate_history), которую пополняет
+    sync_key_rate_history. Сайт ЦБ РФ опрашивается, только если история еще пуста.
+    Если последняя строка старше KEY_RATE_MAX_AGE_DAYS, ставка помечается устаревшей
+    (is_current=False); повторный опрос сайта - дело фоновой задачи, а не пользователя
+    """
+    from db import get_latest_key_rate
+    
+    today = datetime.now().date()
+    row = await get_latest_key_rate(today)
+    if row:
+        is_current = _key_rate_is_current(row['date'], today)
+        if not is_current:
+            logger.warning(f"Ключевая ставка в истории устарела: последняя запись за {row['date']:%d.%m.%Y}")
+        return {
+            'rate': float(row['rate']),
+            'date': row['date'].strftime('%d.%m.%Y'),
+            'is_current': is_current,
+            'source': 'cbr_history'
+        }
+    return await scrape_key_rate()
+
+def _key_rate_is_current(date, today) -> bool:
+    """Строка истории не старше KEY_RATE_MAX_AGE_DAYS"""
+    return (today - date).days <= KEY_RATE_MAX_AGE_DAYS
+
+@traced()
+async def scrape_key_rate():
+    """
+    Получает ключевую ставку с сайта ЦБ РФ, опрашивая источники параллельно в пределах
+    общего дедлайна: побеждает первый корректный ответ, остальные запросы отменяются
+    """
+    hedge_now = asyncio.Event()
+    tasks = [
+        asyncio.create_task(_fetch_key_rate_source(name, fetch, i * KEY_RATE_HEDGE_DELAY, hedge_now))
+        for i, (name, fetch) in enumerate(_key_rate_sources())
+    ]
+    
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + KEY_RATE_DEADLINE
+    pending = set(tasks)
+    key_rate_data = None
+    
+    try:
+        while pending and not key_rate_data:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                logger.warning("Истек дедлайн получения ключевой ставки")
+                break
+            
+            done, pending = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is not None:
+                    logger.error(f"Ошибка источника ключевой ставки: {task.exception()}")
+                    continue
+                name, result = task.result()
+                if result and not key_rate_data:
+                    key_rate_data = result
+                    _record_key_rate_source(name, 0, True, won=True)
+    finally:
+        for task in pending:
+            task.cancel()
     
-    # Если не получилось, пробуем API
-    logger.info("Парсинг HTML не удался, пробуем API...")
-    key_rate_data = get_key_rate_api()
     if key_rate_data:
         return key_rate_data
     
-    # Если оба метода не сработали, возвращаем демо-данные
+    # Если ни один источник не ответил, возвращаем демо-данные
     logger.warning("Не удалось получить актуальную ключевую ставку, используем демо-данные")
     return get_key_rate_demo()
 
-def get_key_rate_html():
+def _latest_key_rate(content: bytes, source: str):
+    """Последняя действующая ставка из таблицы table.data страницы hd_base/KeyRate"""
+    today = datetime.now().date()
+    # Строки идут от новых к старым; проверяем первые 10
+    for date, rate in parse_key_rate_rows(content, limit=10):
+        # Проверяем что дата не в будущем
+        if date <= today:
+            return {
+                'rate': float(rate),
+                'date': date.strftime('%d.%m.%Y'),
+                'is_current': True,
+                'source': source
+            }
+    return None
+
+def _key_rate_query_window(date_from, date_to) -> dict:
+    """Параметры запроса таблицы ключевой ставки за период"""
+    return {
+        'UniDbQuery.Posted': 'True',
+        'UniDbQuery.From': date_from.strftime('%d.%m.%Y'),
+        'UniDbQuery.To': date_to.strftime('%d.%m.%Y'),
+    }
+
+@traced()
+async def get_key_rate_html():
     """Парсинг ключевой ставки с сайта ЦБ РФ"""
     try:
         url = "https://cbr.ru/hd_base/KeyRate/"
@@ -193,11 +425,7 @@ def get_key_rate_html():
             'Connection': 'keep-alive',
         }
         
-        # Добавляем задержку чтобы не выглядеть как бот
-        import time
-        time.sleep(1)
-        
-        response = requests.get(url, headers=headers, timeout=15)
+        response = await get_http_client('cbr').get(url, headers=headers, timeout=15)
         
         if response.status_code == 403:
             logger.error("Доступ запрещен (403) при парсинге HTML")
@@ -205,83 +433,105 @@ def get_key_rate_html():
         elif response.status_code != 200:
             logger.error(f"Ошибка HTTP {response.status_code} при парсинге HTML")
             return None
-            
-        soup = BeautifulSoup(response.content, 'html.parser')
-        
-        # Ищем таблицу с ключевыми ставками
-        table = soup.find('table', class_='data')
-        if table:
-            rows = table.find_all('tr')
-            for i in range(1, min(len(rows), 10)):  # Проверяем первые 10 строк
-                cells = rows[i].find_all('td')
-                if len(cells) >= 2:
-                    date_str = cells[0].get_text(strip=True)
-                    rate_str = cells[1].get_text(strip=True).replace(',', '.')
-                    
-                    try:
-                        date_obj = datetime.strptime(date_str, '%d.%m.%Y')
-                        # Проверяем что дата не в будущем
-                        if date_obj <= datetime.now():
-                            rate_value = float(rate_str)
-                            
-                            return {
-                                'rate': rate_value,
-                                'date': date_obj.strftime('%d.%m.%Y'),
-                                'is_current': True,
-                                'source': 'cbr_parsed'
-                            }
-                    except ValueError:
-                        continue
         
-        return None
+        return _latest_key_rate(response.content, 'cbr_parsed')
             
     except Exception as e:
         logger.error(f"Ошибка при парсинге HTML ключевой ставки: {e}")
         return None
 
-def get_key_rate_api():
-    """Получает ключевую ставку через API ЦБ РФ"""
+@traced()
+async def get_key_rate_api():
+    """Получает ключевую ставку через API ЦБ РФ (таблица только за последние недели)"""
     try:
-        # Альтернативный URL для ключевой ставки
-        url = "https://www.cbr.ru/hd_base/KeyRate/?UniDbQuery.Posted=True&UniDbQuery.From=01.01.2020&UniDbQuery.To=31.12.2025"
+        url = "https://www.cbr.ru/hd_base/KeyRate/"
         
         headers = {
             'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
         }
         
-        response = requests.get(url, headers=headers, timeout=10)
+        today = datetime.now()
+        params = _key_rate_query_window(today - timedelta(days=KEY_RATE_QUERY_DAYS), today)
+        response = await get_http_client('cbr').get(url, params=params, headers=headers, timeout=10)
         
         if response.status_code == 200:
-            soup = BeautifulSoup(response.content, 'html.parser')
-            table = soup.find('table', class_='data')
-            
-            if table:
-                rows = table.find_all('tr')
-                for i in range(1, min(len(rows), 5)):  # Первые 5 строк
-                    cells = rows[i].find_all('td')
-                    if len(cells) >= 2:
-                        date_str = cells[0].get_text(strip=True)
-                        rate_str = cells[1].get_text(strip=True).replace(',', '.')
-                        
-                        try:
-                            date_obj = datetime.strptime(date_str, '%d.%m.%Y')
-                            if date_obj <= datetime.now():
-                                rate_value = float(rate_str)
-                                
-                                return {
-                                    'rate': rate_value,
-                                    'date': date_str,
-                                    'is_current': True,
-                                    'source': 'cbr_api'
-                                }
-                        except ValueError:
-                            continue
+            return _latest_key_rate(response.content, 'cbr_api')
         return None
             
     except Exception as e:
         logger.error(f"Ошибка при получении ключевой ставки через API: {e}")
         return None
 
+@traced()
+async def fetch_key_rate_rows(date_from, date_to) -> list:
+    """Загружает строки таблицы ключевой ставки за период: [(дата, ставка), ...]"""
+    try:
+        url = "https://www.cbr.ru/hd_base/KeyRate/"
+        headers = {
+            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
+        }
+        
+        response = await get_http_client('cbr').get(
+            url, params=_key_rate_query_window(date_from, date_to), headers=headers, timeout=30
+        )
+        if response.status_code != 200:
+            logger.error(f"Ошибка HTTP {response.status_code} при загрузке истории ключевой ставки")
+            return []
+        
+        rows = parse_key_rate_rows(response.content)
+        if not rows:
+            # Обычно означает, что изменилась разметка страницы
+            logger.error(
+                f"В ответе ЦБ РФ нет строк ключевой ставки за {date_from:%d.%m.%Y}-{date_to:%d.%m.%Y} "
+                f"({len(response.content)} байт)"
+            )
+        return rows
+        
+    except Exception as e:
+        logger.error(f"Ошибка при загрузке истории ключевой ставки: {e}")
+        return []
+
+async def sync_key_rate_history() -> int:
+    """Дозагружает историю ключевой ставки: только строки новее последней сохраненной даты"""
+    from db import get_key_rate_last_date, save_key_rate_history
+    
+    today = datetime.now().date()
+    last_date = await get_key_rate_last_date()
+    if last_date is None:
+        date_from = today - timedelta(days=KEY_RATE_HISTORY_BACKFILL_DAYS)
+    else:
+        date_from = last_date + timedelta(days=1)
+    
+    if date_from > today:
+        return 0
+    
+    rows = [
+        (date, rate) for date, rate in await fetch_key_rate_rows(date_from, today)
+        if date_from <= date <= today
+    ]
+    inserted = await save_key_rate_history(rows)
+    if inserted:
+        logger.info(f"История ключевой ставки: добавлено {inserted} записей с {date_from:%d.%m.%Y}")
+    
+    last_date = await get_key_rate_last_date()
+    if last_date is not None and not _key_rate_is_current(last_date, today):
+        # Таблица за период не разобралась или пуста - пробуем текущую ставку с сайта
+        logger.warning(f"История ключевой ставки устарела (последняя запись за {last_date:%d.%m.%Y}), опрашиваем сайт ЦБ РФ")
+        key_rate_data = await scrape_key_rate()
+        if key_rate_data['source'] != 'demo':
+            date = datetime.strptime(key_rate_data['date'], '%d.%m.%Y').date()
+            inserted += await save_key_rate_history([(date, Decimal(str(key_rate_data['rate'])))])
+    return inserted
+
+async def sync_key_rate_history_job(context: ContextTypes.DEFAULT_TYPE):
+    """Фоновая задача: пополнение истории ключевой ставки"""
+    try:
+        if await sync_key_rate_history():
+            # Снимок для обработчиков сразу получает новую ставку
+            await snapshots.refresh('key_rate')
+    except Exception as e:
+        logger.error(f"Ошибка при пополнении истории ключевой ставки: {e}")
+
 def get_key_rate_demo():
     """Возвращает демо-данные ключевой ставки"""
     return {
@@ -310,6 +560,10 @@ def format_key_rate_message(key_rate_data: dict) -> str:
         message += f"\n\n✅ <i>Данные получены с официального сайта ЦБ РФ</i>"
     elif source == 'cbr_api':
         message += f"\n\n✅ <i>Данные получены через API ЦБ РФ</i>"
+    elif source == 'cbr_history' and not key_rate_data.get('is_current', True):
+        message += f"\n\n⚠️ <i>Данные официального сайта ЦБ РФ давно не обновлялись</i>"
+    elif source == 'cbr_history':
+        message += f"\n\n✅ <i>Данные официального сайта ЦБ РФ</i>"
     elif source == 'demo':
         message += f"\n\n⚠️ <i>Используются демонстрационные данные (ошибка получения реальных)</i>"
     
@@ -319,7 +573,8 @@ def format_key_rate_message(key_rate_data: dict) -> str:
 # ФУНКЦИИ ДЛЯ РАБОТЫ С КРИПТОВАЛЮТАМИ
 # =============================================================================
 
-def get_crypto_rates():
+@traced()
+async def get_crypto_rates():
     """Получает курсы криптовалют через CoinGecko API"""
     try:
         # Основные криптовалюты для отслеживания
@@ -344,7 +599,7 @@ def get_crypto_rates():
         logger.info(f"Запрос к CoinGecko API: {url}")
         logger.info(f"Параметры: {params}")
         
-        response = requests.get(url, params=params, headers=headers, timeout=15)
+        response = await get_http_client('coingecko').get(url, params=params, headers=headers, timeout=15)
         
         if response.status_code != 200:
             logger.error(f"Ошибка CoinGecko API: {response.status_code}")
@@ -427,7 +682,7 @@ def get_crypto_rates():
             logger.error("Не найдено валидных данных по криптовалютам в ответе API")
             return None
             
-    except requests.exceptions.RequestException as e:
+    except httpx.HTTPError as e:
         logger.error(f"Сетевая ошибка при получении курсов криптовалют: {e}")
         return None
     except json.JSONDecodeError as e:
@@ -569,21 +824,8 @@ def format_crypto_rates_message(crypto_rates: dict) -> str:
 # ФУНКЦИИ ДЛЯ РАБОТЫ С ИИ DEEPSEEK
 # =============================================================================
 
-async def ask_deepseek(prompt: str, context: ContextTypes.DEFAULT_TYPE = None) -> str:
-    """Отправляет запрос к API DeepSeek и возвращает ответ"""
-    if not DEEPSEEK_API_KEY:
-        return "❌ Функционал ИИ временно недоступен. Отсутствует API ключ."
-    
-    try:
-        url = f"{DEEPSEEK_API_BASE}chat/completions"
-        
-        headers = {
-            'Content-Type': 'application/json',
-            'Authorization': f'Bearer {DEEPSEEK_API_KEY}'
-        }
-        
-        # УНИВЕРСАЛЬНЫЙ ПРОМПТ ДЛЯ ЛЮБЫХ ВОПРОСОВ
-        system_message = """Ты - универсальный ИИ помощник в телеграм боте. Ты помогаешь пользователям с любыми вопросами, включая:
+# УНИВЕРСАЛЬНЫЙ ПРОМПТ ДЛЯ ЛЮБЫХ ВОПРОСОВ
+DEEPSEEK_SYSTEM_MESSAGE = """Ты - универсальный ИИ помощник в телеграм боте. Ты помогаешь пользователям с любыми вопросами, включая:
 
 - 💰 Финансы: курсы валют, инвестиции, криптовалюты
 - 📊 Технологии: программирование, IT, разработка
@@ -595,299 +837,325 @@ async def ask_deepseek(prompt: str, context: ContextTypes.DEFAULT_TYPE = None) -
 - 💬 Общение: поддержка, мотивация
 
 Отвечай подробно, информативно и помогающе. Будь дружелюбным и поддерживающим собеседником."""
-        
-        data = {
-            "model": "deepseek-chat",
-            "messages": [
-                {"role": "system", "content": system_message},
-                {"role": "user", "content": prompt}
-            ],
-            "temperature": 0.7,
-            "max_tokens": 2000,  # Увеличим лимит токенов для более подробных ответов
-            "stream": False
-        }
+
+def _deepseek_headers() -> dict:
+    return {
+        'Content-Type': 'application/json',
+        'Authorization': f'Bearer {DEEPSEEK_API_KEY}'
+    }
+
+def _deepseek_payload(prompt: str, stream: bool = False, history: list = None) -> dict:
+    """Тело запроса к DeepSeek chat/completions (history - предыдущие сообщения диалога)"""
+    return {
+        "model": DEEPSEEK_MODEL,
+        "messages": [
+            {"role": "system", "content": DEEPSEEK_SYSTEM_MESSAGE},
+            *(history or []),
+            {"role": "user", "content": prompt}
+        ],
+        "temperature": DEEPSEEK_TEMPERATURE,
+        "max_tokens": DEEPSEEK_MAX_TOKENS,
+        "stream": stream
+    }
+
+def _record_deepseek_health(started: float, ok: bool, error: str = None, status_code: int = None):
+    """Записывает результат реального обращения к DeepSeek в реестр состояния"""
+    health.record(
+        'deepseek', ok, time.perf_counter() - started,
+        error=error, fatal=status_code in (401, 402)
+    )
+
+def is_ai_available() -> bool:
+    """Доступность ИИ по реестру состояния (без обращения к API)"""
+    if not DEEPSEEK_API_KEY:
+        return False
+    return health.get('deepseek').available
+
+def _deepseek_error_message(status_code: int, response_text: str) -> str:
+    """Сообщение пользователю по HTTP статусу ошибки DeepSeek API"""
+    if status_code == 402:
+        logger.error("Недостаточно средств на счету DeepSeek API")
+        return "❌ Функционал ИИ временно недоступен. Недостаточно средств на API аккаунте. Обратитесь к администратору."
+    elif status_code == 401:
+        logger.error("Неверный API ключ DeepSeek")
+        return "❌ Ошибка аутентификации API. Проверьте API ключ."
+    elif status_code == 429:
+        logger.error("Превышен лимит запросов к DeepSeek API")
+        return "⏰ Превышен лимит запросов. Попробуйте позже."
+    else:
+        error_msg = f"Ошибка API DeepSeek: {status_code} - {response_text}"
+        logger.error(error_msg)
+        return f"❌ Временная ошибка сервиса ИИ. Попробуйте позже."
+
+class AIError(Exception):
+    """Ошибка запроса к DeepSeek; текст исключения - сообщение для пользователя"""
+
+@traced()
+async def ask_deepseek(prompt: str, context: ContextTypes.DEFAULT_TYPE = None, history: list = None) -> str:
+    """Отправляет запрос к API DeepSeek и возвращает ответ (при ошибке - AIError)"""
+    if not DEEPSEEK_API_KEY:
+        raise AIError("❌ Функционал ИИ временно недоступен. Отсутствует API ключ.")
+    
+    started = time.perf_counter()
+    try:
+        url = f"{DEEPSEEK_API_BASE}chat/completions"
+        data = _deepseek_payload(prompt, history=history)
         
         logger.info(f"Отправка запроса к DeepSeek API: {prompt[:100]}...")
         
-        response = requests.post(url, headers=headers, json=data, timeout=30)
+        response = await get_http_client('deepseek').post(url, headers=_deepseek_headers(), json=data, timeout=30)
         
         if response.status_code == 200:
             result = response.json()
             answer = result['choices'][0]['message']['content']
+            _record_deepseek_health(started, True)
             logger.info("Успешно получен ответ от DeepSeek API")
             return answer
-        elif response.status_code == 402:
-            logger.error("Недостаточно средств на счету DeepSeek API")
-            return "❌ Функционал ИИ временно недоступен. Недостаточно средств на API аккаунте. Обратитесь к администратору."
-        elif response.status_code == 401:
-            logger.error("Неверный API ключ DeepSeek")
-            return "❌ Ошибка аутентификации API. Проверьте API ключ."
-        elif response.status_code == 429:
-            logger.error("Превышен лимит запросов к DeepSeek API")
-            return "⏰ Превышен лимит запросов. Попробуйте позже."
         else:
-            error_msg = f"Ошибка API DeepSeek: {response.status_code} - {response.text}"
-            logger.error(error_msg)
-            return f"❌ Временная ошибка сервиса ИИ. Попробуйте позже."
+            _record_deepseek_health(started, False, f"HTTP {response.status_code}", response.status_code)
+            raise AIError(_deepseek_error_message(response.status_code, response.text))
             
-    except requests.exceptions.Timeout:
+    except AIError:
+        raise
+    except httpx.TimeoutException:
+        _record_deepseek_health(started, False, "timeout")
         logger.error("Таймаут при запросе к DeepSeek API")
-        return "⏰ ИИ не успел обработать запрос. Попробуйте позже."
-    except requests.exceptions.RequestException as e:
+        raise AIError("⏰ ИИ не успел обработать запрос. Попробуйте позже.")
+    except httpx.HTTPError as e:
+        _record_deepseek_health(started, False, str(e))
         logger.error(f"Сетевая ошибка при запросе к DeepSeek API: {e}")
-        return "❌ Произошла сетевая ошибка. Проверьте подключение к интернету."
+        raise AIError("❌ Произошла сетевая ошибка. Проверьте подключение к интернету.")
     except Exception as e:
         logger.error(f"Неожиданная ошибка при работе с DeepSeek API: {e}")
-        return "❌ Произошла непредвиденная ошибка. Попробуйте позже."
+        raise AIError("❌ Произошла непредвиденная ошибка. Попробуйте позже.")
 
-# Добавьте в конец services.py
-async def check_alerts(context: ContextTypes.DEFAULT_TYPE):
-    """Проверяет активные уведомления и отправляет уведомления при срабатывании"""
+@traced()
+async def ask_deepseek_stream(prompt: str, history: list = None):
+    """
+    Потоковый запрос к API DeepSeek (SSE): возвращает только фрагменты ответа по мере генерации.
+    При ошибке, в том числе после части ответа или если поток оборвался до [DONE], - AIError.
+    """
+    if not DEEPSEEK_API_KEY:
+        raise AIError("❌ Функционал ИИ временно недоступен. Отсутствует API ключ.")
+    
+    started = time.perf_counter()
     try:
-        from db import get_all_active_alerts, deactivate_alert
+        url = f"{DEEPSEEK_API_BASE}chat/completions"
+        data = _deepseek_payload(prompt, stream=True, history=history)
         
-        alerts = await get_all_active_alerts()
-        if not alerts:
-            return
+        logger.info(f"Отправка потокового запроса к DeepSeek API: {prompt[:100]}...")
         
-        rates_today, _, _, _ = get_currency_rates_with_tomorrow()
-        if not rates_today:
-            return
-        
-        for alert in alerts:
-            user_id = alert['user_id']
-            from_curr = alert['from_currency']
-            threshold = alert['threshold']
-            direction = alert['direction']
-            alert_id = alert['id']
+        async with get_http_client('deepseek').stream(
+            'POST', url, headers=_deepseek_headers(), json=data, timeout=30
+        ) as response:
+            if response.status_code != 200:
+                await response.aread()
+                _record_deepseek_health(started, False, f"HTTP {response.status_code}", response.status_code)
+                raise AIError(_deepseek_error_message(response.status_code, response.text))
             
-            if from_curr in rates_today:
-                current_rate = rates_today[from_curr]['value']
-                triggered = False
-                
-                if direction == 'above' and current_rate >= threshold:
-                    triggered = True
-                elif direction == 'below' and current_rate <= threshold:
-                    triggered = True
+            # Доступность фиксируем по первому ответу (время до начала потока)
+            _record_deepseek_health(started, True)
+            
+            done = False
+            async for line in response.aiter_lines():
+                if not line.startswith('data:'):
+                    continue
+                chunk = line[len('data:'):].strip()
+                if chunk == '[DONE]':
+                    done = True
+                    break
                 
-                if triggered:
-                    message = (
-                        f"🔔 <b>УВЕДОМЛЕНИЕ СРАБОТАЛО!</b>\n\n"
-                        f"💱 <b>Пара:</b> {from_curr}/RUB\n"
-                        f"🎯 <b>Порог:</b> {threshold} руб.\n"
-                        f"💹 <b>Текущий курс:</b> {current_rate:.2f} руб.\n"
-                        f"📊 <b>Условие:</b> курс <b>{'выше' if direction == 'above' else 'ниже'}</b> {threshold} руб.\n\n"
-                        f"✅ <i>Уведомление выполнено и удалено.</i>"
-                    )
-                    
-                    await context.bot.send_message(
-                        chat_id=user_id, 
-                        text=message, 
-                        parse_mode='HTML'
-                    )
-                    await deactivate_alert(alert_id)
-                    
+                try:
+                    choices = json.loads(chunk).get('choices') or [{}]
+                except ValueError:
+                    logger.error(f"Некорректный фрагмент потока DeepSeek API: {chunk[:200]}")
+                    raise AIError("❌ Ответ ИИ получен не полностью. Попробуйте позже.")
+                delta = choices[0].get('delta', {}).get('content')
+                if delta:
+                    yield delta
+            
+            if not done:
+                logger.error("Поток DeepSeek API завершился без [DONE]")
+                raise AIError("❌ Ответ ИИ получен не полностью. Попробуйте позже.")
+        
+        logger.info("Успешно получен потоковый ответ от DeepSeek API")
+            
+    except AIError:
+        raise
+    except httpx.TimeoutException:
+        _record_deepseek_health(started, False, "timeout")
+        logger.error("Таймаут при потоковом запросе к DeepSeek API")
+        raise AIError("⏰ ИИ не успел обработать запрос. Попробуйте позже.")
+    except httpx.HTTPError as e:
+        _record_deepseek_health(started, False, str(e))
+        logger.error(f"Сетевая ошибка при потоковом запросе к DeepSeek API: {e}")
+        raise AIError("❌ Произошла сетевая ошибка. Проверьте подключение к интернету.")
     except Exception as e:
-        logger.error(f"Ошибка при проверке уведомлений: {e}")
+        logger.error(f"Неожиданная ошибка при потоковом запросе к DeepSeek API: {e}")
+        raise AIError("❌ Произошла непредвиденная ошибка. Попробуйте позже.")
 
-async def send_daily_rates(context: ContextTypes.DEFAULT_TYPE):
-    """Ежедневная рассылка основных финансовых данных"""
+async def probe_deepseek():
+    """Дешевая проверка доступности DeepSeek API (список моделей, без генерации)"""
+    if not DEEPSEEK_API_KEY:
+        return
+    
+    started = time.perf_counter()
     try:
-        from db import get_all_users
-        
-        users = await get_all_users()
-        if not users:
-            return
-        
-        # Формируем сводное сообщение
-        message = "🌅 <b>ЕЖЕДНЕВНАЯ ФИНАНСОВАЯ СВОДКА</b>\n\n"
-        
-        # Добавляем курсы валют
-        rates_today, date_today, _, _ = get_currency_rates_with_tomorrow()
-        if rates_today:
-            message += "💱 <b>Основные курсы ЦБ РФ:</b>\n"
-            for currency in ['USD', 'EUR']:
-                if currency in rates_today:
-                    rate = rates_today[currency]['value']
-                    message += f"   {currency}: <b>{rate:.2f} руб.</b>\n"
-            message += "\n"
-        
-        # Добавляем ключевую ставку
-        key_rate_data = get_key_rate()
-        if key_rate_data:
-            message += f"💎 <b>Ключевая ставка:</b> {key_rate_data['rate']:.2f}%\n\n"
-        
-        message += "💡 Используйте команды бота для подробной информации"
-        
-        # Отправляем всем пользователям
-        for user in users:
-            try:
-                await context.bot.send_message(
-                    chat_id=user['user_id'],
-                    text=message,
-                    parse_mode='HTML'
-                )
-            except Exception as e:
-                logger.error(f"Ошибка отправки рассылки пользователю {user['user_id']}: {e}")
-                
+        response = await get_http_client('deepseek').get(
+            f"{DEEPSEEK_API_BASE}models", headers=_deepseek_headers(), timeout=10
+        )
+        if response.status_code == 200:
+            _record_deepseek_health(started, True)
+        else:
+            _record_deepseek_health(started, False, f"HTTP {response.status_code}", response.status_code)
     except Exception as e:
-        logger.error(f"Ошибка при ежедневной рассылке: {e}")
+        _record_deepseek_health(started, False, str(e) or type(e).__name__)
+
+async def probe_ai_health(context: ContextTypes.DEFAULT_TYPE):
+    """Фоновая проверка ИИ, если давно не было реальных запросов"""
+    try:
+        since_check = health.get('deepseek').seconds_since_check
+        if since_check is None or since_check >= AI_HEALTH_PROBE_INTERVAL:
+            await probe_deepseek()
+    except Exception as e:
+        logger.error(f"Ошибка при проверке доступности ИИ: {e}")
+
+async def evict_ai_cache(context: ContextTypes.DEFAULT_TYPE):
+    """Фоновая задача: очистка устаревших и лишних записей кэша ответов ИИ"""
+    try:
+        from ai_cache import evict_answers
+        await evict_answers()
+    except Exception as e:
+        logger.error(f"Ошибка при очистке кэша ответов ИИ: {e}")
+
+def format_alert_triggered_message(from_curr: str, threshold, current_rate: float, direction: str) -> str:
+    """Форматирует сообщение о сработавшем уведомлении"""
+    return (
+        f"🔔 <b>УВЕДОМЛЕНИЕ СРАБОТАЛО!</b>\n\n"
+        f"💱 <b>Пара:</b> {from_curr}/RUB\n"
+        f"🎯 <b>Порог:</b> {threshold} руб.\n"
+        f"💹 <b>Текущий курс:</b> {current_rate:.2f} руб.\n"
+        f"📊 <b>Условие:</b> курс <b>{'выше' if direction == 'above' else 'ниже'}</b> {threshold} руб.\n\n"
+        f"✅ <i>Уведомление выполнено и удалено.</i>"
+    )
 
 async def check_alerts(context: ContextTypes.DEFAULT_TYPE):
     """Проверяет активные уведомления и отправляет уведомления при срабатывании"""
     try:
-        from db import get_all_active_alerts, deactivate_alert
-        
-        alerts = await get_all_active_alerts()
-        if not alerts:
-            return
-        
-        rates_today, _, _, _ = get_currency_rates_with_tomorrow()
-        if not rates_today:
-            return
-        
-        for alert in alerts:
-            user_id = alert['user_id']
-            from_curr = alert['from_currency']
-            threshold = alert['threshold']
-            direction = alert['direction']
-            alert_id = alert['id']
-            
-            if from_curr in rates_today:
-                current_rate = rates_today[from_curr]['value']
-                triggered = False
-                
-                if direction == 'above' and current_rate >= threshold:
-                    triggered = True
-                elif direction == 'below' and current_rate <= threshold:
-                    triggered = True
-                
-                if triggered:
-                    message = (
-                        f"🔔 <b>УВЕДОМЛЕНИЕ СРАБОТАЛО!</b>\n\n"
-                        f"💱 <b>Пара:</b> {from_curr}/RUB\n"
-                        f"🎯 <b>Порог:</b> {threshold} руб.\n"
-                        f"💹 <b>Текущий курс:</b> {current_rate:.2f} руб.\n"
-                        f"📊 <b>Условие:</b> курс <b>{'выше' if direction == 'above' else 'ниже'}</b> {threshold} руб.\n\n"
-                        f"✅ <i>Уведомление выполнено и удалено.</i>"
-                    )
-                    
-                    await context.bot.send_message(
-                        chat_id=user_id, 
-                        text=message, 
-                        parse_mode='HTML'
-                    )
-                    await deactivate_alert(alert_id)
-                    
+        with alert_check_latency.time(ALERT_EVALUATION_MODE):
+            if ALERT_EVALUATION_MODE == 'sql':
+                await check_alerts_sql(context)
+            else:
+                await check_alerts_index(context)
     except Exception as e:
         logger.error(f"Ошибка при проверке уведомлений: {e}")
 
-async def send_daily_rates(context: ContextTypes.DEFAULT_TYPE):
-    """Ежедневная рассылка основных финансовых данных"""
-    try:
-        from db import get_all_users
-        
-        users = await get_all_users()
-        if not users:
-            return
-        
-        # Формируем сводное сообщение
-        message = "🌅 <b>ЕЖЕДНЕВНАЯ ФИНАНСОВАЯ СВОДКА</b>\n\n"
-        
-        # Добавляем курсы валют
-        rates_today, date_today, _, _ = get_currency_rates_with_tomorrow()
-        if rates_today:
-            message += "💱 <b>Основные курсы ЦБ РФ:</b>\n"
-            for currency in ['USD', 'EUR']:
-                if currency in rates_today:
-                    rate = rates_today[currency]['value']
-                    message += f"   {currency}: <b>{rate:.2f} руб.</b>\n"
-            message += "\n"
-        
-        # Добавляем ключевую ставку
-        key_rate_data = get_key_rate()
-        if key_rate_data:
-            message += f"💎 <b>Ключевая ставка:</b> {key_rate_data['rate']:.2f}%\n\n"
-        
-        message += "💡 Используйте команды бота для подробной информации"
+async def check_alerts_index(context: ContextTypes.DEFAULT_TYPE):
+    """Проверка уведомлений через индекс порогов в памяти"""
+    from db import load_alert_index, deactivate_alert
+    from alert_index import alert_index
+    
+    if not alert_index.loaded:
+        await load_alert_index()
+    if not len(alert_index):
+        return
+    
+    rates_today, _, _, _ = await get_currency_rates_with_tomorrow()
+    if not rates_today:
+        return
+    
+    for from_curr, rate_data in rates_today.items():
+        current_rate = rate_data['value']
         
-        # Отправляем всем пользователям
-        for user in users:
+        # Индекс возвращает только уведомления, порог которых пересечен
+        for alert in alert_index.crossed(from_curr, current_rate):
             try:
+                message = format_alert_triggered_message(
+                    from_curr, alert['threshold'], current_rate, alert['direction']
+                )
                 await context.bot.send_message(
-                    chat_id=user['user_id'],
-                    text=message,
+                    chat_id=alert['user_id'], 
+                    text=message, 
                     parse_mode='HTML'
                 )
+                await deactivate_alert(alert['id'])
             except Exception as e:
-                logger.error(f"Ошибка отправки рассылки пользователю {user['user_id']}: {e}")
-                
-    except Exception as e:
-        logger.error(f"Ошибка при ежедневной рассылке: {e}")
+                logger.error(f"Ошибка при отправке уведомления {alert['id']} пользователю {alert['user_id']}: {e}")
 
-async def check_alerts(context: ContextTypes.DEFAULT_TYPE):
-    """Проверяет активные уведомления и отправляет уведомления при срабатывании"""
+async def check_alerts_sql(context: ContextTypes.DEFAULT_TYPE):
+    """Проверка уведомлений на стороне БД: один UPDATE ... RETURNING на весь проход"""
+    from db import trigger_crossed_alerts
+    
+    rates_today, _, _, _ = await get_currency_rates_with_tomorrow()
+    if not rates_today:
+        return
+    
+    rates = {currency: data['value'] for currency, data in rates_today.items()}
+    alerts = await trigger_crossed_alerts(rates)
+    
+    for alert in alerts:
+        try:
+            message = format_alert_triggered_message(
+                alert['from_currency'], alert['threshold'], float(alert['current_rate']), alert['direction']
+            )
+            await context.bot.send_message(
+                chat_id=alert['user_id'], 
+                text=message, 
+                parse_mode='HTML'
+            )
+        except Exception as e:
+            logger.error(f"Ошибка при отправке уведомления {alert['id']} пользователю {alert['user_id']}: {e}")
+
+def _is_leader() -> bool:
+    """Рассылку продолжает только лидер: новый лидер возобновит ее с контрольной точки"""
+    from leader import leader
+    return leader.is_leader
+
+# Время ежедневных рассылок в часовом поясе бота
+BOT_TZ = ZoneInfo(BOT_TIMEZONE)
+DAILY_BROADCAST_TIMES = {
+    'daily_rates': datetime.strptime(DAILY_RATES_TIME, '%H:%M').time().replace(tzinfo=BOT_TZ),
+    'daily_weather': datetime.strptime(DAILY_WEATHER_TIME, '%H:%M').time().replace(tzinfo=BOT_TZ),
+}
+
+def daily_broadcast_id(kind: str) -> str:
+    """
+    Идентификатор ежедневной рассылки (один на вид рассылки и день): дата последнего
+    планового запуска в часовом поясе бота. Не зависит от пояса реплики и не меняется,
+    если рассылка продолжается после полуночи.
+    """
+    now = datetime.now(BOT_TZ)
+    scheduled = datetime.combine(now.date(), DAILY_BROADCAST_TIMES[kind].replace(tzinfo=None), tzinfo=BOT_TZ)
+    if scheduled > now:
+        scheduled -= timedelta(days=1)
+    return f"{kind}:{scheduled.date().isoformat()}"
+
+async def resume_broadcasts(context: ContextTypes.DEFAULT_TYPE):
+    """Продолжает сегодняшние рассылки, прерванные перезапуском бота"""
     try:
-        from db import get_all_active_alerts, deactivate_alert
+        from db import get_unfinished_broadcasts
         
-        alerts = await get_all_active_alerts()
-        if not alerts:
-            return
+        # Отбор по идентификатору ниже; здесь только ограничиваем выборку последними днями
+        since = datetime.now() - timedelta(days=2)
+        senders = {'daily_rates': send_daily_rates, 'daily_weather': send_daily_weather}
         
-        rates_today, _, _, _ = get_currency_rates_with_tomorrow()
-        if not rates_today:
-            return
-        
-        for alert in alerts:
-            user_id = alert['user_id']
-            from_curr = alert['from_currency']
-            threshold = alert['threshold']
-            direction = alert['direction']
-            alert_id = alert['id']
-            
-            if from_curr in rates_today:
-                current_rate = rates_today[from_curr]['value']
-                triggered = False
-                
-                if direction == 'above' and current_rate >= threshold:
-                    triggered = True
-                elif direction == 'below' and current_rate <= threshold:
-                    triggered = True
+        for checkpoint in await get_unfinished_broadcasts(since):
+            sender = senders.get(checkpoint['kind'])
+            if sender and checkpoint['broadcast_id'] == daily_broadcast_id(checkpoint['kind']):
+                logger.info(f"Возобновление рассылки '{checkpoint['broadcast_id']}'")
+                await sender(context)
                 
-                if triggered:
-                    message = (
-                        f"🔔 <b>УВЕДОМЛЕНИЕ СРАБОТАЛО!</b>\n\n"
-                        f"💱 <b>Пара:</b> {from_curr}/RUB\n"
-                        f"🎯 <b>Порог:</b> {threshold} руб.\n"
-                        f"💹 <b>Текущий курс:</b> {current_rate:.2f} руб.\n"
-                        f"📊 <b>Условие:</b> курс <b>{'выше' if direction == 'above' else 'ниже'}</b> {threshold} руб.\n\n"
-                        f"✅ <i>Уведомление выполнено и удалено.</i>"
-                    )
-                    
-                    await context.bot.send_message(
-                        chat_id=user_id, 
-                        text=message, 
-                        parse_mode='HTML'
-                    )
-                    await deactivate_alert(alert_id)
-                    
     except Exception as e:
-        logger.error(f"Ошибка при проверке уведомлений: {e}")
+        logger.error(f"Ошибка при возобновлении рассылок: {e}")
 
 async def send_daily_rates(context: ContextTypes.DEFAULT_TYPE):
     """Ежедневная рассылка основных финансовых данных"""
     try:
-        from db import get_all_users
-        
-        users = await get_all_users()
-        if not users:
-            return
-        
         # Формируем сводное сообщение
         message = "🌅 <b>ЕЖЕДНЕВНАЯ ФИНАНСОВАЯ СВОДКА</b>\n\n"
         
         # Добавляем курсы валют
-        rates_today, date_today, _, _ = get_currency_rates_with_tomorrow()
+        rates_today, date_today, _, _ = await get_currency_rates_with_tomorrow()
         if rates_today:
             message += "💱 <b>Основные курсы ЦБ РФ:</b>\n"
             for currency in ['USD', 'EUR']:
@@ -897,22 +1165,18 @@ async def send_daily_rates(context: ContextTypes.DEFAULT_TYPE):
             message += "\n"
         
         # Добавляем ключевую ставку
-        key_rate_data = get_key_rate()
+        key_rate_data = await get_key_rate()
         if key_rate_data:
             message += f"💎 <b>Ключевая ставка:</b> {key_rate_data['rate']:.2f}%\n\n"
         
         message += "💡 Используйте команды бота для подробной информации"
         
         # Отправляем всем пользователям
-        for user in users:
-            try:
-                await context.bot.send_message(
-                    chat_id=user['user_id'],
-                    text=message,
-                    parse_mode='HTML'
-                )
-            except Exception as e:
-                logger.error(f"Ошибка отправки рассылки пользователю {user['user_id']}: {e}")
+        broadcaster = Broadcaster(context.bot, 'daily_rates')
+        await broadcaster.run_paged(
+            daily_broadcast_id('daily_rates'), 'daily_rates', message,
+            should_continue=_is_leader, parse_mode='HTML'
+        )
                 
     except Exception as e:
         logger.error(f"Ошибка при ежедневной рассылке: {e}")
@@ -922,7 +1186,8 @@ async def send_daily_rates(context: ContextTypes.DEFAULT_TYPE):
 # ФУНКЦИИ ДЛЯ РАБОТЫ С ПОГОДОЙ
 # =============================================================================
 
-def get_weather_moscow():
+@traced()
+async def get_weather_moscow():
     """Получает текущую погоду в Москве через OpenWeatherMap API"""
     try:
         from config import WEATHER_API_KEY
@@ -933,10 +1198,11 @@ def get_weather_moscow():
             return get_weather_demo()
         
         CITY = "Moscow"
-        URL = f"http://api.openweathermap.org/data/2.5/weather?q={CITY}&appid={WEATHER_API_KEY}&units=metric&lang=ru"
+        URL = f"{OPENWEATHER_API_BASE}weather"
+        params = {'q': CITY, 'appid': WEATHER_API_KEY, 'units': 'metric', 'lang': 'ru'}
         
         logger.info(f"Запрос погоды для города: {CITY}")
-        response = requests.get(URL, timeout=10)
+        response = await get_http_client('openweather').get(URL, params=params, timeout=10)
         
         if response.status_code == 401:
             logger.error("Невалидный API ключ OpenWeatherMap")
@@ -965,10 +1231,10 @@ def get_weather_moscow():
         logger.info(f"Погода получена: {weather_info['temperature']}°C, {weather_info['description']}")
         return weather_info
         
-    except requests.exceptions.Timeout:
+    except httpx.TimeoutException:
         logger.error("Таймаут при запросе погоды")
         return get_weather_demo()
-    except requests.exceptions.RequestException as e:
+    except httpx.HTTPError as e:
         logger.error(f"Сетевая ошибка при получении погоды: {e}")
         return get_weather_demo()
     except Exception as e:
@@ -1013,7 +1279,7 @@ def get_weather_demo():
     
     return weather_data
 
-def format_weather_message(weather_data):
+def format_weather_message(weather_data, updated_at: datetime = None):
     """Форматирует сообщение с погодой"""
     if not weather_data:
         return "❌ Не удалось получить данные о погоде."
@@ -1067,40 +1333,56 @@ def format_weather_message(weather_data):
     else:
         message += "✅ <i>Актуальные данные от OpenWeatherMap</i>\n"
     
-    message += f"🕒 <i>Обновлено: {datetime.now().strftime('%d.%m.%Y %H:%M')}</i>"
+    message += f"🕒 <i>Обновлено: {(updated_at or datetime.now()).strftime('%d.%m.%Y %H:%M')}</i>"
     
     return message
 
 async def send_daily_weather(context: ContextTypes.DEFAULT_TYPE):
     """Ежедневная рассылка погоды"""
     try:
-        from db import get_all_users
-        
-        users = await get_all_users()
-        if not users:
-            return
-        
         # Получаем погоду
-        weather_data = get_weather_moscow()
+        weather_data = await get_weather_moscow()
         message = format_weather_message(weather_data)
         
         # Добавляем заголовок для рассылки
         full_message = f"🌅 <b>ЕЖЕДНЕВНАЯ РАССЫЛКА ПОГОДЫ</b>\n\n{message}"
         
         # Отправляем всем пользователям
-        success_count = 0
-        for user in users:
-            try:
-                await context.bot.send_message(
-                    chat_id=user['user_id'],
-                    text=full_message,
-                    parse_mode='HTML'
-                )
-                success_count += 1
-            except Exception as e:
-                logger.error(f"Ошибка отправки погоды пользователю {user['user_id']}: {e}")
-        
-        logger.info(f"Ежедневная рассылка погоды отправлена {success_count} пользователям")
+        broadcaster = Broadcaster(context.bot, 'daily_weather')
+        stats = await broadcaster.run_paged(
+            daily_broadcast_id('daily_weather'), 'daily_weather', full_message,
+            should_continue=_is_leader, parse_mode='HTML'
+        )
+        
+        if stats:
+            logger.info(f"Ежедневная рассылка погоды отправлена {stats.sent} пользователям")
                 
     except Exception as e:
         logger.error(f"Ошибка при ежедневной рассылке погоды: {e}")
+
+# =============================================================================
+# СНИМКИ ДАННЫХ С ФОНОВЫМ ОБНОВЛЕНИЕМ
+# =============================================================================
+
+async def load_crypto_snapshot():
+    """Загрузка снимка курсов криптовалют"""
+    return await get_crypto_rates()
+
+async def load_key_rate_snapshot():
+    """Загрузка снимка ключевой ставки (демо-данные в снимок не попадают)"""
+    key_rate_data = await get_key_rate()
+    if not key_rate_data or key_rate_data.get('source') == 'demo':
+        return None
+    return key_rate_data
+
+async def load_weather_snapshot():
+    """Загрузка снимка погоды (демо-данные в снимок не попадают)"""
+    weather_data = await get_weather_moscow()
+    if not weather_data or weather_data.get('source') == 'demo':
+        return None
+    return weather_data
+
+snapshots = SnapshotStore()
+snapshots.register('crypto', load_crypto_snapshot, CRYPTO_REFRESH_INTERVAL, CRYPTO_STALE_AFTER)
+snapshots.register('key_rate', load_key_rate_snapshot, KEY_RATE_REFRESH_INTERVAL, KEY_RATE_STALE_AFTER)
+snapshots.register('weather', load_weather_snapshot, WEATHER_REFRESH_INTERVAL, WEATHER_STALE_AFTER)
@@ -0,0 +1,94 @@
+import asyncio
+import time
+from datetime import datetime
+from config import logger
+
+class Snapshot:
+    """Последнее полученное значение провайдера и время его получения"""
+    
+    def __init__(self, value):
+        self.value = value
+        self.updated_at = datetime.now()
+        self._fetched = time.monotonic()
+    
+    @property
+    def age(self) -> float:
+        return time.monotonic() - self._fetched
+
+class SnapshotStore:
+    """
+    Хранилище снимков данных внешних провайдеров.
+    Снимки обновляются фоновыми задачами; обработчики читают их мгновенно.
+    Устаревший снимок отдается как есть, а обновление запускается в фоне.
+    """
+    
+    def __init__(self):
+        self._providers = {}
+        self._snapshots = {}
+        self._refreshing = {}
+    
+    def register(self, name: str, loader, refresh_interval: int, stale_after: int):
+        """Регистрирует провайдера: loader - корутина, возвращающая значение или None"""
+        self._providers[name] = {
+            'loader': loader,
+            'refresh_interval': refresh_interval,
+            'stale_after': stale_after,
+        }
+    
+    def providers(self) -> dict:
+        """Возвращает интервалы обновления зарегистрированных провайдеров"""
+        return {name: info['refresh_interval'] for name, info in self._providers.items()}
+    
+    def get(self, name: str):
+        """
+        Возвращает (значение, возраст в секундах) без обращения к сети.
+        Если снимка нет или он устарел, запускает фоновое обновление.
+        """
+        snapshot = self._snapshots.get(name)
+        if snapshot is None or snapshot.age > self._providers[name]['stale_after']:
+            self._schedule_refresh(name)
+        
+        if snapshot is None:
+            return None, None
+        return snapshot.value, snapshot.age
+    
+    def get_snapshot(self, name: str):
+        """Возвращает объект снимка (или None) без запуска обновления"""
+        return self._snapshots.get(name)
+    
+    def _schedule_refresh(self, name: str):
+        if name in self._refreshing:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            # Нет запущенного цикла событий
+            return
+        self._refreshing[name] = loop.create_task(self._refresh(name))
+    
+    async def refresh(self, name: str):
+        """Обновляет снимок провайдера (параллельные вызовы объединяются)"""
+        task = self._refreshing.get(name)
+        if task is None:
+            task = asyncio.ensure_future(self._refresh(name))
+            self._refreshing[name] = task
+        return await asyncio.shield(task)
+    
+    async def _refresh(self, name: str):
+        try:
+            value = await self._providers[name]['loader']()
+            if value is not None:
+                self._snapshots[name] = Snapshot(value)
+                logger.info(f"Снимок '{name}' обновлен")
+            else:
+                logger.warning(f"Не удалось обновить снимок '{name}', используется предыдущее значение")
+            return value
+        except Exception as e:
+            logger.error(f"Ошибка при обновлении снимка '{name}': {e}")
+            return None
+        finally:
+            self._refreshing.pop(name, None)
+    
+    async def refresh_job(self, context):
+        """Фоновая задача JobQueue: обновляет снимок, имя которого передано в job.data"""
+        await self.refresh(context.job.data)
@@ -0,0 +1,291 @@
+import contextvars
+import functools
+import inspect
+import json
+import os
+import queue
+import random
+import secrets
+import threading
+import time
+from contextlib import contextmanager
+import httpx
+from telegram.ext import SimpleUpdateProcessor
+from config import (
+    logger, TRACE_SAMPLE_RATE, TRACE_SLOW_THRESHOLD, TRACE_EXPORT_PATH,
+    TRACE_MAX_BYTES, TRACE_BACKUP_COUNT, TRACE_MAX_SPANS
+)
+
+# Трассировка включена, если сохраняется хотя бы часть трасс или медленные запросы
+TRACING_ENABLED = TRACE_SAMPLE_RATE > 0 or TRACE_SLOW_THRESHOLD > 0
+
+# Текущий спан задачи (дочерние спаны привязываются к нему)
+_current_span = contextvars.ContextVar('current_span', default=None)
+
+class _Trace:
+    """Спаны одного входящего обновления"""
+
+    def __init__(self, sampled: bool):
+        self.trace_id = secrets.token_hex(16)
+        self.sampled = sampled
+        self.spans = []
+        self.finished = False
+
+class Span:
+    __slots__ = ('trace', 'span_id', 'parent_id', 'name', 'attributes', 'start', '_started', 'duration', 'error')
+
+    def __init__(self, trace: _Trace, name: str, parent_id: str = None, attributes: dict = None):
+        self.trace = trace
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent_id
+        self.name = name
+        self.attributes = attributes or {}
+        self.start = time.time()
+        self._started = time.perf_counter()
+        self.duration = None
+        self.error = None
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def finish(self, duration: float = None):
+        self.duration = duration if duration is not None else time.perf_counter() - self._started
+        trace = self.trace
+        # Спаны, завершившиеся после корневого (фоновые задачи), не сохраняются
+        if not trace.finished and len(trace.spans) < TRACE_MAX_SPANS:
+            trace.spans.append(self)
+
+    def to_dict(self) -> dict:
+        data = {
+            'trace_id': self.trace.trace_id,
+            'span_id': self.span_id,
+            'parent_id': self.parent_id,
+            'name': self.name,
+            'start': round(self.start, 6),
+            'duration_ms': round(self.duration * 1000, 3),
+            'attributes': self.attributes,
+        }
+        if self.error:
+            data['error'] = self.error
+        return data
+
+class _NoopSpan:
+    """Заглушка вне трассы: вызовы set() ничего не делают"""
+
+    def set(self, **attributes):
+        pass
+
+_NOOP_SPAN = _NoopSpan()
+
+class JsonlExporter:
+    """
+    Дописывает спаны сохраненных трасс в файл, по строке JSON на спан.
+    Запись идет в отдельном потоке (цикл событий не блокируется); файл
+    ротируется по размеру: path -> path.1 -> ... -> path.<backup_count>.
+    """
+
+    def __init__(self, path: str, max_bytes: int, backup_count: int, queue_size: int = 1000):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._thread = None
+        self._file = None
+        self.exported = 0
+        self.dropped = 0
+
+    def export(self, spans: list):
+        """Передает трассу потоку записи (если очередь заполнена, трасса отбрасывается)"""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='trace-exporter', daemon=True)
+            self._thread.start()
+        try:
+            self._queue.put_nowait([s.to_dict() for s in spans])
+        except queue.Full:
+            self.dropped += 1
+
+    def close(self):
+        """Дописывает очередь и останавливает поток записи"""
+        if self._thread is None:
+            return
+        self._queue.put(None)
+        self._thread.join(timeout=5)
+        self._thread = None
+
+    def _run(self):
+        while True:
+            spans = self._queue.get()
+            if spans is None:
+                break
+            try:
+                self._write(''.join(json.dumps(s, ensure_ascii=False, default=str) + '\n' for s in spans))
+                self.exported += 1
+            except OSError as e:
+                logger.error(f"Не удалось записать трассу в {self.path}: {e}")
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def _write(self, data: str):
+        if self._file is None:
+            self._file = open(self.path, 'a', encoding='utf-8')
+        if self.max_bytes and self._file.tell() + len(data) > self.max_bytes and self._file.tell() > 0:
+            self._rotate()
+        self._file.write(data)
+        self._file.flush()
+
+    def _rotate(self):
+        self._file.close()
+        for i in range(self.backup_count - 1, 0, -1):
+            if os.path.exists(f"{self.path}.{i}"):
+                os.replace(f"{self.path}.{i}", f"{self.path}.{i + 1}")
+        if self.backup_count > 0:
+            os.replace(self.path, f"{self.path}.1")
+        else:
+            os.remove(self.path)
+        self._file = open(self.path, 'a', encoding='utf-8')
+
+exporter = JsonlExporter(TRACE_EXPORT_PATH, TRACE_MAX_BYTES, TRACE_BACKUP_COUNT)
+
+@contextmanager
+def root_span(name: str, **attributes):
+    """
+    Корневой спан трассы. Трасса сохраняется, если попала в выборку
+    (TRACE_SAMPLE_RATE) или длилась дольше TRACE_SLOW_THRESHOLD.
+    """
+    if not TRACING_ENABLED:
+        yield _NOOP_SPAN
+        return
+
+    trace = _Trace(random.random() < TRACE_SAMPLE_RATE)
+    span = Span(trace, name, None, attributes)
+    token = _current_span.set(span)
+    try:
+        yield span
+    except BaseException as e:
+        span.error = repr(e)
+        raise
+    finally:
+        _current_span.reset(token)
+        span.finish()
+        trace.finished = True
+        if trace.sampled or (TRACE_SLOW_THRESHOLD > 0 and span.duration >= TRACE_SLOW_THRESHOLD):
+            exporter.export(trace.spans)
+
+@contextmanager
+def span(name: str, **attributes):
+    """Дочерний спан текущей трассы (вне трассы ничего не записывает)"""
+    parent = _current_span.get()
+    if parent is None:
+        yield _NOOP_SPAN
+        return
+
+    child = Span(parent.trace, name, parent.span_id, attributes)
+    token = _current_span.set(child)
+    try:
+        yield child
+    except BaseException as e:
+        child.error = repr(e)
+        raise
+    finally:
+        _current_span.reset(token)
+        child.finish()
+
+def record_span(name: str, duration: float, **attributes):
+    """Добавляет уже завершенный спан (например, по данным логгера запросов asyncpg)"""
+    parent = _current_span.get()
+    if parent is None:
+        return
+    child = Span(parent.trace, name, parent.span_id, attributes)
+    child.start -= duration
+    child.finish(duration)
+
+def traced(name: str = None):
+    """Декоратор асинхронной функции или асинхронного генератора: вызов оборачивается в спан"""
+    def decorator(func):
+        span_name = name or func.__name__
+
+        if inspect.isasyncgenfunction(func):
+            @functools.wraps(func)
+            async def gen_wrapper(*args, **kwargs):
+                # Спан генератора не делаем текущим: контекст между yield принадлежит вызывающему
+                parent = _current_span.get()
+                child = Span(parent.trace, span_name, parent.span_id) if parent is not None else None
+                try:
+                    async for item in func(*args, **kwargs):
+                        yield item
+                except BaseException as e:
+                    if child is not None:
+                        child.error = repr(e)
+                    raise
+                finally:
+                    if child is not None:
+                        child.finish()
+            return gen_wrapper
+
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            with span(span_name):
+                return await func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def _update_attributes(update) -> dict:
+    """Описание обновления для корневого спана (без текста сообщений пользователей)"""
+    attributes = {'update_id': getattr(update, 'update_id', None)}
+    user = getattr(update, 'effective_user', None)
+    if user is not None:
+        attributes['user_id'] = user.id
+
+    message = getattr(update, 'message', None)
+    query = getattr(update, 'callback_query', None)
+    if query is not None:
+        attributes['kind'] = 'callback'
+        attributes['data'] = query.data
+    elif message is not None and message.text:
+        if message.text.startswith('/'):
+            attributes['kind'] = 'command'
+            attributes['command'] = message.text.split()[0]
+        else:
+            attributes['kind'] = 'text'
+    return attributes
+
+class TracingUpdateProcessor(SimpleUpdateProcessor):
+    """Обработчик очереди обновлений PTB, открывающий корневой спан на каждое обновление"""
+
+    async def do_process_update(self, update, coroutine) -> None:
+        with root_span('update', **_update_attributes(update)):
+            await coroutine
+
+def trace_handlers(application):
+    """Оборачивает зарегистрированные обработчики в спаны handler:<имя>"""
+    for handlers in application.handlers.values():
+        for handler in handlers:
+            callback = handler.callback
+            handler.callback = traced(f"handler:{callback.__name__}")(callback)
+
+class TracingTransport(httpx.AsyncBaseTransport):
+    """Транспорт httpx, открывающий спан на каждый запрос к провайдеру (включая ошибки соединения)"""
+
+    def __init__(self, transport: httpx.AsyncBaseTransport, provider: str):
+        self._transport = transport
+        self.provider = provider
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        with span('http', provider=self.provider, method=request.method,
+                  url=str(request.url.copy_with(query=None))) as current:
+            response = await self._transport.handle_async_request(request)
+            current.set(status=response.status_code)
+            return response
+
+    async def aclose(self) -> None:
+        await self._transport.aclose()
+
+def db_query_tracer(record):
+    """Обработчик asyncpg Connection.add_query_logger: спан на каждый запрос"""
+    from metrics import statement_label
+
+    attributes = {'statement': statement_label(record.query)}
+    if record.exception is not None:
+        attributes['error'] = repr(record.exception)
+    record_span('db', record.elapsed, **attributes)
@@ -1,5 +1,8 @@
+import html
 import logging
+import time
 from telegram import InlineKeyboardMarkup
+from telegram.error import BadRequest
 
 logger = logging.getLogger(__name__)
 
@@ -31,3 +34,87 @@ def create_back_button():
     """Создает кнопку 'Назад в меню'"""
     from telegram import InlineKeyboardButton
     return InlineKeyboardMarkup([[InlineKeyboardButton("🔙 Назад в меню", callback_data='back_to_main')]])
+
+def format_snapshot_age(age: float) -> str:
+    """Форматирует возраст данных для подписи в сообщении"""
+    if age is None:
+        return ""
+    
+    age = int(age)
+    if age < 60:
+        age_text = "только что"
+    elif age < 3600:
+        age_text = f"{age // 60} мин. назад"
+    else:
+        age_text = f"{age // 3600} ч. {age % 3600 // 60} мин. назад"
+    
+    return f"\n🕒 <i>Данные обновлены {age_text}</i>"
+
+class StreamingReply:
+    """
+    Ответ, который дописывается по мере поступления текста: одно сообщение
+    редактируется не чаще edit_interval, а при превышении лимита Telegram
+    текст переносится в новое сообщение.
+    """
+    
+    def __init__(self, message, header: str = "", edit_interval: float = 1.0, max_length: int = 4096):
+        self.message = message
+        self.edit_interval = edit_interval
+        self.max_length = max_length
+        self._prefix = header  # заголовок выводится только в первом сообщении
+        self._text = ""
+        self._current = None
+        self._rendered = None
+        self._last_edit = 0.0
+    
+    async def append(self, delta: str):
+        """Добавляет фрагмент текста (правка сообщения - с ограничением частоты)"""
+        self._text += html.escape(delta)
+        if self._current is None or time.monotonic() - self._last_edit >= self.edit_interval:
+            await self._flush()
+    
+    async def finish(self, reply_markup=None):
+        """Выводит оставшийся текст и добавляет клавиатуру к последнему сообщению"""
+        await self._flush(reply_markup)
+    
+    async def _flush(self, reply_markup=None):
+        # Переносим текст, не помещающийся в сообщение, в новые сообщения
+        while len(self._prefix) + len(self._text) > self.max_length:
+            split_pos = self._split_pos(self._text, self.max_length - len(self._prefix))
+            part, self._text = self._text[:split_pos], self._text[split_pos:]
+            await self._render(self._prefix + part)
+            self._prefix = ""
+            self._current = None
+            self._rendered = None
+        
+        await self._render(self._prefix + self._text, reply_markup)
+    
+    @staticmethod
+    def _split_pos(text: str, max_length: int) -> int:
+        split_pos = text.rfind('\n', 0, max_length)
+        if split_pos == -1:
+            split_pos = text.rfind(' ', 0, max_length)
+        if split_pos == -1:
+            split_pos = max_length - 1
+        
+        # Не разрываем HTML-сущность (&amp; и т.п.)
+        entity_start = text.rfind('&', 0, split_pos + 1)
+        if entity_start > text.rfind(';', 0, split_pos + 1):
+            split_pos = entity_start - 1
+        return max(split_pos + 1, 1)
+    
+    async def _render(self, text: str, reply_markup=None):
+        if not text.strip():
+            return
+        
+        if self._current is None:
+            self._current = await self.message.reply_text(text, parse_mode='HTML', reply_markup=reply_markup)
+        elif text != self._rendered or reply_markup is not None:
+            try:
+                await self._current.edit_text(text, parse_mode='HTML', reply_markup=reply_markup)
+            except BadRequest as e:
+                if 'not modified' not in str(e).lower():
+                    raise
+        
+        self._rendered = text
+        self._last_edit = time.monotonic()